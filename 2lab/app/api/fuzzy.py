@@ -7,6 +7,7 @@ from app.schemas.corpus import (
 from app.cruds import corpus as corpus_crud
 from app.services import fuzzy_algorithms
 from app.core.deps import get_db, get_current_user
+from app.core.responses import ORJSONResponse
 from app.models.user import User
 
 router = APIRouter()
@@ -24,8 +25,8 @@ def get_corpuses(
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
-    corpuses = corpus_crud.get_corpuses(db)
-    return {"corpuses": corpuses}
+    corpuses = corpus_crud.get_corpus_summaries(db)
+    return ORJSONResponse({"corpuses": corpuses})
 
 @router.post("/search_algorithm", response_model=SearchResponse)
 def search(
@@ -42,4 +43,4 @@ def search(
         corpus=corpus.text,
         algorithm=request.algorithm
     )
-    return result
+    return ORJSONResponse(result)
@@ -12,5 +12,9 @@ def create_corpus(db: Session, data: CorpusCreate):
 def get_corpuses(db: Session):
     return db.query(Corpus).all()
 
+def get_corpus_summaries(db: Session):
+    """id and name of every corpus, without loading the texts."""
+    return [{"id": row.id, "name": row.name} for row in db.query(Corpus.id, Corpus.name)]
+
 def get_corpus_by_id(db: Session, corpus_id: int):
     return db.query(Corpus).filter(Corpus.id == corpus_id).first()
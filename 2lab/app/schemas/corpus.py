@@ -10,7 +10,7 @@ class CorpusOut(BaseModel):
     name: str
 
     class Config:
-        ord_mode = True
+        from_attributes = True
 
 class CorpusListOut(BaseModel):
     corpuses: List[CorpusOut]
@@ -5,10 +5,12 @@ warnings.filterwarnings("ignore", category=UserWarning)
 
 import uvicorn
 from app.api import async_fuzzy, auth, fuzzy, ws
+from app.core.responses import add_compression
 from app.db.database import create_tables
 from fastapi import FastAPI
 
 app = FastAPI(title="Fuzzy Search API")
+add_compression(app)
 app.include_router(auth.router, prefix="/auth", tags=["auth"])
 app.include_router(fuzzy.router, prefix="/fuzzy", tags=["fuzzy"])
 app.include_router(ws.router)
@@ -0,0 +1,38 @@
+"""Track background index builds of corpora
+
+Revision ID: a2c6e9f04b18
+Revises: f3b8d21c6a47
+Create Date: 2025-06-10 15:05:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a2c6e9f04b18'
+down_revision: Union[str, None] = 'f3b8d21c6a47'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # строки заполняет первый запуск API: индексы, построенные раньше при загрузке, принимаются как есть
+    op.create_table('corpus_indexes',
+    sa.Column('corpus_id', sa.Integer(), nullable=False),
+    sa.Column('status', sa.String(), nullable=False),
+    sa.Column('kind', sa.String(), nullable=True),
+    sa.Column('version', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('updated_at', sa.Float(), nullable=False),
+    sa.Column('error', sa.Text(), nullable=True),
+    sa.ForeignKeyConstraint(['corpus_id'], ['corpuses.id'], ),
+    sa.PrimaryKeyConstraint('corpus_id')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('corpus_indexes')
@@ -0,0 +1,34 @@
+"""Add corpus owner
+
+Revision ID: c41e8b2d7f10
+Revises: a7d9f4cee2f3
+Create Date: 2025-05-20 10:12:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c41e8b2d7f10'
+down_revision: Union[str, None] = 'a7d9f4cee2f3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.batch_alter_table('corpuses') as batch_op:
+        batch_op.add_column(sa.Column('owner_id', sa.Integer(), nullable=True))
+        batch_op.create_index(batch_op.f('ix_corpuses_owner_id'), ['owner_id'], unique=False)
+        batch_op.create_foreign_key('fk_corpuses_owner_id_users', 'users', ['owner_id'], ['id'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('corpuses') as batch_op:
+        batch_op.drop_constraint('fk_corpuses_owner_id_users', type_='foreignkey')
+        batch_op.drop_index(batch_op.f('ix_corpuses_owner_id'))
+        batch_op.drop_column('owner_id')
@@ -0,0 +1,31 @@
+"""Record the token normalization a word index was built with
+
+Revision ID: c7d1e5a93f20
+Revises: a2c6e9f04b18
+Create Date: 2025-06-17 11:20:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c7d1e5a93f20'
+down_revision: Union[str, None] = 'a2c6e9f04b18'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # у существующих индексов words значение пустое: они построены по сырым словам и пересобираются при запуске API
+    with op.batch_alter_table('corpus_indexes') as batch_op:
+        batch_op.add_column(sa.Column('normalization', sa.String(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('corpus_indexes') as batch_op:
+        batch_op.drop_column('normalization')
@@ -0,0 +1,43 @@
+"""Add corpus version and appends
+
+Revision ID: e5a17c93b2d4
+Revises: c41e8b2d7f10
+Create Date: 2025-05-27 09:40:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e5a17c93b2d4'
+down_revision: Union[str, None] = 'c41e8b2d7f10'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.batch_alter_table('corpuses') as batch_op:
+        batch_op.add_column(sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+    op.create_table('corpus_appends',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('corpus_id', sa.Integer(), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.Column('text', sa.Text(), nullable=False),
+    sa.ForeignKeyConstraint(['corpus_id'], ['corpuses.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_corpus_appends_id'), 'corpus_appends', ['id'], unique=False)
+    op.create_index(op.f('ix_corpus_appends_corpus_id'), 'corpus_appends', ['corpus_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_corpus_appends_corpus_id'), table_name='corpus_appends')
+    op.drop_index(op.f('ix_corpus_appends_id'), table_name='corpus_appends')
+    op.drop_table('corpus_appends')
+    with op.batch_alter_table('corpuses') as batch_op:
+        batch_op.drop_column('version')
@@ -0,0 +1,117 @@
+"""Store corpus texts compressed in content-addressed blobs
+
+Revision ID: f3b8d21c6a47
+Revises: e5a17c93b2d4
+Create Date: 2025-06-03 11:20:00.000000
+
+"""
+import hashlib
+import zlib
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f3b8d21c6a47'
+down_revision: Union[str, None] = 'e5a17c93b2d4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# формат блобов на момент этой ревизии; миграция не зависит от app.services.corpus_blobs,
+# чтобы её результат не менялся вместе с кодом приложения
+BLOB_CODEC = "zlib"
+BLOB_LEVEL = 9
+
+
+def _content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _compress(data: bytes) -> bytes:
+    return zlib.compress(data, BLOB_LEVEL)
+
+
+def _decompress(data: bytes, codec: str) -> bytes:
+    # после апгрейда приложение могло записать блобы в zstd
+    if codec == "zstd":
+        import zstandard
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('corpus_blobs',
+    sa.Column('hash', sa.String(length=64), nullable=False),
+    sa.Column('codec', sa.String(), nullable=False),
+    sa.Column('length', sa.Integer(), nullable=False),
+    sa.Column('data', sa.LargeBinary(), nullable=False),
+    sa.Column('vocabulary_size', sa.Integer(), nullable=False),
+    sa.Column('vocabulary', sa.LargeBinary(), nullable=False),
+    sa.PrimaryKeyConstraint('hash')
+    )
+    with op.batch_alter_table('corpuses') as batch_op:
+        batch_op.add_column(sa.Column('blob_hash', sa.String(length=64), nullable=True))
+
+    # тексты переносятся по одному, чтобы не держать в памяти все корпуса сразу
+    conn = op.get_bind()
+    stored = set()
+    ids = [row.id for row in conn.execute(sa.text("SELECT id FROM corpuses"))]
+    for corpus_id in ids:
+        text = conn.execute(
+            sa.text("SELECT text FROM corpuses WHERE id = :id"), {"id": corpus_id}
+        ).scalar()
+        blob_hash = _content_hash(text)
+        if blob_hash not in stored:
+            words = set(text.split())
+            conn.execute(
+                sa.text(
+                    "INSERT INTO corpus_blobs (hash, codec, length, data, vocabulary_size, vocabulary) "
+                    "VALUES (:hash, :codec, :length, :data, :vocabulary_size, :vocabulary)"
+                ),
+                {
+                    "hash": blob_hash,
+                    "codec": BLOB_CODEC,
+                    "length": len(text),
+                    "data": _compress(text.encode("utf-8")),
+                    "vocabulary_size": len(words),
+                    "vocabulary": _compress("\n".join(sorted(words)).encode("utf-8")),
+                }
+            )
+            stored.add(blob_hash)
+        conn.execute(
+            sa.text("UPDATE corpuses SET blob_hash = :hash WHERE id = :id"),
+            {"hash": blob_hash, "id": corpus_id}
+        )
+
+    with op.batch_alter_table('corpuses') as batch_op:
+        batch_op.alter_column('blob_hash', existing_type=sa.String(length=64), nullable=False)
+        batch_op.create_index(batch_op.f('ix_corpuses_blob_hash'), ['blob_hash'], unique=False)
+        batch_op.create_foreign_key('fk_corpuses_blob_hash_corpus_blobs', 'corpus_blobs', ['blob_hash'], ['hash'])
+        batch_op.drop_column('text')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('corpuses') as batch_op:
+        batch_op.add_column(sa.Column('text', sa.Text(), nullable=True))
+
+    conn = op.get_bind()
+    hashes = [row.hash for row in conn.execute(sa.text("SELECT hash FROM corpus_blobs"))]
+    for blob_hash in hashes:
+        blob = conn.execute(
+            sa.text("SELECT codec, data FROM corpus_blobs WHERE hash = :hash"), {"hash": blob_hash}
+        ).first()
+        conn.execute(
+            sa.text("UPDATE corpuses SET text = :text WHERE blob_hash = :hash"),
+            {"text": _decompress(blob.data, blob.codec).decode("utf-8"), "hash": blob_hash}
+        )
+
+    with op.batch_alter_table('corpuses') as batch_op:
+        batch_op.alter_column('text', existing_type=sa.Text(), nullable=False)
+        batch_op.drop_constraint('fk_corpuses_blob_hash_corpus_blobs', type_='foreignkey')
+        batch_op.drop_index(batch_op.f('ix_corpuses_blob_hash'))
+        batch_op.drop_column('blob_hash')
+    op.drop_table('corpus_blobs')
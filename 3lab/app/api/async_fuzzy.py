@@ -1,32 +1,87 @@
+import time
 from fastapi import APIRouter, Depends
 from fastapi import HTTPException
 from sqlalchemy.orm import Session
+from app.core import tracing
 from app.schemas.corpus import SearchRequest
-from celery.result import AsyncResult
-from app.celery_worker import fuzzy_search_task
-from app.core.deps import get_db, get_current_user
+from app.core.deps import (
+    get_db, get_read_db, get_current_user, profiling_requested, resolve_search_corpora
+)
 from app.models.user import User
+from app.services.admission import Overloaded
+from app.services.search_tasks import (
+    cancel_search, get_celery_app, submit_multi_search, submit_search
+)
 
 router = APIRouter()
 
-@router.post("/async_search")
+@router.post(
+    "/async_search",
+    responses={429: {"description": "Over capacity, retry after the Retry-After seconds"}}
+)
 def start_search_task(
     request: SearchRequest,
-    current_user: User = Depends(get_current_user)
+    db: Session = Depends(get_read_db),
+    current_user: User = Depends(get_current_user),
+    profile: bool = Depends(profiling_requested)
 ):
-    task = fuzzy_search_task.delay(request.word, request.algorithm, request.corpus_id)
-    return {"task_id": task.id}
+    submitter = submitter_of(current_user)
+    try:
+        if request.corpus_ids is not None:
+            corpus_ids = resolve_search_corpora(db, request.corpus_ids, current_user)
+            with tracing.span("submit", stage="submit", corpora=len(corpus_ids)):
+                submission = submit_multi_search(
+                    get_celery_app(), request.word, request.algorithm, corpus_ids,
+                    priority=request.priority, submitter=submitter, user=submitter,
+                    **request.search_params()
+                )
+            # поиск по нескольким корпусам не профилируется
+            return {"task_id": submission.task_id, "coalesced": submission.coalesced, "profile_id": None}
+
+        with tracing.span("submit", stage="submit", corpus_id=request.corpus_id):
+            submission = submit_search(
+                get_celery_app(), request.word, request.algorithm, request.corpus_id,
+                priority=request.priority, profile=profile, submitter=submitter, user=submitter,
+                **request.search_params()
+            )
+    except Overloaded as e:
+        raise HTTPException(
+            status_code=429, detail=e.reason, headers={"Retry-After": str(e.retry_after)}
+        )
+    # профиль снимает воркер, и только он знает, сохранён ли он: profile_id — в /task_status
+    return {"task_id": submission.task_id, "coalesced": submission.coalesced, "profile_id": None}
+
+@router.post("/cancel_task")
+def cancel_task(task_id: str, current_user: User = Depends(get_current_user)):
+    """
+    Cancel a search started through /async_search. A search shared with other
+    identical requests keeps running until all of its submitters cancel it.
+    """
+    try:
+        cancelled = cancel_search(get_celery_app(), task_id, submitter_of(current_user))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to cancel task: {str(e)}")
+    return {"task_id": task_id, "cancelled": cancelled}
+
+def submitter_of(user: User) -> str:
+    return f"user:{user.id}"
 
 @router.get("/task_status")
 def get_task_status(task_id: str, current_user: User = Depends(get_current_user)):
+    started = time.perf_counter()
     try:
-        result = AsyncResult(task_id)
-        status = result.status  # тут может упасть, если backend не работает
+        with tracing.span("result_fetch", task_id=task_id):
+            result = get_celery_app().AsyncResult(task_id)
+            status = result.status  # тут может упасть, если backend не работает
+            value = result.result if result.ready() else None
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to fetch task status: {str(e)}")
 
+    if isinstance(value, dict) and "stages" in value:
+        # этапы воркера плюс чтение результата из backend этим запросом
+        value["stages"] = {**value["stages"], "result_fetch": round(time.perf_counter() - started, 4)}
     return {
         "status": status,
         "progress": 100 if result.successful() else 0,
-        "result": result.result if result.ready() else None
+        "result": value
     }
@@ -1,13 +1,22 @@
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException, status
+import asyncio
+from typing import Callable, List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-from app.db.database import SessionLocal
 from app.schemas.corpus import (
-    CorpusCreate, CorpusOut, CorpusListOut, SearchRequest, SearchResponse
+    AutocompleteResponse, CorpusAppendIn, CorpusCreate, CorpusIndexOut, CorpusOut, CorpusListOut,
+    CorpusVersionOut, SearchRequest, SearchResponse
 )
 from app.cruds import corpus as corpus_crud
-from app.services import fuzzy_algorithms
-from app.core.deps import get_db, get_current_user
+from app.services import autocomplete, fuzzy_algorithms, index_builds, normalization
+from app.services.corpus_cache import cache as corpus_cache
+from app.core import memory, profiling, tracing
+from app.core.responses import ORJSONResponse
+from app.core.deps import (
+    get_db, get_read_db, get_current_user, is_admin, profiling_requested,
+    resolve_search_corpora
+)
+from app.db.database import ReadSessionLocal
 from app.models.user import User
 
 router = APIRouter()
@@ -19,17 +28,151 @@ router = APIRouter()
     summary="Upload new corpus",
     description="Upload a new text corpus for fuzzy search"
 )
-async def upload_corpus(
+def upload_corpus(
     data: CorpusCreate,
+    response: Response,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_user),
+    profile: bool = Depends(profiling_requested)
 ) -> CorpusOut:
     """
     Upload a new corpus with the following information:
     - **name**: unique name for the corpus
     - **text**: text content of the corpus
+
+    The word index of a large corpus is built in the background, see
+    `GET /corpuses/{corpus_id}/index`; searches scan the vocabulary until it is ready.
+    """
+    # сжатие текста и запись ждут блокировку SQLite, поэтому обработчик синхронный и идёт в пуле потоков
+    with profiling.profile(profile) as handle:
+        corpus = corpus_crud.create_corpus(db, data, owner_id=current_user.id)
+    index_builds.schedule(db, corpus.id)
+    if handle.profile_id:
+        response.headers["X-Profile-Id"] = handle.profile_id
+    return corpus
+
+@router.post(
+    "/corpuses/{corpus_id}/append",
+    response_model=CorpusVersionOut,
+    summary="Append text to a corpus",
+    description="Add text to an existing corpus without re-uploading it"
+)
+def append_corpus(
+    corpus_id: int,
+    data: CorpusAppendIn,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+) -> CorpusVersionOut:
     """
-    return corpus_crud.create_corpus(db, data)
+    Append text to a corpus owned by the current user (admins may append to any):
+    - **text**: text to add; only its new words reach the vocabulary and the word index
+
+    Returns the new version of the corpus.
+    """
+    info = corpus_crud.get_corpus_info(db, corpus_id)
+    if info is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Corpus not found"
+        )
+    if info.owner_id != current_user.id and not is_admin(current_user):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Only the owner of the corpus can append to it"
+        )
+
+    version = corpus_crud.append_corpus(db, corpus_id, data.text)
+    if corpus_id in corpus_cache:
+        # кэш этого процесса догоняет версию сразу, остальные - при следующей сверке
+        corpus_cache.get(corpus_id, db, fresh=True)
+    if corpus_id in autocomplete.cache:
+        autocomplete.cache.get(corpus_id, db, fresh=True)
+    return CorpusVersionOut(id=info.id, name=info.name, version=version)
+
+@router.get(
+    "/corpuses/{corpus_id}/index",
+    response_model=CorpusIndexOut,
+    summary="Corpus index status",
+    description="Whether the search index of a corpus is building, ready or stale"
+)
+def get_corpus_index(
+    corpus_id: int,
+    db: Session = Depends(get_read_db),
+    current_user: User = Depends(get_current_user)
+) -> CorpusIndexOut:
+    """
+    State of the background index build of a corpus:
+    - **status**: building, ready, or stale (never built, failed or behind the corpus version)
+    - **kind**: words for an FTS5 word index, vocabulary for corpora too small to need one
+    - **version** / **indexed_version**: corpus version and the version the index covers
+    """
+    state = index_builds.status(db, corpus_id)
+    if state is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Corpus not found"
+        )
+    return CorpusIndexOut(**state)
+
+@router.post(
+    "/corpuses/{corpus_id}/index",
+    response_model=CorpusIndexOut,
+    status_code=status.HTTP_202_ACCEPTED,
+    summary="Rebuild a stale corpus index",
+    description="Queue a background build of a corpus index that is stale"
+)
+def build_corpus_index(
+    corpus_id: int,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+) -> CorpusIndexOut:
+    """
+    Queue an index build for a corpus owned by the current user (admins may
+    build any). A ready or building index is left alone; returns the state after the call.
+    """
+    info = corpus_crud.get_corpus_info(db, corpus_id)
+    if info is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Corpus not found"
+        )
+    if info.owner_id != current_user.id and not is_admin(current_user):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Only the owner of the corpus can rebuild its index"
+        )
+    return CorpusIndexOut(**index_builds.schedule(db, corpus_id))
+
+@router.get(
+    "/corpuses/{corpus_id}/autocomplete",
+    response_model=AutocompleteResponse,
+    summary="Autocomplete a prefix",
+    description="Type-ahead suggestions from the vocabulary of a corpus"
+)
+def autocomplete_prefix(
+    corpus_id: int,
+    prefix: str = Query(..., min_length=1),
+    limit: int = Query(10, ge=1, le=autocomplete.AUTOCOMPLETE_MAX_LIMIT),
+    max_distance: int = Query(0, ge=0),
+    db: Session = Depends(get_read_db),
+    current_user: User = Depends(get_current_user)
+) -> ORJSONResponse:
+    """
+    Words of the corpus that start with `prefix`, shortest first:
+    - **max_distance**: typos allowed in the prefix (fuzzy-prefix search); capped by
+      AUTOCOMPLETE_MAX_DISTANCE and a third of the prefix length, the applied value is returned
+    - **limit**: number of suggestions, ranked by distance, then length
+
+    The trie of a corpus is loaded on first use and kept in an LRU cache of
+    AUTOCOMPLETE_CACHE_SIZE corpora per process.
+    """
+    result = autocomplete.suggest(corpus_id, prefix, limit, max_distance, db)
+    if result is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Corpus not found"
+        )
+    return ORJSONResponse(result)
 
 @router.get(
     "/corpuses",
@@ -37,15 +180,21 @@ async def upload_corpus(
     summary="Get all corpuses",
     description="Get a list of all available text corpuses"
 )
-async def get_corpuses(
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
-) -> CorpusListOut:
+def get_corpuses(
+    db: Session = Depends(get_read_db),
+    current_user: User = Depends(get_current_user),
+    profile: bool = Depends(profiling_requested)
+) -> ORJSONResponse:
     """
     Retrieve all available text corpuses.
     """
-    corpuses = corpus_crud.get_corpuses(db)
-    return CorpusListOut(corpuses=corpuses)
+    with profiling.profile(profile) as handle:
+        corpuses = corpus_crud.get_corpus_summaries(db)
+    # строки уже в форме CorpusOut, повторная валидация response_model не нужна
+    response = ORJSONResponse({"corpuses": corpuses})
+    if handle.profile_id:
+        response.headers["X-Profile-Id"] = handle.profile_id
+    return response
 
 @router.post(
     "/search_algorithm",
@@ -55,24 +204,145 @@ async def get_corpuses(
 )
 async def search(
     request: SearchRequest,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
-) -> SearchResponse:
+    db: Session = Depends(get_read_db),
+    current_user: User = Depends(get_current_user),
+    profile: bool = Depends(profiling_requested)
+) -> ORJSONResponse:
     """
     Perform fuzzy search with the following parameters:
     - **word**: word to search for
     - **algorithm**: fuzzy search algorithm (levenshtein/ngram)
     - **corpus_id**: ID of the corpus to search in
+    - **corpus_ids**: several corpus IDs or "mine", instead of corpus_id;
+      results are merged into one top list tagged with corpus_id
+    - **max_errors**: edits allowed by the bitap algorithm, which matches the
+      word (or a phrase) inside the raw text and returns start/end offsets
+
+    With SEARCH_MEMORY_TRACKING the response has the peak memory of the
+    process during the search, concurrent requests included;
+    SEARCH_MEMORY_LIMIT_MB is enforced by the Celery tasks only.
     """
-    corpus = corpus_crud.get_corpus_by_id(db, request.corpus_id)
-    if not corpus:
+    if request.corpus_ids is not None:
+        corpus_ids = resolve_search_corpora(db, request.corpus_ids, current_user)
+        with memory.track() as tracker:
+            if profile:
+                # cProfile видит только свой поток, поэтому профилируемый поиск идёт по корпусам подряд
+                per_corpus, profile_id = await run_in_threadpool(
+                    profiling.run_profiled, True, search_corpora, corpus_ids, request.word,
+                    request.algorithm, request.max_errors, tracker.guard()
+                )
+            else:
+                # корпуса считаются параллельно в пуле потоков, у каждого своя сессия
+                profile_id = None
+                per_corpus = await asyncio.gather(*(
+                    run_in_threadpool(
+                        search_corpus, corpus_id, request.word, request.algorithm, request.max_errors,
+                        tracker.guard()
+                    )
+                    for corpus_id in corpus_ids
+                ))
+            result = fuzzy_algorithms.merge_results(dict(zip(corpus_ids, per_corpus)))
+        result["profile_id"] = profile_id
+        result["stages"] = tracing.stages(result.get("stages"))
+        return search_response(result, tracker)
+
+    if request.algorithm in fuzzy_algorithms.TEXT_ALGORITHMS:
+        with memory.track() as tracker:
+            # проход по всему тексту корпуса, поэтому вне цикла событий; профиль снимается в том же потоке
+            result, profile_id = await run_in_threadpool(
+                profiling.run_profiled, profile, search_corpus_text, db, request.corpus_id,
+                request.word, request.max_errors, tracker.guard()
+            )
+        if result is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Corpus not found"
+            )
+        result["profile_id"] = profile_id
+        result["stages"] = tracing.stages()
+        return search_response(result, tracker)
+
+    with memory.track() as tracker:
+        # загрузка корпуса не из кэша и подсчёт блокируют, поэтому вне цикла событий
+        result, profile_id = await run_in_threadpool(
+            profiling.run_profiled, profile, search_corpus_words, db, request.corpus_id,
+            request.word, request.algorithm, tracker.guard()
+        )
+    if result is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Corpus not found"
         )
+    result["profile_id"] = profile_id
+    result["stages"] = tracing.stages()
+    return search_response(result, tracker)
+
+def search_response(result: dict, tracker: memory.MemoryTracker) -> ORJSONResponse:
+    if tracker.usage is not None:
+        result["memory"] = tracker.usage
+    return ORJSONResponse(result)
+
+def search_corpus(
+    corpus_id: int, word: str, algorithm: str, max_errors: Optional[int] = None,
+    check: Optional[Callable[[], None]] = None
+) -> dict:
+    """Search one corpus with its own database session and stage timings; safe to run in a thread."""
+    with tracing.collect_stages(), tracing.span("search_corpus", corpus_id=corpus_id):
+        if algorithm in fuzzy_algorithms.TEXT_ALGORITHMS:
+            db = ReadSessionLocal()
+            try:
+                result = search_corpus_text(db, corpus_id, word, max_errors, check)
+            finally:
+                db.close()
+            if result is None:
+                return {"error": "Corpus not found"}
+        else:
+            with tracing.span("corpus_load", stage="corpus_load", corpus_id=corpus_id):
+                corpus = corpus_cache.get(corpus_id)
+            if corpus is None:
+                return {"error": "Corpus not found"}
+            result = score_words(corpus, word, algorithm, check=check)
+        result["stages"] = tracing.stages()
+        return result
+
+def search_corpora(
+    corpus_ids: List[int], word: str, algorithm: str, max_errors: Optional[int] = None,
+    check: Optional[Callable[[], None]] = None
+) -> List[dict]:
+    """search_corpus for each corpus in turn, in the calling thread."""
+    return [search_corpus(corpus_id, word, algorithm, max_errors, check) for corpus_id in corpus_ids]
+
+def search_corpus_words(
+    db: Session, corpus_id: int, word: str, algorithm: str,
+    check: Optional[Callable[[], None]] = None
+) -> Optional[dict]:
+    """Score the words of a corpus loaded through the cache; None if there is no such corpus."""
+    with tracing.span("corpus_load", stage="corpus_load", corpus_id=corpus_id):
+        corpus = corpus_cache.get(corpus_id, db)
+    if not corpus:
+        return None
+    return score_words(corpus, word, algorithm, db, check)
+
+def score_words(
+    corpus, word: str, algorithm: str, db: Optional[Session] = None,
+    check: Optional[Callable[[], None]] = None
+) -> dict:
+    """Score the candidate words of a cached corpus against `word`, normalized like the corpus."""
+    word = normalization.normalize_query(word)
+    with tracing.span("candidates", stage="candidates", indexed=corpus.words is None):
+        words = corpus.candidates(word, db)
+    with tracing.span("scoring", stage="scoring", words=len(words)):
+        result = fuzzy_algorithms.search_words(word=word, words=words, algorithm=algorithm, check=check)
+    corpus.attach_forms(result["results"], db)
+    return result
 
-    return fuzzy_algorithms.search(
-        word=request.word,
-        corpus=corpus.text,
-        algorithm=request.algorithm
-    )
+def search_corpus_text(
+    db: Session, corpus_id: int, word: str, max_errors: Optional[int],
+    check: Optional[Callable[[], None]] = None
+) -> Optional[dict]:
+    """Bitap search over the raw text of a corpus; None if there is no such corpus."""
+    chunks = corpus_crud.iter_corpus_text(db, corpus_id)
+    if chunks is None:
+        return None
+    with tracing.span("scan", stage="scan", corpus_id=corpus_id):
+        return fuzzy_algorithms.search_text(word, chunks, max_errors, check=check)
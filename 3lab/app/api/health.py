@@ -0,0 +1,31 @@
+import os
+import time
+from typing import Any, Dict
+
+from fastapi import APIRouter
+
+from app import server
+from app.services.corpus_cache import cache as corpus_cache
+
+router = APIRouter()
+
+@router.get(
+    "/health",
+    summary="Worker health",
+    description="State of the worker that served the request and, under the launcher, of all workers"
+)
+def health() -> Dict[str, Any]:
+    """
+    Liveness report of this worker process:
+    - **worker**: index of the worker (null when running without the launcher)
+    - **corpora_cached**: corpus vocabularies held in this process
+    - **launcher**: per-worker pids, generations and readiness, written by the launcher
+    """
+    return {
+        "status": "ok",
+        "pid": os.getpid(),
+        "worker": server.worker_index,
+        "uptime": round(time.time() - server.worker_started, 1),
+        "corpora_cached": len(corpus_cache),
+        "launcher": server.read_state(),
+    }
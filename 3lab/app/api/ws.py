@@ -1,68 +1,339 @@
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional, Set, Tuple, Union
+import asyncio
 import os
 import json
 import logging
+import time
+import uuid
+from dataclasses import asdict, dataclass
 from fastapi import WebSocket, WebSocketDisconnect, APIRouter, Query, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
 from jose import jwt, JWTError
-from celery.result import AsyncResult
+from celery import states
+from pydantic import ValidationError
 
-from app.celery_worker import celery_app
+from app.core import tracing
+from app.core.deps import is_admin
+from app.core.serialization import frame_size, negotiate_ws_subprotocol, ws_codec
+from app.cruds import corpus as corpus_crud
+from app.db.database import ReadSessionLocal, SessionLocal
+from app.models.user import User
+from app.schemas.corpus import SearchRequest
+from app.services import autocomplete
+from app.services.admission import Overloaded
+from app.services.search_tasks import (
+    add_submitter, cancel_search, cancel_searches, fetch_task_metas, get_celery_app,
+    submit_multi_search, submit_search
+)
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
+# How often subscribed tasks are polled, seconds
+WS_POLL_INTERVAL = float(os.getenv("WS_POLL_INTERVAL", "0.5"))
+# Passed to uvicorn by main.start_server
+WS_PER_MESSAGE_DEFLATE = os.getenv("WS_PER_MESSAGE_DEFLATE", "true").lower() in ("1", "true", "yes")
+# Сколько секунд после отключения ждать переподключения, прежде чем отменить задачи соединения
+WS_CANCEL_GRACE = float(os.getenv("WS_CANCEL_GRACE", "5"))
+
+@dataclass
+class ConnectionStats:
+    """Per-connection traffic and serialization cost (frame payloads, before deflate)."""
+    messages_in: int = 0
+    messages_out: int = 0
+    bytes_in: int = 0
+    bytes_out: int = 0
+    decode_seconds: float = 0.0
+    encode_seconds: float = 0.0
+
 class WebSocketManager:
-    def __init__(self, websocket: WebSocket, user_id: int):
+    def __init__(
+        self, websocket: WebSocket, user_id: int, admin: bool = False,
+        subprotocol: Optional[str] = None
+    ):
         self.websocket = websocket
         self.user_id = user_id
-        self.celery = celery_app
+        self.admin = admin
+        self.celery = get_celery_app()
+        self.subprotocol = subprotocol
+        self.codec = ws_codec(subprotocol)
+        self.stats = ConnectionStats()
+        # task_id -> (status, progress) last pushed to the client
+        self.subscriptions: Dict[str, Optional[Tuple[str, Any]]] = {}
+        self._poller: Optional[asyncio.Task] = None
+        self._send_lock = asyncio.Lock()
+        # задачи, отправленные этим соединением или подписанные им: отменяются, если клиент отключился
+        self.submitter = f"ws:{uuid.uuid4().hex}"
+        # владелец задач для admission control и повторной подписки
+        self.user = f"user:{user_id}"
+        self.submitted: Set[str] = set()
+
+    async def send_json(self, message: Dict[str, Any]) -> None:
+        """Send one message in the negotiated format; the poller sends concurrently."""
+        started = time.perf_counter()
+        data = self.codec.encode(message)
+        self.stats.encode_seconds += time.perf_counter() - started
+        self.stats.messages_out += 1
+        self.stats.bytes_out += frame_size(data)
+        async with self._send_lock:
+            if self.codec.binary:
+                await self.websocket.send_bytes(data)
+            else:
+                await self.websocket.send_text(data)
+
+    async def receive_message(self) -> Any:
+        """Receive and decode one frame: text frames are JSON, binary ones msgpack."""
+        message = await self.websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            raise WebSocketDisconnect(message.get("code", 1000))
+        data: Union[str, bytes, None] = message.get("text")
+        if data is None:
+            data = message.get("bytes") or b""
+        self.stats.messages_in += 1
+        self.stats.bytes_in += frame_size(data)
+        started = time.perf_counter()
+        try:
+            return self.codec.decode(data) if isinstance(data, bytes) else json.loads(data)
+        finally:
+            self.stats.decode_seconds += time.perf_counter() - started
+
+    def stats_report(self) -> Dict[str, Any]:
+        report = asdict(self.stats)
+        report["format"] = self.subprotocol or "json"
+        report["compression"] = self.compression
+        return report
+
+    @property
+    def compression(self) -> Optional[str]:
+        """permessage-deflate is negotiated by the server when the client offers it."""
+        headers = dict(self.websocket.scope.get("headers", []))
+        offered = headers.get(b"sec-websocket-extensions", b"")
+        if WS_PER_MESSAGE_DEFLATE and b"permessage-deflate" in offered:
+            return "permessage-deflate"
+        return None
 
     async def handle_task_status(self, task_id: str) -> None:
         """Handle task status check request."""
-        result = self.celery.AsyncResult(task_id)
+        with tracing.span("WS task_status", task_id=task_id) as current:
+            metas = await run_in_threadpool(fetch_task_metas, self.celery, [task_id])
+            await self.send_meta(task_id, metas[0], time.time() - current.start)
 
-        if result.successful():
-            await self.send_success_response(task_id, result)
-        elif result.state == "PROGRESS":
-            await self.send_progress_response(task_id, result)
-        else:
-            await self.send_status_response(task_id, result.state)
+    async def watch(self, task_id: str) -> None:
+        """
+        Subscribe on behalf of the client. A task of this user (e.g. after a
+        reconnect) is kept alive while connected; on a task of another user
+        the subscription only reads its state.
+        """
+        if task_id not in self.submitted:
+            added = await run_in_threadpool(
+                add_submitter, self.celery, task_id, self.submitter, self.user
+            )
+            if added:
+                self.submitted.add(task_id)
+        self.subscribe(task_id)
 
-    async def handle_search_request(self, data: Dict[str, Any]) -> None:
-        """Handle new search request."""
-        word = data.get("word")
-        algorithm = data.get("algorithm")
+    def subscribe(self, task_id: str) -> None:
+        """Push status updates of the task until it is finished."""
+        self.subscriptions.setdefault(task_id, None)
+        if self._poller is None or self._poller.done():
+            self._poller = asyncio.create_task(self.push_updates())
+
+    def unsubscribe(self, task_id: str) -> None:
+        self.subscriptions.pop(task_id, None)
+
+    async def push_updates(self) -> None:
+        """Poll all subscribed tasks in one batch and push changes."""
+        while self.subscriptions:
+            task_ids = list(self.subscriptions)
+            started = time.perf_counter()
+            try:
+                metas = await run_in_threadpool(fetch_task_metas, self.celery, task_ids)
+            except Exception as e:
+                # бэкенд недоступен: подписки сохраняются, опрос повторится
+                logger.warning(f"Failed to poll {len(task_ids)} subscribed tasks: {e}")
+                metas = []
+            fetch_time = time.perf_counter() - started
+            for task_id, meta in zip(task_ids, metas):
+                if task_id not in self.subscriptions:
+                    continue
+                info = meta.get("result")
+                progress = info.get("progress") if isinstance(info, dict) else None
+                marker = (meta["status"], progress)
+                if marker != self.subscriptions[task_id]:
+                    try:
+                        await self.send_meta(task_id, meta, fetch_time)
+                    except Exception as e:
+                        # состояние не отправлено: попробуем снова на следующем круге
+                        logger.warning(f"Failed to push the state of task {task_id}: {e}")
+                        continue
+                    self.subscriptions[task_id] = marker
+                if meta["status"] in states.READY_STATES:
+                    self.subscriptions.pop(task_id, None)
+                    self.submitted.discard(task_id)
+            await asyncio.sleep(WS_POLL_INTERVAL)
+
+    async def handle_cancel(self, task_id: str) -> None:
+        """Cancel a search submitted over this connection."""
+        cancelled = await run_in_threadpool(cancel_search, self.celery, task_id, self.submitter)
+        self.submitted.discard(task_id)
+        self.unsubscribe(task_id)
+        await self.send_json({"task_id": task_id, "cancelled": cancelled})
+
+    async def close(self) -> None:
+        self.subscriptions.clear()
+        if self._poller is not None:
+            self._poller.cancel()
+        if self.submitted:
+            # клиент мог переподключиться и заново подписаться на свои задачи, тогда они
+            # не отменятся; иначе воркер освободится через cancel_check_interval
+            task_ids, self.submitted = list(self.submitted), set()
+            try:
+                await asyncio.sleep(WS_CANCEL_GRACE)
+                cancelled = await run_in_threadpool(
+                    cancel_searches, self.celery, task_ids, self.submitter
+                )
+                logger.info(f"Cancelled {cancelled} of {len(task_ids)} searches of a closed connection")
+            except Exception as e:
+                logger.warning(f"Failed to cancel searches of a closed connection: {e}")
+
+    async def handle_autocomplete(self, data: Dict[str, Any]) -> None:
+        """Answer a type-ahead message right away, without a Celery task."""
+        prefix = data.get("autocomplete")
         corpus_id = data.get("corpus_id")
+        limit = data.get("limit", 10)
+        max_distance = data.get("max_distance", 0)
+        request_id = data.get("request_id")
+        if not (
+            isinstance(prefix, str) and prefix and isinstance(corpus_id, int)
+            and isinstance(limit, int) and 1 <= limit <= autocomplete.AUTOCOMPLETE_MAX_LIMIT
+            and isinstance(max_distance, int) and max_distance >= 0
+        ):
+            await self.send_error("Invalid autocomplete format", request_id)
+            return
 
-        if not all(isinstance(x, str) for x in [word, algorithm]) or not isinstance(corpus_id, int):
-            await self.send_error("Invalid search task format")
+        with tracing.span("WS autocomplete", corpus_id=corpus_id):
+            # первое обращение к корпусу загружает его словарь
+            result = await run_in_threadpool(
+                autocomplete.suggest, corpus_id, prefix, limit, max_distance
+            )
+        if result is None:
+            await self.send_error("Corpus not found", request_id)
             return
+        # префикс уже в поле autocomplete, как в запросе
+        result.pop("prefix")
+        message = {"autocomplete": prefix, "corpus_id": corpus_id, **result}
+        if request_id is not None:
+            message["request_id"] = request_id
+        await self.send_json(message)
 
-        task = self.celery.send_task(
-            "fuzzy_search_task",
-            args=[word, algorithm, corpus_id]
-        )
+    async def handle_search_request(self, data: Dict[str, Any]) -> None:
+        """Handle new search request in a span of its own; the worker continues the trace."""
+        with tracing.span("WS search", user_id=self.user_id):
+            await self._handle_search_request(data)
+
+    async def _handle_search_request(self, data: Dict[str, Any]) -> None:
+        request_id = data.get("request_id")
+        # те же правила, что и у HTTP-поиска; request_id, subscribe и profile модель пропускает
+        try:
+            request = SearchRequest.model_validate(data)
+        except ValidationError as e:
+            await self.send_error(
+                "Invalid search task format", request_id,
+                detail=e.errors(include_url=False, include_context=False, include_input=False)
+            )
+            return
+        word, algorithm = request.word, request.algorithm
+        corpus_id, corpus_ids = request.corpus_id, request.corpus_ids
+        priority = request.priority
+        params = request.search_params()
+
+        profile = bool(data.get("profile"))
+        if profile and not self.admin:
+            await self.send_error("Profiling is available to administrators only", request_id)
+            return
 
-        await self.websocket.send_json({
+        if corpus_ids is not None:
+            found, missing = await run_in_threadpool(resolve_corpora, corpus_ids, self.user_id)
+            if missing or not found:
+                await self.send_error(
+                    f"Corpus not found: {missing}" if missing else "No corpora to search",
+                    request_id
+                )
+                return
+        try:
+            with tracing.span("submit"):
+                if corpus_ids is not None:
+                    submission = await run_in_threadpool(
+                        submit_multi_search, self.celery, word, algorithm, found,
+                        priority=priority, submitter=self.submitter, user=self.user, **params
+                    )
+                else:
+                    submission = await run_in_threadpool(
+                        submit_search, self.celery, word, algorithm, corpus_id,
+                        priority=priority, profile=profile, submitter=self.submitter, user=self.user, **params
+                    )
+        except Overloaded as e:
+            await self.send_error(e.reason, request_id, retry_after=e.retry_after)
+            return
+
+        self.submitted.add(submission.task_id)
+        message = {
             "status": "STARTED",
-            "task_id": task.id,
+            "task_id": submission.task_id,
+            "coalesced": submission.coalesced,
             "word": word,
             "algorithm": algorithm
-        })
+        }
+        if request_id is not None:
+            message["request_id"] = request_id
+        await self.send_json(message)
+
+        if data.get("subscribe"):
+            self.subscribe(submission.task_id)
 
-    async def send_success_response(self, task_id: str, result: AsyncResult) -> None:
+    async def send_meta(self, task_id: str, meta: Dict[str, Any], fetch_time: Optional[float] = None) -> None:
+        """Send the response matching a task state; `fetch_time` is how long reading it took."""
+        if meta["status"] == states.SUCCESS:
+            await self.send_success_response(task_id, meta["result"] or {}, fetch_time)
+        elif meta["status"] == "PROGRESS":
+            await self.send_progress_response(task_id, meta["result"] or {})
+        elif meta["status"] in states.EXCEPTION_STATES:
+            await self.send_json({
+                "status": meta["status"],
+                "task_id": task_id,
+                "error": str(meta["result"])
+            })
+        else:
+            await self.send_status_response(task_id, meta["status"])
+
+    async def send_success_response(
+        self, task_id: str, result: Dict[str, Any], fetch_time: Optional[float] = None
+    ) -> None:
         """Send successful task completion response."""
-        await self.websocket.send_json({
+        message = {
             "status": "COMPLETED",
             "task_id": task_id,
-            "execution_time": result.result.get("execution_time"),
-            "results": result.result.get("results")
-        })
+            "execution_time": result.get("execution_time"),
+            "results": result.get("results"),
+            "profile_id": result.get("profile_id")
+        }
+        if "stages" in result:
+            message["stages"] = dict(result["stages"])
+            if fetch_time is not None:
+                message["stages"]["result_fetch"] = round(fetch_time, 4)
+        if "memory" in result:
+            message["memory"] = result["memory"]
+        if "error" in result:
+            message["error"] = result["error"]
+        if "missing" in result:
+            message["missing"] = result["missing"]
+        if "errors" in result:
+            message["errors"] = result["errors"]
+        await self.send_json(message)
 
-    async def send_progress_response(self, task_id: str, result: AsyncResult) -> None:
+    async def send_progress_response(self, task_id: str, info: Dict[str, Any]) -> None:
         """Send task progress response."""
-        info = result.info or {}
-        await self.websocket.send_json({
+        await self.send_json({
             "status": "PROGRESS",
             "task_id": task_id,
             "progress": info.get("progress", 0),
@@ -71,14 +342,17 @@ class WebSocketManager:
 
     async def send_status_response(self, task_id: str, state: str) -> None:
         """Send task status response."""
-        await self.websocket.send_json({
+        await self.send_json({
             "status": state,
             "task_id": task_id
         })
 
-    async def send_error(self, message: str) -> None:
+    async def send_error(self, message: str, request_id: Any = None, **extra: Any) -> None:
         """Send error message."""
-        await self.websocket.send_json({"error": message})
+        error = {"error": message, **extra}
+        if request_id is not None:
+            error["request_id"] = request_id
+        await self.send_json(error)
 
 def verify_token(token: str) -> Optional[int]:
     """Verify JWT token and return user_id."""
@@ -92,6 +366,23 @@ def verify_token(token: str) -> Optional[int]:
     except (JWTError, ValueError):
         return None
 
+def resolve_corpora(corpus_ids, user_id: int) -> Tuple[List[int], List[int]]:
+    """Expand the corpora of a multi-corpus search message, see corpus_crud.resolve_corpus_ids."""
+    db = ReadSessionLocal()
+    try:
+        return corpus_crud.resolve_corpus_ids(db, corpus_ids, user_id)
+    finally:
+        db.close()
+
+def user_is_admin(user_id: int) -> bool:
+    """Look up the connecting user to decide on admin-only options."""
+    db = SessionLocal()
+    try:
+        user = db.query(User).filter(User.id == user_id).first()
+        return user is not None and is_admin(user)
+    finally:
+        db.close()
+
 @router.websocket("/ws")
 async def websocket_endpoint(
     websocket: WebSocket,
@@ -103,40 +394,75 @@ async def websocket_endpoint(
         await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
         return
 
-    await websocket.accept()
-    logger.info(f"WebSocket connected: user_id={user_id}")
+    subprotocol = negotiate_ws_subprotocol(websocket.scope.get("subprotocols", []))
+    await websocket.accept(subprotocol=subprotocol)
+    logger.info(f"WebSocket connected: user_id={user_id}, subprotocol={subprotocol}")
     
-    ws_manager = WebSocketManager(websocket, user_id)
+    ws_manager = WebSocketManager(
+        websocket, user_id, admin=user_is_admin(user_id), subprotocol=subprotocol
+    )
 
     try:
         while True:
             try:
-                data = await websocket.receive_text()
-                parsed = json.loads(data)
-            except json.JSONDecodeError:
-                await ws_manager.send_error("Invalid JSON format")
+                parsed = await ws_manager.receive_message()
+            except WebSocketDisconnect:
+                raise
+            except Exception:
+                await ws_manager.send_error("Invalid message encoding")
                 continue
 
             if isinstance(parsed, dict):
-                if "task_id" in parsed and len(parsed) == 1:
+                if parsed.get("stats") is True and len(parsed) == 1:
+                    await ws_manager.send_json({"stats": ws_manager.stats_report()})
+
+                elif "task_id" in parsed and len(parsed) == 1:
                     task_id = parsed.get("task_id")
                     if not isinstance(task_id, str):
                         await ws_manager.send_error("Invalid task_id format")
                         continue
                     await ws_manager.handle_task_status(task_id)
 
-                elif all(k in parsed for k in ("word", "algorithm", "corpus_id")):
+                elif "autocomplete" in parsed:
+                    await ws_manager.handle_autocomplete(parsed)
+
+                elif "word" in parsed and "algorithm" in parsed and (
+                    "corpus_id" in parsed or "corpus_ids" in parsed
+                ):
                     await ws_manager.handle_search_request(parsed)
 
+                elif "cancel" in parsed and len(parsed) == 1:
+                    task_id = parsed.get("cancel")
+                    if not isinstance(task_id, str):
+                        await ws_manager.send_error("Invalid task_id format")
+                        continue
+                    await ws_manager.handle_cancel(task_id)
+
+                elif "subscribe" in parsed or "unsubscribe" in parsed:
+                    task_id = parsed.get("subscribe") or parsed.get("unsubscribe")
+                    if not isinstance(task_id, str):
+                        await ws_manager.send_error("Invalid task_id format")
+                        continue
+                    if "subscribe" in parsed:
+                        await ws_manager.watch(task_id)
+                    else:
+                        ws_manager.unsubscribe(task_id)
+
                 else:
                     await ws_manager.send_error(
-                        "Invalid message structure. Expected 'task_id' or {word, algorithm, corpus_id}."
+                        "Invalid message structure. Expected 'task_id', 'subscribe', "
+                        "'unsubscribe', 'cancel', {autocomplete, corpus_id} "
+                        "or {word, algorithm, corpus_id | corpus_ids}."
                     )
             else:
                 await ws_manager.send_error("Invalid message format")
 
     except WebSocketDisconnect:
-        logger.info(f"WebSocket disconnected: user_id={user_id}")
+        logger.info(
+            f"WebSocket disconnected: user_id={user_id}, stats={ws_manager.stats_report()}"
+        )
     except Exception as e:
         logger.error(f"WebSocket error: {str(e)}")
         await websocket.close(code=status.WS_1011_INTERNAL_ERROR)
+    finally:
+        await ws_manager.close()
@@ -1,27 +1,210 @@
+import logging
+import os
 import time
+from typing import Callable, List, Optional
 from celery import Celery
-from sqlalchemy.orm import Session
-from app.db.database import SessionLocal
+from celery.exceptions import Ignore
+from celery.signals import (
+    before_task_publish, task_postrun, task_prerun, task_revoked, worker_init, worker_process_init
+)
+from app import routing
+from app.core import memory, profiling, tracing
+from app.db.database import ReadSessionLocal, dispose_engines
 from app.cruds import corpus as corpus_crud
-from app.services import fuzzy_algorithms
+from app.services import admission, fuzzy_algorithms, index_builds, normalization, search_tasks
+from app.services.corpus_cache import cache as corpus_cache
+
+logger = logging.getLogger(__name__)
 
 celery_app = Celery("tasks")
 celery_app.config_from_object("app.celeryconfig")
 
+@worker_init.connect
+def warm_corpus_cache(sender=None, **kwargs) -> None:
+    """Preload the corpora routed to this worker's queues before the pool forks."""
+    shards = set(routing.shards_of_queues(sender.app.amqp.queues.consume_from))
+    db = ReadSessionLocal()
+    try:
+        corpus_ids = [
+            corpus_id for corpus_id in corpus_crud.get_corpus_ids(db)
+            if routing.shard_for_corpus(corpus_id) in shards
+        ]
+    finally:
+        db.close()
+    loaded = corpus_cache.warm(corpus_ids)
+    logger.info(f"Corpus cache warmed: {loaded} corpora for shards {sorted(shards)}")
+
+@worker_init.connect
+def name_trace_service(**kwargs) -> None:
+    """Spans of the worker are exported under a service name of their own."""
+    if "TRACE_SERVICE_NAME" not in os.environ:
+        tracing.service_name = f"{tracing.TRACE_SERVICE_NAME.removesuffix('-api')}-worker"
+
+@before_task_publish.connect
+def add_trace_headers(headers=None, **kwargs) -> None:
+    """Carry the trace of the API request (or of the parent task) to the worker."""
+    if headers is not None:
+        tracing.inject_headers(headers)
+
+@task_prerun.connect
+def start_task_span(task_id=None, task=None, **kwargs) -> None:
+    tracing.start_task(task_id, task.name, task.request)
+
+@task_postrun.connect
+def finish_task_span(task_id=None, state=None, **kwargs) -> None:
+    tracing.finish_task(task_id, state)
+
+@worker_process_init.connect
+def reset_db_connections(**kwargs) -> None:
+    """Forked pool processes must not reuse the parent's SQLite connections."""
+    dispose_engines(close=False)
+
 @celery_app.task(name="fuzzy_search_task", bind=True)
-def fuzzy_search_task(self, word: str, algorithm: str, corpus_id: int):
-    db: Session = SessionLocal()
-    corpus = corpus_crud.get_corpus_by_id(db, corpus_id)
-    if not corpus:
+def fuzzy_search_task(
+    self, word: str, algorithm: str, corpus_id: int,
+    profile: bool = False, inflight_key: Optional[str] = None, max_errors: Optional[int] = None
+):
+    _record_queue_wait(self.request)
+    # у части chord отправители записаны на id всего поиска — задачи merge
+    search_id = celery_app.signature(self.request.chord).id if self.request.chord else None
+    cancelled = search_tasks.cancellation_check(
+        celery_app, self.request.id, celery_app.conf.cancel_check_interval, search_id
+    )
+    try:
+        with profiling.profile(profile, profile_id=self.request.id) as handle, memory.track(enforce_limit=True) as tracker:
+            check = tracker.guard(cancelled)
+            check()
+            if algorithm in fuzzy_algorithms.TEXT_ALGORITHMS:
+                result = _run_text_search(self, word, corpus_id, max_errors, check)
+            else:
+                result = _run_search(self, word, algorithm, corpus_id, check)
+    except search_tasks.SearchCancelled:
+        if self.request.chord:
+            # часть chord: merge увидит отмену и сам завершится как REVOKED
+            return {"error": "Cancelled"}
+        _stop_cancelled(self)
+    except memory.MemoryLimitExceeded as e:
+        # поиск остановлен до того, как воркер убьёт OOM killer; память освобождена вместе с его данными
+        logger.warning(f"Search {self.request.id} in corpus {corpus_id} stopped: {e}")
+        result = {"error": str(e)}
+    finally:
+        search_tasks.release_inflight(celery_app, inflight_key, self.request.id)
+        admission.finished(celery_app, self.request.id)
+    if handle.profile_id:
+        result["profile_id"] = handle.profile_id
+    result["stages"] = tracing.stages()
+    if tracker.usage is not None:
+        result["memory"] = tracker.usage
+    return result
+
+@celery_app.task(name="merge_search_results", bind=True)
+def merge_search_results(
+    self, results: List[dict], corpus_ids: List[int], inflight_key: Optional[str] = None
+):
+    """Chord body of a multi-corpus search: one global top list over the per-corpus results."""
+    try:
+        if search_tasks.is_cancelled(celery_app, self.request.id):
+            _stop_cancelled(self)
+        return fuzzy_algorithms.merge_results(dict(zip(corpus_ids, results)))
+    finally:
+        search_tasks.release_inflight(celery_app, inflight_key, self.request.id)
+        admission.finished(celery_app, self.request.id)
+
+@celery_app.task(name="release_failed_search")
+def release_failed_search(request, exc, traceback) -> None:
+    """
+    Errback of merge_search_results: a part that raised or expired in its
+    queue fails the chord, and merge never runs to release the search.
+    """
+    logger.warning(f"Multi-corpus search {request.id} failed: {exc}")
+    search_tasks.release_inflight(celery_app, (request.kwargs or {}).get("inflight_key"), request.id)
+    admission.finished(celery_app, request.id)
+
+@celery_app.task(name="build_corpus_index")
+def build_corpus_index(corpus_id: int) -> Optional[str]:
+    """Build the search index of a corpus queued by index_builds.schedule, then warm this worker's cache."""
+    status = index_builds.build(corpus_id)
+    if status is not None:
+        # задача пришла в очередь шарда корпуса, так что следующий поиск по нему попадёт сюда
+        corpus_cache.get(corpus_id, fresh=True)
+    return status
+
+def _queue_of(request) -> Optional[str]:
+    return (request.delivery_info or {}).get("routing_key")
+
+def _record_queue_wait(request) -> None:
+    """Take the search out of the queued work seen by admission control."""
+    queue = _queue_of(request)
+    waited = admission.started(celery_app, request.id, queue)
+    if waited is not None and admission.ADMISSION_MAX_WAIT > 0 and waited > admission.ADMISSION_MAX_WAIT:
+        logger.warning(f"Search {request.id} waited {waited:.1f} s in {queue}")
+
+@task_revoked.connect
+def release_revoked(request=None, expired=False, **kwargs) -> None:
+    """A search revoked in the queue (cancelled or expired) never runs its finally block."""
+    if request is None or request.task != "fuzzy_search_task":
+        return
+    if expired:
+        logger.warning(f"Search {request.id} expired in {_queue_of(request)}")
+    admission.started(celery_app, request.id, _queue_of(request))
+    search_tasks.release_inflight(celery_app, (request.kwargs or {}).get("inflight_key"), request.id)
+    admission.finished(celery_app, request.id)
+
+def _stop_cancelled(self) -> None:
+    """End a cancelled task as REVOKED; Ignore keeps Celery from overwriting the state."""
+    logger.info(f"Search {self.request.id} cancelled")
+    self.backend.mark_as_revoked(self.request.id, reason="cancelled")
+    raise Ignore()
+
+def _run_text_search(
+    self, word: str, corpus_id: int, max_errors: Optional[int], check: Callable[[], None]
+) -> dict:
+    db = ReadSessionLocal()
+    try:
+        with tracing.span("corpus_load", stage="corpus_load", corpus_id=corpus_id):
+            chunks = corpus_crud.iter_corpus_text(db, corpus_id)
+            if chunks is None:
+                return {"error": "Corpus not found"}
+            total = max(corpus_crud.get_corpus_text_length(db, corpus_id), 1)
+
+        interval = celery_app.conf.progress_update_interval
+        last_update = time.time()
+
+        def on_chunk(done: int) -> None:
+            nonlocal last_update
+            now = time.time()
+            if now - last_update >= interval:
+                last_update = now
+                self.update_state(
+                    state='PROGRESS',
+                    meta={'progress': int(done / total * 100), 'current_word': f'{done}/{total} chars'}
+                )
+
+        with tracing.span("scan", stage="scan", chars=total):
+            return fuzzy_algorithms.search_text(word, chunks, max_errors, on_chunk=on_chunk, check=check)
+    finally:
+        db.close()
+
+def _run_search(self, word: str, algorithm: str, corpus_id: int, check: Callable[[], None]) -> dict:
+    with tracing.span("corpus_load", stage="corpus_load", corpus_id=corpus_id):
+        corpus = corpus_cache.get(corpus_id)
+    if corpus is None:
         return {"error": "Corpus not found"}
 
-    words = list(set(corpus.text.split()))
+    word = normalization.normalize_query(word)
+    with tracing.span("candidates", stage="candidates", indexed=corpus.words is None):
+        words = corpus.candidates(word)
     total = len(words)
 
     start_time = time.time()
+    # Each update_state is a Redis write, so progress is reported at most
+    # once per interval instead of once per word.
+    interval = celery_app.conf.progress_update_interval
+    last_update = start_time
 
     results = []
     for idx, w in enumerate(words):
+        check()
         if algorithm == "levenshtein":
             distance = fuzzy_algorithms.levenshtein_distance(word, w)
         elif algorithm == "ngram":
@@ -29,20 +212,24 @@ def fuzzy_search_task(self, word: str, algorithm: str, corpus_id: int):
         else:
             continue
 
-        self.update_state(
-            state='PROGRESS',
-            meta={
-                'progress': int((idx + 1) / total * 100),
-                'current_word': f'{idx + 1}/{total}'
-            }
-        )
+        now = time.time()
+        if now - last_update >= interval:
+            last_update = now
+            self.update_state(
+                state='PROGRESS',
+                meta={
+                    'progress': int((idx + 1) / total * 100),
+                    'current_word': f'{idx + 1}/{total}'
+                }
+            )
 
         results.append({"word": w, "distance": distance})
 
     sorted_results = sorted(results, key=lambda x: x["distance"])[:10]
     end_time = time.time()
+    tracing.record("scoring", start_time, end_time, stage="scoring", words=total)
 
     return {
         "execution_time": round(end_time - start_time, 4),
-        "results": sorted_results
+        "results": corpus.attach_forms(sorted_results)
     }
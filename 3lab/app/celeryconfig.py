@@ -1,5 +1,40 @@
-broker_url = "redis://localhost:6379/0"
-result_backend = "redis://localhost:6379/0"
+import os
+from dotenv import load_dotenv
+from kombu import Queue
+
+from app import routing
+from app.core.serialization import ZMSGPACK, register_zmsgpack
+
+load_dotenv()
+register_zmsgpack()
+
+broker_url = os.getenv("CELERY_BROKER_URL", "redis://localhost:6379/0")
+result_backend = os.getenv("CELERY_RESULT_BACKEND", "redis://localhost:6379/0")
 task_serializer = "json"
-result_serializer = "json"
-accept_content = ["json"]
+# json (по умолчанию) или zmsgpack: msgpack + zlib для больших результатов
+result_serializer = os.getenv("CELERY_RESULT_SERIALIZER", "json")
+accept_content = ["json", ZMSGPACK]
+result_accept_content = ["json", ZMSGPACK]
+
+# Время жизни результатов и PROGRESS-состояний в Redis, секунды
+result_expires = int(os.getenv("CELERY_RESULT_EXPIRES", "3600"))
+
+# Как часто задача обновляет PROGRESS-метаданные, секунды
+progress_update_interval = float(os.getenv("CELERY_PROGRESS_INTERVAL", "0.5"))
+
+# Как часто поиск проверяет флаг отмены, секунды: за это время отменённая задача освобождает воркер
+cancel_check_interval = float(os.getenv("CELERY_CANCEL_CHECK_INTERVAL", "0.5"))
+
+# Поиск уходит в очередь <класс>.corpus.<n>: класс interactive/bulk, n — consistent
+# hashing по corpus_id, чтобы повторные запросы попадали на воркер с уже загруженным
+# корпусом. Воркер без -Q слушает все очереди.
+task_default_queue = "celery"
+task_queues = [
+    Queue(name, routing_key=name)
+    for name in [task_default_queue] + routing.corpus_queues()
+]
+task_routes = (routing.route_task,)
+
+# Воркер резервирует не больше CELERY_PREFETCH_MULTIPLIER задач на процесс,
+# чтобы длинные bulk-задачи не задерживали уже полученные interactive-задачи.
+worker_prefetch_multiplier = int(os.getenv("CELERY_PREFETCH_MULTIPLIER", "1"))
@@ -1,14 +1,23 @@
-from fastapi import Depends, HTTPException, status
+from typing import List, Literal, Optional, Union
+from fastapi import Depends, Header, HTTPException, Query, status
 from jose import JWTError, jwt
 from sqlalchemy.orm import Session
 from fastapi.security import OAuth2PasswordBearer
 import os
 
-from app.db.database import SessionLocal
+from app.core import tracing
+from app.cruds import corpus as corpus_crud
+from app.db.database import ReadSessionLocal, SessionLocal
 from app.models.user import User
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login/")
 
+ADMIN_EMAILS = {
+    email.strip().lower()
+    for email in os.getenv("ADMIN_EMAILS", "").split(",")
+    if email.strip()
+}
+
 def get_db():
     db = SessionLocal()
     try:
@@ -16,19 +25,63 @@ def get_db():
     finally:
         db.close()
 
+def get_read_db():
+    """Session from the read-only pool, for endpoints that never write."""
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
 def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> User:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
     )
 
-    try:
-        payload = jwt.decode(token, os.getenv("SECRET_KEY"), algorithms=[os.getenv("ALGORITHM")])
-        user_id = int(payload.get("sub"))
-    except (JWTError, ValueError):
-        raise credentials_exception
+    with tracing.span("auth", stage="auth"):
+        try:
+            payload = jwt.decode(token, os.getenv("SECRET_KEY"), algorithms=[os.getenv("ALGORITHM")])
+            user_id = int(payload.get("sub"))
+        except (JWTError, ValueError):
+            raise credentials_exception
 
-    user = db.query(User).filter(User.id == user_id).first()
+        user = db.query(User).filter(User.id == user_id).first()
     if user is None:
         raise credentials_exception
     return user
+
+def resolve_search_corpora(
+    db: Session, corpus_ids: Union[List[int], Literal["mine"]], current_user: User
+) -> List[int]:
+    """Corpora of a multi-corpus search; 404 if some are missing or none are left."""
+    found, missing = corpus_crud.resolve_corpus_ids(db, corpus_ids, current_user.id)
+    if missing:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Corpus not found: {missing}"
+        )
+    if not found:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="No corpora to search"
+        )
+    return found
+
+def is_admin(user: User) -> bool:
+    """Admins are configured by e-mail through the ADMIN_EMAILS variable."""
+    return user.email.lower() in ADMIN_EMAILS
+
+def profiling_requested(
+    profile: bool = Query(False, description="Profile this request (admins only)"),
+    x_profile: Optional[str] = Header(None),
+    current_user: User = Depends(get_current_user)
+) -> bool:
+    """Opt-in profiling flag from `?profile=true` or the `X-Profile: 1` header."""
+    requested = profile or x_profile in ("1", "true", "yes")
+    if requested and not is_admin(current_user):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Profiling is available to administrators only"
+        )
+    return requested
@@ -0,0 +1,193 @@
+"""
+Per-search memory accounting and an optional memory ceiling.
+
+SEARCH_MEMORY_TRACKING selects how the memory of a search is measured:
+- rss: growth of the resident set size of the process, sampled while the
+  search runs and taken from the process high-water mark at its end; cheap,
+  and it is what the OOM killer looks at;
+- tracemalloc: peak of the memory allocated by Python during the search,
+  exact but slows allocation-heavy code down while a search is traced;
+- empty (default): not measured, unless SEARCH_MEMORY_LIMIT_MB is set,
+  which then measures rss in the Celery tasks.
+
+A measured search reports `memory`: `peak_bytes` over the memory at its
+start (loading an uncached corpus counts) and `objects`, the peak growth of
+the blocks allocated by the interpreter (sys.getallocatedblocks, about one
+per object). The numbers are also tags of the current trace span.
+
+A search whose peak goes over SEARCH_MEMORY_LIMIT_MB is stopped at its next
+check with MemoryLimitExceeded: the Celery task returns an error result
+instead of the worker being killed. Memory is sampled at most every
+SEARCH_MEMORY_CHECK_INTERVAL seconds, at the checks the search loops
+already make for cancellation.
+
+Accounting is per process: a prefork Celery worker runs one search per
+process and the numbers are its own, so only the tasks enforce the limit
+(`track(enforce_limit=True)`). Requests served at the same time by the API
+add to each other's numbers; there the memory is only reported.
+"""
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, Optional
+
+from app.core import tracing
+
+RSS = "rss"
+TRACEMALLOC = "tracemalloc"
+
+# rss, tracemalloc или пусто — не измеряется (при заданном лимите — rss)
+SEARCH_MEMORY_TRACKING = os.getenv("SEARCH_MEMORY_TRACKING", "").lower()
+# 0 — без ограничения
+SEARCH_MEMORY_LIMIT_MB = float(os.getenv("SEARCH_MEMORY_LIMIT_MB", "0"))
+SEARCH_MEMORY_CHECK_INTERVAL = float(os.getenv("SEARCH_MEMORY_CHECK_INTERVAL", "0.05"))
+
+TRACKING_MODE = SEARCH_MEMORY_TRACKING if SEARCH_MEMORY_TRACKING in (RSS, TRACEMALLOC) else ""
+# там, где лимит соблюдается, он включает замеры и без SEARCH_MEMORY_TRACKING
+MODE = TRACKING_MODE or (RSS if SEARCH_MEMORY_LIMIT_MB > 0 else "")
+LIMIT_BYTES = int(SEARCH_MEMORY_LIMIT_MB * 2 ** 20)
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+class MemoryLimitExceeded(Exception):
+    def __init__(self, peak: int, limit: int):
+        super().__init__(
+            f"Search exceeded the memory limit: {peak / 2 ** 20:.1f} MB of {limit / 2 ** 20:.1f} MB"
+        )
+        self.peak = peak
+        self.limit = limit
+
+
+def _max_rss() -> int:
+    """High-water mark of the resident set size of the process, bytes."""
+    import resource
+
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux считает в килобайтах, macOS — в байтах
+    return usage if sys.platform == "darwin" else usage * 1024
+
+
+def _rss() -> int:
+    """Current resident set size of the process, bytes."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except OSError:
+        # без /proc (macOS) текущий размер недоступен, только пиковый
+        return _max_rss()
+
+
+_tracing_lock = threading.Lock()
+_traced = 0
+
+
+def _start_tracemalloc() -> None:
+    global _traced
+    with _tracing_lock:
+        if _traced == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        _traced += 1
+        tracemalloc.reset_peak()
+
+
+def _stop_tracemalloc() -> None:
+    global _traced
+    with _tracing_lock:
+        _traced -= 1
+        if _traced == 0:
+            tracemalloc.stop()
+
+
+class MemoryTracker:
+    """Memory of one search: started by `track`, sampled by `check`."""
+
+    def __init__(self, mode: str, limit: int):
+        self.mode = mode
+        self.limit = limit
+        self.usage: Optional[Dict[str, int]] = None
+        self._peak = 0
+        self._objects = 0
+        self._next_check = 0.0
+        if mode == TRACEMALLOC:
+            _start_tracemalloc()
+            self._base = tracemalloc.get_traced_memory()[0]
+        elif mode == RSS:
+            self._base = _rss()
+            self._base_max = _max_rss()
+        self._base_blocks = sys.getallocatedblocks()
+
+    @property
+    def active(self) -> bool:
+        return bool(self.mode)
+
+    def _sample(self) -> None:
+        if self.mode == TRACEMALLOC:
+            current = tracemalloc.get_traced_memory()[0] - self._base
+        else:
+            current = _rss() - self._base
+        self._peak = max(self._peak, current)
+        self._objects = max(self._objects, sys.getallocatedblocks() - self._base_blocks)
+
+    def check(self) -> None:
+        """Sample the memory at most every SEARCH_MEMORY_CHECK_INTERVAL; raise over the limit."""
+        if not self.mode:
+            return
+        now = time.monotonic()
+        if now < self._next_check:
+            return
+        self._next_check = now + SEARCH_MEMORY_CHECK_INTERVAL
+        self._sample()
+        if self.limit and self._peak > self.limit:
+            raise MemoryLimitExceeded(self._peak, self.limit)
+
+    def guard(self, check: Optional[Callable[[], None]] = None) -> Optional[Callable[[], None]]:
+        """`check` of a search loop extended with the memory check."""
+        if not self.mode:
+            return check
+        if check is None:
+            return self.check
+
+        def guarded() -> None:
+            check()
+            self.check()
+
+        return guarded
+
+    def finish(self) -> None:
+        self._sample()
+        if self.mode == TRACEMALLOC:
+            self._peak = max(self._peak, tracemalloc.get_traced_memory()[1] - self._base)
+            _stop_tracemalloc()
+        else:
+            high_water = _max_rss()
+            if high_water > self._base_max:
+                # пик процесса вырос за время поиска, значит это пик поиска, даже между проверками
+                self._peak = max(self._peak, high_water - self._base)
+        self.usage = {"peak_bytes": max(self._peak, 0), "objects": max(self._objects, 0)}
+        current = tracing.current_span()
+        if current is not None:
+            current.tag("memory.peak_bytes", self.usage["peak_bytes"])
+            current.tag("memory.objects", self.usage["objects"])
+
+
+@contextmanager
+def track(enforce_limit: bool = False) -> Iterator[MemoryTracker]:
+    """
+    Measure the memory of the block; `usage` of the tracker is set when it
+    ends, also by an exception, and stays None when nothing is measured.
+    SEARCH_MEMORY_LIMIT_MB is enforced only with `enforce_limit`, for a
+    block that owns its process.
+    """
+    if enforce_limit:
+        tracker = MemoryTracker(MODE, LIMIT_BYTES)
+    else:
+        tracker = MemoryTracker(TRACKING_MODE, 0)
+    try:
+        yield tracker
+    finally:
+        if tracker.active:
+            tracker.finish()
@@ -0,0 +1,87 @@
+import cProfile
+import os
+import random
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, List, Optional, Tuple, TypeVar
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", "./profiles")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "1.0"))
+PROFILE_MAX_PER_MINUTE = int(os.getenv("PROFILE_MAX_PER_MINUTE", "6"))
+
+T = TypeVar("T")
+
+
+class ProfileLimiter:
+    """Sliding-window limiter that caps how many requests get profiled."""
+
+    def __init__(self, sample_rate: float, max_per_minute: int):
+        self.sample_rate = sample_rate
+        self.max_per_minute = max_per_minute
+        self._started: List[float] = []
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Return True if one more profile may be taken right now."""
+        if self.max_per_minute <= 0 or random.random() >= self.sample_rate:
+            return False
+        now = time.monotonic()
+        with self._lock:
+            self._started = [t for t in self._started if now - t < 60]
+            if len(self._started) >= self.max_per_minute:
+                return False
+            self._started.append(now)
+            return True
+
+
+limiter = ProfileLimiter(PROFILE_SAMPLE_RATE, PROFILE_MAX_PER_MINUTE)
+
+
+def profile_path(profile_id: str) -> str:
+    """Return the file path of a stored profile."""
+    return os.path.join(PROFILE_DIR, f"{profile_id}.prof")
+
+
+class ProfileHandle:
+    """Result of a profiled block; profile_id is None when it was skipped."""
+
+    def __init__(self):
+        self.profile_id: Optional[str] = None
+
+
+@contextmanager
+def profile(enabled: bool, profile_id: Optional[str] = None) -> Iterator[ProfileHandle]:
+    """
+    Run the block under cProfile if enabled and allowed by the limiter.
+
+    The stats are dumped to PROFILE_DIR/<profile_id>.prof and can be
+    inspected with `python -m pstats` or snakeviz.
+    """
+    handle = ProfileHandle()
+    if not enabled or not limiter.allow():
+        yield handle
+        return
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield handle
+    finally:
+        profiler.disable()
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        handle.profile_id = profile_id or uuid.uuid4().hex
+        profiler.dump_stats(profile_path(handle.profile_id))
+
+
+def run_profiled(enabled: bool, fn: Callable[..., T], *args: Any) -> Tuple[T, Optional[str]]:
+    """
+    Call fn under `profile` in the current thread; returns (result, profile_id).
+
+    cProfile only traces the thread it is enabled in, so work handed to a
+    thread pool has to be profiled inside the pool thread, not around the await.
+    """
+    with profile(enabled) as handle:
+        result = fn(*args)
+    return result, handle.profile_id
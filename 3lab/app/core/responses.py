@@ -0,0 +1,55 @@
+import os
+from typing import Any
+
+from fastapi import FastAPI
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, the stdlib encoder is used without it
+    orjson = None
+
+RESPONSE_COMPRESS_MIN_SIZE = int(os.getenv("RESPONSE_COMPRESS_MIN_SIZE", "1024"))
+RESPONSE_GZIP_LEVEL = int(os.getenv("RESPONSE_GZIP_LEVEL", "5"))
+RESPONSE_BROTLI = os.getenv("RESPONSE_BROTLI", "true").lower() in ("1", "true", "yes")
+
+
+class ORJSONResponse(JSONResponse):
+    """
+    JSON response rendered with orjson.
+
+    Routes return it directly with plain dicts/lists to skip response_model
+    validation of data that is already in the right shape.
+    """
+
+    def render(self, content: Any) -> bytes:
+        if orjson is None:
+            return super().render(content)
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+
+
+def add_compression(app: FastAPI) -> None:
+    """
+    Compress responses larger than RESPONSE_COMPRESS_MIN_SIZE bytes.
+
+    Brotli is negotiated when brotli-asgi is installed and the client sends
+    `Accept-Encoding: br`; otherwise responses are gzipped.
+    """
+    if RESPONSE_BROTLI:
+        try:
+            from brotli_asgi import BrotliMiddleware
+        except ImportError:
+            pass
+        else:
+            app.add_middleware(
+                BrotliMiddleware,
+                minimum_size=RESPONSE_COMPRESS_MIN_SIZE,
+                gzip_fallback=True
+            )
+            return
+    app.add_middleware(
+        GZipMiddleware,
+        minimum_size=RESPONSE_COMPRESS_MIN_SIZE,
+        compresslevel=RESPONSE_GZIP_LEVEL
+    )
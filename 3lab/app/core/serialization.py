@@ -0,0 +1,103 @@
+import json
+import os
+import zlib
+from typing import Any, List, Optional, Union
+
+ZMSGPACK = "zmsgpack"
+ZMSGPACK_CONTENT_TYPE = "application/x-zmsgpack"
+
+# Payloads smaller than this are stored as plain msgpack.
+COMPRESS_THRESHOLD = int(os.getenv("CELERY_RESULT_COMPRESS_THRESHOLD", "1024"))
+COMPRESS_LEVEL = int(os.getenv("CELERY_RESULT_COMPRESS_LEVEL", "6"))
+
+_RAW = b"\x00"
+_ZLIB = b"\x01"
+
+
+def zmsgpack_dumps(obj: Any) -> bytes:
+    """Pack with msgpack and zlib-compress payloads above the threshold."""
+    import msgpack
+
+    packed = msgpack.packb(obj, use_bin_type=True)
+    if len(packed) >= COMPRESS_THRESHOLD:
+        return _ZLIB + zlib.compress(packed, COMPRESS_LEVEL)
+    return _RAW + packed
+
+
+def zmsgpack_loads(data: bytes) -> Any:
+    """Inverse of zmsgpack_dumps."""
+    import msgpack
+
+    if isinstance(data, str):
+        data = data.encode("latin-1")
+    flag, body = data[:1], data[1:]
+    if flag == _ZLIB:
+        body = zlib.decompress(body)
+    return msgpack.unpackb(body, raw=False)
+
+
+def register_zmsgpack() -> None:
+    """Register the compact result serializer with kombu."""
+    from kombu.serialization import register
+
+    register(
+        ZMSGPACK,
+        zmsgpack_dumps,
+        zmsgpack_loads,
+        content_type=ZMSGPACK_CONTENT_TYPE,
+        content_encoding="binary",
+    )
+
+
+# WebSocket subprotocols negotiated at connect time; without one the
+# connection uses JSON text frames.
+WS_JSON = "fuzzy.json"
+WS_MSGPACK = "fuzzy.msgpack"
+
+
+class JsonCodec:
+    subprotocol = WS_JSON
+    binary = False
+
+    def encode(self, message: Any) -> str:
+        return json.dumps(message, ensure_ascii=False)
+
+    def decode(self, data: Union[str, bytes]) -> Any:
+        return json.loads(data)
+
+
+class MsgpackCodec:
+    subprotocol = WS_MSGPACK
+    binary = True
+
+    def encode(self, message: Any) -> bytes:
+        import msgpack
+
+        return msgpack.packb(message, use_bin_type=True)
+
+    def decode(self, data: Union[str, bytes]) -> Any:
+        import msgpack
+
+        if isinstance(data, str):
+            return json.loads(data)
+        return msgpack.unpackb(data, raw=False)
+
+
+WS_CODECS = {WS_JSON: JsonCodec(), WS_MSGPACK: MsgpackCodec()}
+
+
+def negotiate_ws_subprotocol(offered: List[str]) -> Optional[str]:
+    """Pick msgpack if the client offers it, then JSON; None keeps the default."""
+    for subprotocol in (WS_MSGPACK, WS_JSON):
+        if subprotocol in offered:
+            return subprotocol
+    return None
+
+
+def ws_codec(subprotocol: Optional[str]):
+    return WS_CODECS.get(subprotocol, WS_CODECS[WS_JSON])
+
+
+def frame_size(data: Union[str, bytes]) -> int:
+    """Payload bytes of a WebSocket frame; text frames go over the wire as UTF-8."""
+    return len(data.encode("utf-8")) if isinstance(data, str) else len(data)
@@ -0,0 +1,76 @@
+import importlib
+import logging
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# uvicorn настраивает этот логгер на уровень info, так что отчёт виден в консоли
+logger = logging.getLogger("uvicorn.error")
+
+
+class StartupTimer:
+    """
+    Start-up timings of the API process, counted from the creation of the timer.
+
+    Modules are timed in import order, so shared dependencies are attributed
+    to the first module that pulls them in.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.steps: List[Tuple[str, float]] = []
+        self.ready: Optional[float] = None
+        self.first_request: Optional[float] = None
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    @contextmanager
+    def measure(self, name: str) -> Iterator[None]:
+        step_started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.steps.append((name, time.perf_counter() - step_started))
+
+    def import_module(self, name: str) -> Any:
+        with self.measure(name):
+            return importlib.import_module(name)
+
+    def mark_ready(self) -> None:
+        self.ready = self.elapsed()
+        logger.info(f"Startup: ready in {self.ready * 1000:.0f} ms ({self._steps_text()})")
+
+    def mark_first_request(self) -> None:
+        self.first_request = self.elapsed()
+        logger.info(f"Startup: first request served after {self.first_request * 1000:.0f} ms")
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "steps_ms": {name: round(seconds * 1000, 1) for name, seconds in self.steps},
+            "ready_ms": None if self.ready is None else round(self.ready * 1000, 1),
+            "first_request_ms": (
+                None if self.first_request is None else round(self.first_request * 1000, 1)
+            ),
+        }
+
+    def _steps_text(self) -> str:
+        return ", ".join(f"{name} {seconds * 1000:.0f} ms" for name, seconds in self.steps)
+
+
+class FirstRequestMiddleware:
+    """ASGI middleware that records when the first HTTP response has been sent."""
+
+    def __init__(self, app, timer: StartupTimer):
+        self.app = app
+        self.timer = timer
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or self.timer.first_request is not None:
+            await self.app(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            if self.timer.first_request is None:
+                self.timer.mark_first_request()
@@ -0,0 +1,332 @@
+"""
+Lightweight request tracing across the API, the broker and the Celery workers.
+
+A trace is a tree of spans: the HTTP request or WebSocket message, the
+auth and database steps inside it, the wait in the broker queue and the
+search in the worker. The context travels in a W3C `traceparent` header:
+accepted on HTTP requests, added to every Celery message by
+`inject_headers` and picked up by the worker in `start_task`.
+
+Finished spans of sampled traces go to TRACE_EXPORTER: `file` appends
+Zipkin v2 JSON lines to TRACE_FILE, `zipkin` posts batches to
+TRACE_COLLECTOR_URL (Zipkin, Jaeger and the OpenTelemetry collector accept
+this format). Empty, the default, exports nothing.
+
+Spans opened with `stage=` also add their duration to the stage timings of
+the current result (`collect_stages`), which searches return as `stages`
+next to `execution_time`; those are collected whether or not anything is
+exported.
+"""
+import atexit
+import contextvars
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# file, zipkin или пусто — спаны не выгружаются, этапы в ответах считаются всё равно
+TRACE_EXPORTER = os.getenv("TRACE_EXPORTER", "").lower()
+TRACE_FILE = os.getenv("TRACE_FILE", "./traces/spans.jsonl")
+TRACE_COLLECTOR_URL = os.getenv("TRACE_COLLECTOR_URL", "http://localhost:9411/api/v2/spans")
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "1.0"))
+# воркер Celery переименовывает сервис в <имя>-worker
+TRACE_SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "fuzzy-api")
+# как часто фоновый поток выгружает накопленные спаны, секунды
+TRACE_FLUSH_INTERVAL = float(os.getenv("TRACE_FLUSH_INTERVAL", "1"))
+
+TRACEPARENT = "traceparent"
+# время отправки сообщения в брокер (time.time()), из него воркер считает ожидание в очереди
+PUBLISHED_AT = "published_at"
+
+service_name = TRACE_SERVICE_NAME
+
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_id", "sampled", "name", "start", "duration", "tags")
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], sampled: bool,
+                 start: Optional[float] = None):
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.sampled = sampled
+        self.name = name
+        self.start = time.time() if start is None else start
+        self.duration: Optional[float] = None
+        self.tags: Dict[str, str] = {}
+
+    def tag(self, key: str, value: Any) -> None:
+        self.tags[key] = str(value)
+
+    def finish(self, end: Optional[float] = None) -> float:
+        self.duration = max(0.0, (time.time() if end is None else end) - self.start)
+        if self.sampled:
+            exporter.export(self)
+        return self.duration
+
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def as_zipkin(self) -> Dict[str, Any]:
+        record = {
+            "traceId": self.trace_id,
+            "id": self.span_id,
+            "name": self.name,
+            "timestamp": int(self.start * 1_000_000),
+            "duration": int((self.duration or 0) * 1_000_000),
+            "localEndpoint": {"serviceName": service_name},
+            "tags": self.tags,
+        }
+        if self.parent_id:
+            record["parentId"] = self.parent_id
+        return record
+
+
+_current: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("trace_span", default=None)
+_stages: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar(
+    "trace_stages", default=None
+)
+
+
+def parse_traceparent(value: Optional[str]) -> Optional[Tuple[str, str, bool]]:
+    """(trace id, parent span id, sampled) from a W3C traceparent header, None if malformed."""
+    parts = (value or "").strip().split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        int(parts[1], 16), int(parts[2], 16)
+        flags = int(parts[3], 16)
+    except ValueError:
+        return None
+    return parts[1], parts[2], bool(flags & 1)
+
+
+def start_span(name: str, traceparent: Optional[str] = None, start: Optional[float] = None) -> Span:
+    """
+    A span that is not made current: a child of the current span, of the
+    remote parent in `traceparent`, or the root of a new trace.
+    """
+    parent = _current.get()
+    remote = parse_traceparent(traceparent) if parent is None else None
+    if parent is not None:
+        return Span(name, parent.trace_id, parent.span_id, parent.sampled, start)
+    if remote is not None:
+        return Span(name, remote[0], remote[1], remote[2], start)
+    return Span(name, os.urandom(16).hex(), None, random.random() < TRACE_SAMPLE_RATE, start)
+
+
+@contextmanager
+def span(name: str, stage: Optional[str] = None, traceparent: Optional[str] = None,
+         **tags: Any) -> Iterator[Span]:
+    """Run the block in a span; with `stage` its duration also counts towards that stage."""
+    current = start_span(name, traceparent)
+    for key, value in tags.items():
+        current.tag(key, value)
+    token = _current.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.tag("error", type(e).__name__)
+        raise
+    finally:
+        _current.reset(token)
+        duration = current.finish()
+        if stage:
+            add_stage(stage, duration)
+
+
+def record(name: str, start: float, end: float, stage: Optional[str] = None, **tags: Any) -> None:
+    """A child span of the current one for a step timed by the caller (time.time() bounds)."""
+    finished = start_span(name, start=start)
+    for key, value in tags.items():
+        finished.tag(key, value)
+    duration = finished.finish(end)
+    if stage:
+        add_stage(stage, duration)
+
+
+def current_span() -> Optional[Span]:
+    return _current.get()
+
+
+def add_stage(stage: str, seconds: float) -> None:
+    stages = _stages.get()
+    if stages is not None:
+        stages[stage] = stages.get(stage, 0.0) + seconds
+
+
+@contextmanager
+def collect_stages() -> Iterator[Dict[str, float]]:
+    """Collect stage timings of the block separately, e.g. per corpus of a multi-corpus search."""
+    stages: Dict[str, float] = {}
+    token = _stages.set(stages)
+    try:
+        yield stages
+    finally:
+        _stages.reset(token)
+
+
+def stages(extra: Optional[Dict[str, float]] = None) -> Dict[str, float]:
+    """Stage timings collected so far, in seconds, merged with `extra`."""
+    collected = dict(_stages.get() or {})
+    collected.update(extra or {})
+    return {name: round(seconds, 4) for name, seconds in collected.items()}
+
+
+def inject_headers(headers: Dict[str, Any]) -> None:
+    """Add the trace context and the publish time to the headers of an outgoing Celery message."""
+    current = _current.get()
+    if current is not None:
+        headers.setdefault(TRACEPARENT, current.traceparent())
+    headers.setdefault(PUBLISHED_AT, time.time())
+
+
+_tasks: Dict[str, Tuple[Span, contextvars.Token, contextvars.Token]] = {}
+
+
+def start_task(task_id: str, name: str, request) -> None:
+    """Open the span of a Celery task and its stage timings; queue wait is the first stage."""
+    started = time.time()
+    current = start_span(name, getattr(request, TRACEPARENT, None), start=started)
+    current.tag("celery.task_id", task_id)
+    queue = (request.delivery_info or {}).get("routing_key")
+    if queue:
+        current.tag("celery.queue", queue)
+    stage_times: Dict[str, float] = {}
+    published = getattr(request, PUBLISHED_AT, None)
+    if isinstance(published, (int, float)) and published <= started:
+        # часы API и воркера могут расходиться, на одной машине ожидание точное
+        wait = Span("queue_wait", current.trace_id, current.parent_id, current.sampled, published)
+        wait.finish(started)
+        stage_times["queue_wait"] = started - published
+    _tasks[task_id] = (current, _current.set(current), _stages.set(stage_times))
+
+
+def finish_task(task_id: str, state: Optional[str] = None) -> None:
+    entry = _tasks.pop(task_id, None)
+    if entry is None:
+        return
+    current, span_token, stages_token = entry
+    if state:
+        current.tag("celery.state", state)
+    try:
+        _stages.reset(stages_token)
+        _current.reset(span_token)
+    except ValueError:
+        # задача выполнялась в другом контексте, чем сигнал о её начале
+        pass
+    current.finish()
+
+
+class Exporter:
+    """Batches finished spans and writes them from a background thread, one per process."""
+
+    def __init__(self, kind: str):
+        self.kind = kind
+        self._queue: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=10000)
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def export(self, finished: Span) -> None:
+        if self.kind not in ("file", "zipkin"):
+            return
+        self._ensure_thread()
+        try:
+            self._queue.put_nowait(finished.as_zipkin())
+        except queue.Full:
+            pass
+
+    def _ensure_thread(self) -> None:
+        # after a fork the queue and the thread of the parent are gone
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(maxsize=10000)
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name="trace-exporter", daemon=True).start()
+            atexit.register(self.flush)
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(TRACE_FLUSH_INTERVAL)
+            self.flush()
+
+    def flush(self) -> None:
+        batch: List[Dict[str, Any]] = []
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if not batch:
+            return
+        try:
+            if self.kind == "file":
+                self._write_file(batch)
+            else:
+                self._post(batch)
+        except Exception as e:
+            logger.warning(f"Dropped {len(batch)} spans: {e}")
+
+    @staticmethod
+    def _write_file(batch: List[Dict[str, Any]]) -> None:
+        directory = os.path.dirname(TRACE_FILE)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        data = "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in batch)
+        # one write per batch: appends of several worker processes do not interleave
+        with open(TRACE_FILE, "a", encoding="utf-8") as f:
+            f.write(data)
+
+    @staticmethod
+    def _post(batch: List[Dict[str, Any]]) -> None:
+        request = urllib.request.Request(
+            TRACE_COLLECTOR_URL,
+            data=json.dumps(batch).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+            method="POST"
+        )
+        with urllib.request.urlopen(request, timeout=5):
+            pass
+
+
+exporter = Exporter(TRACE_EXPORTER)
+
+
+class TracingMiddleware:
+    """ASGI middleware: one root span and one set of stage timings per HTTP request."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope.get("headers", []))
+        traceparent = headers.get(b"traceparent", b"").decode("latin-1") or None
+
+        with collect_stages(), span(f"{scope['method']} {scope['path']}", traceparent=traceparent) as root:
+            async def send_with_trace_id(message):
+                if message["type"] == "http.response.start":
+                    root.tag("http.status_code", message["status"])
+                    message.setdefault("headers", [])
+                    message["headers"] = [*message["headers"], (b"x-trace-id", root.trace_id.encode())]
+                await send(message)
+
+            await self.app(scope, receive, send_with_trace_id)
+            # /fuzzy/corpuses/7/index -> /fuzzy/corpuses/{corpus_id}/index: одно имя на маршрут
+            path = scope["path"]
+            for name, value in (scope.get("path_params") or {}).items():
+                path = path.replace(f"/{value}", f"/{{{name}}}", 1)
+            root.name = f"{scope['method']} {path}"
@@ -1,16 +1,280 @@
+import time
+from typing import Iterator, List, Literal, Optional, Set, Tuple, Union
+
+from sqlalchemy import func, or_
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from app.models.corpus import Corpus
+from app.models.corpus import Corpus, CorpusAppend, CorpusBlob, CorpusIndex
 from app.schemas.corpus import CorpusCreate
+from app.services import corpus_blobs, normalization, word_index
 
-def create_corpus(db: Session, data: CorpusCreate):
-    db_corpus = Corpus(name=data.corpus_name, text=data.text)
+def create_corpus(db: Session, data: CorpusCreate, owner_id: Optional[int] = None):
+    words = set(data.text.split())
+    blob_hash = store_text(db, data.text, words)
+    db_corpus = Corpus(name=data.corpus_name, blob_hash=blob_hash, owner_id=owner_id)
     db.add(db_corpus)
+    if not word_index.should_index(len(words)):
+        # строить нечего; индекс слов большого корпуса строится в фоне (app.services.index_builds)
+        db.flush()
+        db.add(CorpusIndex(
+            corpus_id=db_corpus.id, status=CorpusIndex.READY, kind=CorpusIndex.VOCABULARY,
+            version=1, updated_at=time.time()
+        ))
     db.commit()
     db.refresh(db_corpus)
     return db_corpus
 
+def store_text(db: Session, text: str, words: Set[str]) -> str:
+    """
+    Hash of the blob holding `text`, compressing and adding it unless an
+    identical text is stored already. Call before anything else is added to
+    the session: a concurrent identical upload rolls it back.
+    """
+    blob_hash = corpus_blobs.content_hash(text)
+    if db.get(CorpusBlob, blob_hash) is not None:
+        return blob_hash
+    db.add(CorpusBlob(
+        hash=blob_hash,
+        codec=corpus_blobs.CORPUS_BLOB_CODEC,
+        length=len(text),
+        data=corpus_blobs.pack_text(text),
+        vocabulary_size=len(words),
+        vocabulary=corpus_blobs.pack_vocabulary(words)
+    ))
+    try:
+        db.flush()
+    except IntegrityError:
+        # тот же текст сохранили параллельно, его строку и используем
+        db.rollback()
+    return blob_hash
+
+def append_corpus(db: Session, corpus_id: int, text: str) -> int:
+    """
+    Store `text` as the next version of the corpus and return that version.
+
+    The corpus text is neither read nor rewritten; an indexed corpus gets only
+    the words its index does not have yet, so the cost follows the appended text.
+    An index still being built is caught up by its build instead, and a stale
+    one by its rebuild.
+    """
+    # UPDATE первым: берёт блокировку записи, параллельные дописывания получают разные версии
+    db.query(Corpus).filter(Corpus.id == corpus_id).update(
+        {Corpus.version: Corpus.version + 1}, synchronize_session=False
+    )
+    version = get_corpus_version(db, corpus_id)
+    db.add(CorpusAppend(corpus_id=corpus_id, version=version, text=text))
+    if _current_word_index(db, corpus_id) is not None:
+        word_index.add(db, corpus_id, normalization.group(text.split()))
+    db.query(CorpusIndex).filter(
+        CorpusIndex.corpus_id == corpus_id, CorpusIndex.status == CorpusIndex.READY
+    ).update({CorpusIndex.version: version}, synchronize_session=False)
+    db.commit()
+    return version
+
+def get_appended_texts(db: Session, corpus_id: int, after_version: int = 0) -> List[Tuple[int, str]]:
+    """(version, text) of the appends newer than `after_version`, oldest first."""
+    rows = (
+        db.query(CorpusAppend.version, CorpusAppend.text)
+        .filter(CorpusAppend.corpus_id == corpus_id, CorpusAppend.version > after_version)
+        .order_by(CorpusAppend.version)
+    )
+    return [(row.version, row.text) for row in rows]
+
+def get_vocabulary(db: Session, corpus_id: int) -> Optional[Tuple[int, Set[str]]]:
+    """
+    Version and distinct words of a corpus including its appends, read from the
+    stored vocabulary without decompressing the text. None if there is no such corpus.
+    """
+    row = (
+        db.query(Corpus.version, CorpusBlob.codec, CorpusBlob.vocabulary)
+        .join(CorpusBlob, Corpus.blob_hash == CorpusBlob.hash)
+        .filter(Corpus.id == corpus_id)
+        .first()
+    )
+    if row is None:
+        return None
+    words = set(corpus_blobs.unpack_vocabulary(row.vocabulary, row.codec))
+    for _, text in get_appended_texts(db, corpus_id):
+        words.update(text.split())
+    return row.version or 1, words
+
+def iter_corpus_text(db: Session, corpus_id: int) -> Optional[Iterator[str]]:
+    """
+    Full text of a corpus as chunks: the uploaded text, decompressed piece by
+    piece, then every append after a newline, read lazily. None if there is no
+    such corpus.
+    """
+    blob = (
+        db.query(CorpusBlob.codec, CorpusBlob.data)
+        .join(Corpus, Corpus.blob_hash == CorpusBlob.hash)
+        .filter(Corpus.id == corpus_id)
+        .first()
+    )
+    if blob is None:
+        return None
+
+    def chunks() -> Iterator[str]:
+        yield from corpus_blobs.iter_text(blob.data, blob.codec)
+        appends = (
+            db.query(CorpusAppend.text)
+            .filter(CorpusAppend.corpus_id == corpus_id)
+            .order_by(CorpusAppend.version)
+            .yield_per(100)
+        )
+        for row in appends:
+            yield "\n" + row.text
+
+    return chunks()
+
+def get_corpus_text_length(db: Session, corpus_id: int) -> int:
+    """Characters iter_corpus_text yields."""
+    length = _blob_column(db, corpus_id, CorpusBlob.length)
+    appended = db.query(func.sum(func.length(CorpusAppend.text) + 1)).filter(
+        CorpusAppend.corpus_id == corpus_id
+    ).scalar()
+    return (length or 0) + (appended or 0)
+
+def get_corpus_version(db: Session, corpus_id: int) -> Optional[int]:
+    return db.query(Corpus.version).filter(Corpus.id == corpus_id).scalar()
+
 def get_corpuses(db: Session):
     return db.query(Corpus).all()
 
+def get_corpus_summaries(db: Session):
+    """id and name of every corpus, without loading the texts."""
+    return [{"id": row.id, "name": row.name} for row in db.query(Corpus.id, Corpus.name)]
+
+def get_corpus_info(db: Session, corpus_id: int):
+    """id, name, owner_id and version of a corpus, without its text."""
+    return db.query(Corpus.id, Corpus.name, Corpus.owner_id, Corpus.version).filter(
+        Corpus.id == corpus_id
+    ).first()
+
+def get_index_states(db: Session, corpus_id: Optional[int] = None):
+    """
+    Per corpus: id, version, vocabulary_size of the uploaded text and the
+    CorpusIndex columns (status, kind, indexed_version, updated_at, error,
+    normalization), which are None for a corpus whose index was never tracked.
+    """
+    query = (
+        db.query(
+            Corpus.id, Corpus.version, CorpusBlob.vocabulary_size,
+            CorpusIndex.status, CorpusIndex.kind, CorpusIndex.version.label("indexed_version"),
+            CorpusIndex.updated_at, CorpusIndex.error, CorpusIndex.normalization
+        )
+        .join(CorpusBlob, Corpus.blob_hash == CorpusBlob.hash)
+        .outerjoin(CorpusIndex, CorpusIndex.corpus_id == Corpus.id)
+    )
+    if corpus_id is not None:
+        query = query.filter(Corpus.id == corpus_id)
+    return query.order_by(Corpus.id).all()
+
+def word_index_ready(db: Session, corpus_id: int) -> bool:
+    """True if the corpus has a word index of the current normalization built up to its current version."""
+    row = _current_word_index(db, corpus_id)
+    return row is not None and row.version >= row.corpus_version
+
+def _current_word_index(db: Session, corpus_id: int):
+    """Version of a ready word index built with the current normalization steps and of its corpus."""
+    return (
+        db.query(CorpusIndex.version, Corpus.version.label("corpus_version"))
+        .join(Corpus, Corpus.id == CorpusIndex.corpus_id)
+        .filter(
+            CorpusIndex.corpus_id == corpus_id,
+            CorpusIndex.status == CorpusIndex.READY,
+            CorpusIndex.kind == CorpusIndex.WORDS,
+            CorpusIndex.normalization == normalization.SIGNATURE
+        )
+        .first()
+    )
+
+def set_index_state(
+    db: Session, corpus_id: int, status: str, kind: Optional[str] = None,
+    version: Optional[int] = None, error: Optional[str] = None,
+    normalization: Optional[str] = None
+) -> None:
+    """Record the index state of a corpus and commit; kind, version and normalization are kept unless given."""
+    row = db.get(CorpusIndex, corpus_id)
+    if row is None:
+        row = CorpusIndex(corpus_id=corpus_id, version=0)
+        db.add(row)
+    row.status = status
+    row.error = error
+    row.updated_at = time.time()
+    if kind is not None:
+        row.kind = kind
+    if version is not None:
+        row.version = version
+    if normalization is not None:
+        row.normalization = normalization
+    try:
+        db.commit()
+    except IntegrityError:
+        # строку одновременно создал другой процесс; его состояние не хуже нашего
+        db.rollback()
+
+def claim_index_build(db: Session, corpus_id: int, timeout: float) -> bool:
+    """
+    Mark the index of a corpus as building; False if another build holds it.
+    A build that has not finished within `timeout` seconds counts as lost.
+    """
+    now = time.time()
+    claimed = db.query(CorpusIndex).filter(
+        CorpusIndex.corpus_id == corpus_id,
+        or_(CorpusIndex.status != CorpusIndex.BUILDING, CorpusIndex.updated_at < now - timeout)
+    ).update(
+        {CorpusIndex.status: CorpusIndex.BUILDING, CorpusIndex.updated_at: now, CorpusIndex.error: None},
+        synchronize_session=False
+    )
+    if not claimed:
+        if db.get(CorpusIndex, corpus_id) is not None:
+            db.rollback()
+            return False
+        db.add(CorpusIndex(corpus_id=corpus_id, status=CorpusIndex.BUILDING, version=0, updated_at=now))
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        return False
+    return True
+
+def _blob_column(db: Session, corpus_id: int, column):
+    return (
+        db.query(column)
+        .join(Corpus, Corpus.blob_hash == CorpusBlob.hash)
+        .filter(Corpus.id == corpus_id)
+        .scalar()
+    )
+
 def get_corpus_by_id(db: Session, corpus_id: int):
     return db.query(Corpus).filter(Corpus.id == corpus_id).first()
+
+def get_corpus_ids(db: Session, owner_id: Optional[int] = None):
+    query = db.query(Corpus.id)
+    if owner_id is not None:
+        query = query.filter(Corpus.owner_id == owner_id)
+    return [row.id for row in query.order_by(Corpus.id)]
+
+def resolve_corpus_ids(
+    db: Session, corpus_ids: Union[List[int], Literal["mine"]], owner_id: int
+) -> Tuple[List[int], List[int]]:
+    """Expand "mine" to the user's corpora; return (existing ids, missing ids) in request order."""
+    if corpus_ids == "mine":
+        return get_corpus_ids(db, owner_id=owner_id), []
+    requested = list(dict.fromkeys(corpus_ids))
+    existing = {row.id for row in db.query(Corpus.id).filter(Corpus.id.in_(requested))}
+    return (
+        [corpus_id for corpus_id in requested if corpus_id in existing],
+        [corpus_id for corpus_id in requested if corpus_id not in existing]
+    )
+
+# average token length incl. the separator, used to estimate token counts
+AVG_TOKEN_LENGTH = 6
+
+def estimate_vocabulary_size(db: Session, corpus_id: int) -> int:
+    """Vocabulary size of the uploaded text plus an upper-bound estimate for the appends."""
+    size = _blob_column(db, corpus_id, CorpusBlob.vocabulary_size)
+    appended = db.query(func.sum(func.length(CorpusAppend.text))).filter(
+        CorpusAppend.corpus_id == corpus_id
+    ).scalar()
+    return (size or 0) + (appended or 0) // AVG_TOKEN_LENGTH
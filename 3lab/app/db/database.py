@@ -1,4 +1,5 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, inspect
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import sessionmaker, declarative_base
 import os
 from dotenv import load_dotenv
@@ -6,12 +7,81 @@ from dotenv import load_dotenv
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
+# auto: создавать таблицы, только если база не под управлением alembic; always; never
+CREATE_TABLES = os.getenv("CREATE_TABLES", "auto").lower()
 
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+# performance: WAL и pragma ниже; default: настройки SQLite по умолчанию
+SQLITE_PROFILE = os.getenv("SQLITE_PROFILE", "performance").lower()
+SQLITE_PRAGMAS = {
+    "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "WAL"),
+    "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+    "mmap_size": os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)),
+    "cache_size": os.getenv("SQLITE_CACHE_SIZE", "-65536"),
+    "temp_store": "MEMORY",
+}
+# сколько миллисекунд ждать снятия блокировки, прежде чем вернуть "database is locked"
+SQLITE_BUSY_TIMEOUT = int(os.getenv("SQLITE_BUSY_TIMEOUT", "5000"))
+SQLITE_READ_POOL_SIZE = int(os.getenv("SQLITE_READ_POOL_SIZE", "10"))
+
+
+def make_engine(url: str, read_only: bool = False, profile: str = SQLITE_PROFILE) -> Engine:
+    """
+    Create an engine; SQLite connections get busy_timeout and the pragmas of the profile.
+
+    Read-only engines run with `query_only` and leave the journal mode to the
+    writer, since WAL can only be switched on by a connection that may write.
+    """
+    if not url.startswith("sqlite"):
+        return create_engine(url)
+
+    pool_args = {"pool_size": SQLITE_READ_POOL_SIZE} if read_only else {}
+    engine = create_engine(
+        url,
+        connect_args={"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT / 1000},
+        **pool_args
+    )
+    pragmas = {"busy_timeout": SQLITE_BUSY_TIMEOUT}
+    if profile == "performance":
+        pragmas.update(SQLITE_PRAGMAS)
+    if read_only:
+        pragmas.pop("journal_mode", None)
+        pragmas["query_only"] = "ON"
+
+    @event.listens_for(engine, "connect")
+    def apply_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+    return engine
+
+
+def _is_shared_file(url: str) -> bool:
+    """A second engine sees the same data only for file databases."""
+    return url.startswith("sqlite") and ":memory:" not in url and url.rstrip("/") != "sqlite:"
+
+
+engine = make_engine(DATABASE_URL)
+# отдельный пул только для чтения: поиски не ждут в общей очереди соединений с загрузками
+read_engine = make_engine(DATABASE_URL, read_only=True) if _is_shared_file(DATABASE_URL) else engine
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
 
 Base = declarative_base()
 
-def create_tables():
+def dispose_engines(close: bool = True) -> None:
+    """Drop pooled connections, e.g. before or after a fork."""
+    engine.dispose(close=close)
+    if read_engine is not engine:
+        read_engine.dispose(close=close)
+
+def create_tables() -> bool:
+    """Create missing tables unless migrations manage the schema; return True if DDL ran."""
+    if CREATE_TABLES == "never":
+        return False
+    if CREATE_TABLES == "auto" and inspect(engine).has_table("alembic_version"):
+        return False
     from app.models import user, corpus
     Base.metadata.create_all(bind=engine)
+    return True
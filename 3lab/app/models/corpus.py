@@ -1,9 +1,62 @@
-from sqlalchemy import Column, Integer, String, Text
+from sqlalchemy import Column, Float, ForeignKey, Integer, LargeBinary, String, Text
 from app.db.database import Base
 
+class CorpusBlob(Base):
+    """Compressed text of a corpus and its vocabulary, stored once per distinct text."""
+    __tablename__ = "corpus_blobs"
+
+    # sha256 текста в UTF-8
+    hash = Column(String(64), primary_key=True)
+    # zstd или zlib, см. app.services.corpus_blobs
+    codec = Column(String, nullable=False)
+    # символов в тексте
+    length = Column(Integer, nullable=False)
+    data = Column(LargeBinary, nullable=False)
+    vocabulary_size = Column(Integer, nullable=False)
+    # различные слова текста через "\n", сжатые тем же кодеком
+    vocabulary = Column(LargeBinary, nullable=False)
+
 class Corpus(Base):
     __tablename__ = "corpuses"
 
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, unique=True, nullable=False)
+    blob_hash = Column(String(64), ForeignKey("corpus_blobs.hash"), nullable=False, index=True)
+    owner_id = Column(Integer, ForeignKey("users.id"), nullable=True, index=True)
+    # растёт на 1 с каждым дописыванием текста
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+
+class CorpusAppend(Base):
+    """Text appended to a corpus; the full text is that of its blob followed by its appends."""
+    __tablename__ = "corpus_appends"
+
+    id = Column(Integer, primary_key=True, index=True)
+    corpus_id = Column(Integer, ForeignKey("corpuses.id"), nullable=False, index=True)
+    version = Column(Integer, nullable=False)
     text = Column(Text, nullable=False)
+
+class CorpusIndex(Base):
+    """State of the search structures of a corpus, built in the background (app.services.index_builds)."""
+    __tablename__ = "corpus_indexes"
+
+    BUILDING = "building"
+    READY = "ready"
+    FAILED = "failed"
+
+    # FTS5-индекс слов (app.services.word_index)
+    WORDS = "words"
+    # индекс не нужен: поиск перебирает словарь в памяти
+    VOCABULARY = "vocabulary"
+
+    corpus_id = Column(Integer, ForeignKey("corpuses.id"), primary_key=True)
+    # building, ready или failed
+    status = Column(String, nullable=False)
+    # words или vocabulary; None, пока индекс ни разу не построен
+    kind = Column(String, nullable=True)
+    # версия корпуса, до которой индекс доведён
+    version = Column(Integer, nullable=False, default=0, server_default="0")
+    # time.time() последней смены состояния
+    updated_at = Column(Float, nullable=False)
+    error = Column(Text, nullable=True)
+    # шаги нормализации слов, с которыми построен индекс words (normalization.SIGNATURE)
+    normalization = Column(String, nullable=True)
@@ -0,0 +1,103 @@
+import argparse
+import os
+from typing import List, Optional
+
+CORPUS_QUEUE_COUNT = int(os.getenv("CORPUS_QUEUE_COUNT", "4"))
+CORPUS_QUEUE_PREFIX = "corpus"
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+PRIORITIES = (INTERACTIVE, BULK)
+
+
+def jump_hash(key: int, buckets: int) -> int:
+    """
+    Jump consistent hash (Lamping & Veach): maps key to [0, buckets).
+
+    When the number of buckets grows from n to n + 1 only 1/(n + 1) of the
+    keys move, so most corpora stay on their warm workers.
+    """
+    b, j = -1, 0
+    key &= 0xFFFFFFFFFFFFFFFF
+    while j < buckets:
+        b = j
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        j = int((b + 1) * (float(1 << 31) / float((key >> 33) + 1)))
+    return b
+
+
+def shard_for_corpus(corpus_id: int) -> int:
+    return jump_hash(corpus_id, CORPUS_QUEUE_COUNT)
+
+
+def queue_for_corpus(corpus_id: int, priority: str = INTERACTIVE) -> str:
+    return f"{priority}.{CORPUS_QUEUE_PREFIX}.{shard_for_corpus(corpus_id)}"
+
+
+def corpus_queues(
+    shards: Optional[List[int]] = None, priorities: Optional[List[str]] = None
+) -> List[str]:
+    """Names of the corpus queues for the given shards and priority classes."""
+    if shards is None:
+        shards = list(range(CORPUS_QUEUE_COUNT))
+    if priorities is None:
+        priorities = list(PRIORITIES)
+    return [
+        f"{priority}.{CORPUS_QUEUE_PREFIX}.{shard}"
+        for priority in priorities
+        for shard in shards
+    ]
+
+
+def shards_of_queues(queue_names) -> List[int]:
+    """Inverse of corpus_queues: shard numbers a worker consumes from."""
+    shards = set()
+    for name in queue_names:
+        parts = name.split(".")
+        if len(parts) == 3 and parts[1] == CORPUS_QUEUE_PREFIX and parts[2].isdigit():
+            shards.add(int(parts[2]))
+    return sorted(shards)
+
+
+def _corpus_id_from(args, kwargs) -> Optional[int]:
+    if kwargs and "corpus_id" in kwargs:
+        return kwargs["corpus_id"]
+    if args and len(args) >= 3:
+        return args[2]
+    return None
+
+
+def route_task(name, args, kwargs, options, task=None, **kw):
+    """
+    Celery router: send fuzzy searches to the queue owning their corpus.
+
+    submit_search passes an explicit queue with the priority class; other
+    callers land in the interactive queue of the corpus shard.
+    """
+    if name != "fuzzy_search_task":
+        return None
+    corpus_id = _corpus_id_from(args, kwargs)
+    if not isinstance(corpus_id, int):
+        return None
+    return {"queue": queue_for_corpus(corpus_id)}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Print corpus queue names for `celery worker -Q`")
+    parser.add_argument("--shards", help="Comma-separated shard numbers, default: all")
+    parser.add_argument(
+        "--priority",
+        help=f"Comma-separated priority classes ({', '.join(PRIORITIES)}), default: all"
+    )
+    args = parser.parse_args()
+
+    shards = [int(s) for s in args.shards.split(",")] if args.shards else None
+    priorities = args.priority.split(",") if args.priority else None
+    if priorities and not set(priorities) <= set(PRIORITIES):
+        parser.error(f"unknown priority class in {args.priority!r}")
+    print(",".join(corpus_queues(shards, priorities)))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,7 @@
-from pydantic import BaseModel
-from typing import List
+from pydantic import BaseModel, Field, model_validator
+from typing import Dict, List, Literal, Optional, Union
+
+from app.services.fuzzy_algorithms import BITAP_MAX_ERRORS, TEXT_ALGORITHMS, max_errors_limit
 
 class CorpusCreate(BaseModel):
     corpus_name: str
@@ -10,7 +12,29 @@ class CorpusOut(BaseModel):
     name: str
 
     class Config:
-        ord_mode = True
+        from_attributes = True
+
+class CorpusAppendIn(BaseModel):
+    text: str
+
+class CorpusVersionOut(BaseModel):
+    id: int
+    name: str
+    version: int
+
+class CorpusIndexOut(BaseModel):
+    corpus_id: int
+    # building: строится в фоне, поиск пока перебирает словарь; stale: не построен или отстал
+    status: Literal["building", "ready", "stale"]
+    # words: индекс слов FTS5; vocabulary: корпус мал, индекс не нужен
+    kind: Optional[str] = None
+    version: int
+    # версия корпуса, до которой доведён индекс
+    indexed_version: Optional[int] = None
+    updated_at: Optional[float] = None
+    error: Optional[str] = None
+    # шаги нормализации, с которыми построен индекс words
+    normalization: Optional[str] = None
 
 class CorpusListOut(BaseModel):
     corpuses: List[CorpusOut]
@@ -18,12 +42,65 @@ class CorpusListOut(BaseModel):
 class SearchRequest(BaseModel):
     word: str
     algorithm: str
-    corpus_id: int
+    corpus_id: Optional[int] = None
+    # несколько корпусов сразу: список id или "mine" — все корпуса пользователя
+    corpus_ids: Optional[Union[List[int], Literal["mine"]]] = None
+    # класс очереди для async_search; по умолчанию определяется по оценке стоимости
+    priority: Optional[Literal["interactive", "bulk"]] = None
+    # только для bitap: сколько правок допускается; по умолчанию 1
+    max_errors: Optional[int] = Field(None, ge=0, le=BITAP_MAX_ERRORS)
+
+    @model_validator(mode="after")
+    def one_target(self):
+        if (self.corpus_id is None) == (self.corpus_ids is None):
+            raise ValueError("Specify either corpus_id or corpus_ids")
+        if self.corpus_ids is not None and not self.corpus_ids:
+            raise ValueError("corpus_ids must not be empty")
+        if self.algorithm in TEXT_ALGORITHMS and not self.word:
+            raise ValueError("word must not be empty")
+        if self.max_errors is not None:
+            if self.algorithm not in TEXT_ALGORITHMS:
+                raise ValueError(f"max_errors applies to {list(TEXT_ALGORITHMS)} only")
+            if self.max_errors > max_errors_limit(self.word):
+                raise ValueError("max_errors must not exceed half the length of word")
+        return self
+
+    def search_params(self) -> dict:
+        """Algorithm parameters passed on to the search task."""
+        return {"max_errors": self.max_errors} if self.max_errors is not None else {}
 
 class SearchResult(BaseModel):
+    # нормализованное слово; для bitap — найденный фрагмент текста как есть
+    word: str
+    distance: int
+    # формы слова в тексте корпуса, если они отличаются от него самого ("Word,", "word.")
+    forms: Optional[List[str]] = None
+    corpus_id: Optional[int] = None
+    # bitap: позиция совпадения в тексте корпуса, end не включается
+    start: Optional[int] = None
+    end: Optional[int] = None
+
+class AutocompleteSuggestion(BaseModel):
     word: str
+    # расстояние от префикса запроса до начала слова
     distance: int
+    forms: Optional[List[str]] = None
+
+class AutocompleteResponse(BaseModel):
+    prefix: str
+    # допуск, с которым шёл поиск: запрошенный, но не больше трети длины префикса
+    max_distance: int
+    execution_time: float
+    suggestions: List[AutocompleteSuggestion]
 
 class SearchResponse(BaseModel):
     execution_time: float
     results: List[SearchResult]
+    profile_id: Optional[str] = None
+    # секунды по этапам: auth, queue_wait, corpus_load, candidates, scoring, scan, result_fetch
+    stages: Optional[Dict[str, float]] = None
+    # при SEARCH_MEMORY_TRACKING: peak_bytes и objects, прирост за время поиска
+    memory: Optional[Dict[str, int]] = None
+    # поиск по нескольким корпусам: удалённые корпуса и ошибки отдельных частей
+    missing: Optional[List[int]] = None
+    errors: Optional[Dict[int, str]] = None
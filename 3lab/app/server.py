@@ -0,0 +1,309 @@
+"""
+Pre-fork launcher for the API.
+
+The parent process binds the socket, imports the app and preloads the corpus
+vocabularies, then forks SERVER_WORKERS uvicorn workers that share the
+preloaded data copy-on-write. SIGHUP reloads the shared data and replaces the
+workers one at a time; SIGTERM/SIGINT shut everything down gracefully.
+"""
+import asyncio
+import gc
+import json
+import logging
+import os
+import select
+import signal
+import socket
+import tempfile
+import time
+from typing import Any, Dict, Optional
+
+SERVER_HOST = os.getenv("SERVER_HOST", "127.0.0.1")
+SERVER_PORT = int(os.getenv("SERVER_PORT", "8000"))
+SERVER_WORKERS = int(os.getenv("SERVER_WORKERS", "1"))
+SERVER_PRELOAD = os.getenv("SERVER_PRELOAD", "true").lower() in ("1", "true", "yes")
+SERVER_READY_TIMEOUT = float(os.getenv("SERVER_READY_TIMEOUT", "30"))
+SERVER_STOP_TIMEOUT = float(os.getenv("SERVER_STOP_TIMEOUT", "30"))
+
+logger = logging.getLogger("uvicorn.error")
+
+# worker index and start time of this process, set in forked workers
+worker_index: Optional[int] = None
+worker_started = time.time()
+# launcher state with per-worker details, written by the parent for /health
+state_file: Optional[str] = None
+
+
+class Worker:
+    def __init__(self, index: int, pid: int, ready_fd: int, generation: int):
+        self.index = index
+        self.pid = pid
+        self.ready_fd = ready_fd
+        self.generation = generation
+        self.started = time.time()
+        self.ready = False
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "index": self.index,
+            "pid": self.pid,
+            "generation": self.generation,
+            "started": self.started,
+            "ready": self.ready,
+        }
+
+
+def preload() -> int:
+    """Create tables and load corpus vocabularies before the workers are forked."""
+    from app.cruds import corpus as corpus_crud
+    from app.db.database import ReadSessionLocal, create_tables, dispose_engines
+    from app.services.corpus_cache import cache as corpus_cache
+
+    create_tables()
+    db = ReadSessionLocal()
+    try:
+        corpus_ids = corpus_crud.get_corpus_ids(db)
+    finally:
+        db.close()
+    corpus_cache.clear()
+    # the most recently uploaded corpora win when they do not all fit
+    loaded = corpus_cache.warm(reversed(corpus_ids))
+    # children must not inherit open SQLite connections
+    dispose_engines()
+    return loaded
+
+
+def read_state() -> Optional[Dict[str, Any]]:
+    """Launcher state written by the parent process, None when running without it."""
+    if state_file is None:
+        return None
+    try:
+        with open(state_file, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+class Launcher:
+    def __init__(self, app: Any, workers: int, host: str, port: int, **uvicorn_kwargs: Any):
+        self.app = app
+        self.workers_count = workers
+        self.host = host
+        self.port = port
+        self.config_kwargs = dict(uvicorn_kwargs, host=host, port=port)
+        self.sock: Optional[socket.socket] = None
+        self.workers: Dict[int, Worker] = {}
+        self.retiring: Dict[int, Worker] = {}
+        self.generation = 0
+        self.restarts = 0
+        self._stop = False
+        self._reload = False
+
+    def run(self) -> None:
+        global state_file
+        import uvicorn
+
+        # creating the config also sets up uvicorn logging for the launcher
+        self.sock = uvicorn.Config(self.app, **self.config_kwargs).bind_socket()
+        state_file = os.path.join(tempfile.gettempdir(), f"fuzzy-server-{os.getpid()}.json")
+        self._preload()
+
+        signal.signal(signal.SIGHUP, lambda *_: setattr(self, "_reload", True))
+        signal.signal(signal.SIGTERM, lambda *_: setattr(self, "_stop", True))
+        signal.signal(signal.SIGINT, lambda *_: setattr(self, "_stop", True))
+
+        for index in range(self.workers_count):
+            self._spawn(index)
+        logger.info(
+            f"Launcher {os.getpid()}: {self.workers_count} workers on http://{self.host}:{self.port}"
+        )
+        try:
+            while not self._stop:
+                if self._reload:
+                    self._reload = False
+                    self._rolling_restart()
+                self._reap()
+                self._check_ready()
+                self._write_state()
+                time.sleep(0.5)
+        finally:
+            self._shutdown()
+
+    def _preload(self) -> None:
+        if not SERVER_PRELOAD:
+            return
+        started = time.perf_counter()
+        loaded = preload()
+        # keep the preloaded objects out of the collector so GC passes in the
+        # workers do not write to (and un-share) their pages
+        gc.collect()
+        gc.freeze()
+        logger.info(
+            f"Launcher: preloaded {loaded} corpora in {(time.perf_counter() - started) * 1000:.0f} ms"
+        )
+
+    def _spawn(self, index: int, generation: Optional[int] = None) -> Worker:
+        ready_r, ready_w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(ready_r)
+            code = 0
+            try:
+                self._run_worker(index, ready_w)
+            except BaseException:
+                logger.exception(f"Worker {index} crashed")
+                code = 1
+            finally:
+                os._exit(code)
+        os.close(ready_w)
+        worker = Worker(index, pid, ready_r, self.generation if generation is None else generation)
+        self.workers[index] = worker
+        return worker
+
+    def _run_worker(self, index: int, ready_fd: int) -> None:
+        global worker_index, worker_started
+        import uvicorn
+        from app.db.database import dispose_engines
+
+        for signum in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, signal.SIG_DFL)
+        # Ctrl+C in the terminal reaches only the launcher, which stops the
+        # workers with a single SIGTERM (a second signal would force-exit uvicorn)
+        os.setpgid(0, 0)
+        for sibling in list(self.workers.values()) + list(self.retiring.values()):
+            if sibling.ready_fd != -1:
+                os.close(sibling.ready_fd)
+        worker_index = index
+        worker_started = time.time()
+        dispose_engines(close=False)
+
+        server = uvicorn.Server(uvicorn.Config(self.app, **self.config_kwargs))
+        asyncio.run(self._serve(server, ready_fd))
+
+    async def _serve(self, server, ready_fd: int) -> None:
+        task = asyncio.create_task(server.serve(sockets=[self.sock]))
+        while not server.started and not task.done():
+            await asyncio.sleep(0.05)
+        if server.started:
+            os.write(ready_fd, b"1")
+        os.close(ready_fd)
+        await task
+
+    def _check_ready(self, timeout: float = 0) -> None:
+        pending = {w.ready_fd: w for w in self.workers.values() if w.ready_fd != -1}
+        if not pending:
+            return
+        readable, _, _ = select.select(list(pending), [], [], timeout)
+        for fd in readable:
+            worker = pending[fd]
+            # EOF without the ready byte means the worker died during start-up
+            worker.ready = bool(os.read(fd, 1))
+            self._close_ready(worker)
+
+    @staticmethod
+    def _close_ready(worker: Worker) -> None:
+        if worker.ready_fd != -1:
+            os.close(worker.ready_fd)
+            worker.ready_fd = -1
+
+    def _wait_ready(self, worker: Worker) -> bool:
+        deadline = time.monotonic() + SERVER_READY_TIMEOUT
+        while not worker.ready and worker.ready_fd != -1 and time.monotonic() < deadline:
+            self._check_ready(timeout=min(0.5, max(0.0, deadline - time.monotonic())))
+        return worker.ready
+
+    def _rolling_restart(self) -> None:
+        """Replace workers one by one; each old worker stops only once its successor is ready."""
+        logger.info("Launcher: rolling restart")
+        self._preload()
+        # /health видит новое поколение, только когда заменены все воркеры
+        generation = self.generation + 1
+        for index in sorted(self.workers):
+            old = self.workers[index]
+            new = self._spawn(index, generation)
+            if not self._wait_ready(new):
+                logger.error(f"Launcher: worker {index} did not start, keeping pid {old.pid}")
+                self._kill(new.pid, signal.SIGKILL)
+                self._close_ready(new)
+                self.retiring[new.pid] = new
+                self.workers[index] = old
+                return
+            self.retiring[old.pid] = old
+            self._kill(old.pid, signal.SIGTERM)
+        self.generation = generation
+        logger.info(f"Launcher: generation {self.generation} is serving")
+
+    def _reap(self) -> None:
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            retired = self.retiring.pop(pid, None)
+            if retired is not None:
+                self._close_ready(retired)
+                continue
+            for index, worker in list(self.workers.items()):
+                if worker.pid == pid:
+                    logger.warning(f"Launcher: worker {index} (pid {pid}) exited with status {status}")
+                    self._close_ready(worker)
+                    del self.workers[index]
+                    if not self._stop:
+                        self.restarts += 1
+                        self._spawn(index)
+
+    def _write_state(self) -> None:
+        state = {
+            "launcher_pid": os.getpid(),
+            "generation": self.generation,
+            "restarts": self.restarts,
+            "workers": [self.workers[i].as_dict() for i in sorted(self.workers)],
+        }
+        tmp_path = f"{state_file}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, state_file)
+
+    def _shutdown(self) -> None:
+        children = list(self.workers.values()) + list(self.retiring.values())
+        for worker in children:
+            self._kill(worker.pid, signal.SIGTERM)
+        deadline = time.monotonic() + SERVER_STOP_TIMEOUT
+        pending = {worker.pid for worker in children}
+        while pending and time.monotonic() < deadline:
+            for pid in list(pending):
+                try:
+                    if os.waitpid(pid, os.WNOHANG)[0] == pid:
+                        pending.discard(pid)
+                except ChildProcessError:
+                    pending.discard(pid)
+            time.sleep(0.1)
+        for pid in pending:
+            self._kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+        if state_file and os.path.exists(state_file):
+            os.remove(state_file)
+        logger.info("Launcher: stopped")
+
+    @staticmethod
+    def _kill(pid: int, signum: int) -> None:
+        try:
+            os.kill(pid, signum)
+        except ProcessLookupError:
+            pass
+
+
+def serve(app: Any, workers: int = SERVER_WORKERS, host: str = SERVER_HOST,
+          port: int = SERVER_PORT, **uvicorn_kwargs: Any) -> None:
+    """Run the app with `workers` pre-forked processes, or in-process where fork is unavailable."""
+    import uvicorn
+
+    if workers > 1 and not hasattr(os, "fork"):
+        logger.warning("Launcher: os.fork is not available, running a single worker")
+        workers = 1
+    if workers <= 1:
+        uvicorn.run(app, host=host, port=port, **uvicorn_kwargs)
+        return
+    Launcher(app, workers, host, port, **uvicorn_kwargs).run()
@@ -0,0 +1,227 @@
+"""
+Admission control for queued searches.
+
+Before a search is enqueued, submit_search checks the corpus queue it goes
+to: the messages waiting in it (read from the broker), the estimated work
+they hold and the searches the user already has in flight. Over any limit
+the search is rejected with Overloaded, which the API turns into 429 with
+Retry-After, so a spike is refused at the door instead of growing the
+queue and the latency of everyone behind it.
+
+Queued work is the sum of priority.estimate_cost of the searches admitted
+into a queue and not started yet. It lives in Redis next to the result
+backend: the worker removes a search when it starts, entries older than
+ADMISSION_QUEUE_TIMEOUT (tasks that expired or were lost) are pruned on
+the next check. Without a Redis backend only the queue depth is checked.
+The checks and the enqueue are not atomic, concurrent submissions can
+overshoot a limit by a few searches.
+"""
+import logging
+import math
+import os
+import threading
+import time
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    from celery import Celery
+
+logger = logging.getLogger(__name__)
+
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() in ("1", "true", "yes")
+# сообщений в одной очереди корпуса; 0 — без ограничения
+ADMISSION_MAX_QUEUE_DEPTH = int(os.getenv("ADMISSION_MAX_QUEUE_DEPTH", "500"))
+# оценка ожидания в очереди, секунды: работа в очереди / ADMISSION_COST_RATE; 0 — без ограничения
+ADMISSION_MAX_WAIT = float(os.getenv("ADMISSION_MAX_WAIT", "30"))
+# единиц estimate_cost (слов словаря * длина запроса), которые очередь обрабатывает за секунду
+ADMISSION_COST_RATE = float(os.getenv("ADMISSION_COST_RATE", "250000"))
+# поисков в очереди или в работе на одного пользователя; 0 — без ограничения
+ADMISSION_USER_INFLIGHT = int(os.getenv("ADMISSION_USER_INFLIGHT", "20"))
+# задача, не начатая за это время, отбрасывается воркером (REVOKED); 0 — без срока
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "120"))
+# сколько секунд процесс API переиспользует прочитанную длину очереди
+ADMISSION_DEPTH_CACHE = float(os.getenv("ADMISSION_DEPTH_CACHE", "0.5"))
+ADMISSION_RETRY_MAX = int(os.getenv("ADMISSION_RETRY_MAX", "60"))
+
+QUEUED_PREFIX = "fuzzy:admission:queued:"
+COST_PREFIX = "fuzzy:admission:cost:"
+USER_PREFIX = "fuzzy:admission:user:"
+OWNER_PREFIX = "fuzzy:admission:owner:"
+# через сколько секунд забывается поиск пользователя (и очереди без ADMISSION_QUEUE_TIMEOUT),
+# если воркер так и не отчитался о нём
+STALE_AFTER = 600
+
+
+class Overloaded(Exception):
+    """The search would exceed a capacity limit; retry after `retry_after` seconds."""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+_depths: Dict[str, Tuple[float, int]] = {}
+_depths_lock = threading.Lock()
+
+
+def queue_timeout() -> Optional[float]:
+    """`expires` for admitted tasks, so that none waits in a queue longer than this."""
+    return ADMISSION_QUEUE_TIMEOUT if ADMISSION_ENABLED and ADMISSION_QUEUE_TIMEOUT > 0 else None
+
+
+def queue_depth(celery: "Celery", queue: str) -> int:
+    """Messages waiting in the broker queue, cached for ADMISSION_DEPTH_CACHE seconds."""
+    now = time.monotonic()
+    cached = _depths.get(queue)
+    if cached is not None and now - cached[0] < ADMISSION_DEPTH_CACHE:
+        return cached[1]
+    from kombu.exceptions import ChannelError
+
+    try:
+        with celery.connection_for_read() as conn:
+            depth = conn.default_channel.queue_declare(queue=queue, passive=True).message_count
+    except ChannelError:
+        # очередь ещё не объявлена: ни воркер, ни отправитель её не создавали
+        depth = 0
+    with _depths_lock:
+        _depths[queue] = (now, depth)
+    return depth
+
+
+def _redis(celery: "Celery"):
+    from app.services.search_tasks import _redis as backend_redis
+    return backend_redis(celery)
+
+
+def _decode(value) -> str:
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def _stale_before() -> float:
+    return time.time() - (ADMISSION_QUEUE_TIMEOUT if ADMISSION_QUEUE_TIMEOUT > 0 else STALE_AFTER)
+
+
+def _queued_work(client, queue: str) -> Tuple[int, int]:
+    """(searches, cost) admitted into the queue and not started yet."""
+    stale = client.zrangebyscore(QUEUED_PREFIX + queue, "-inf", _stale_before())
+    pipe = client.pipeline()
+    if stale:
+        pipe.zrem(QUEUED_PREFIX + queue, *stale)
+        pipe.hdel(COST_PREFIX + queue, *stale)
+    pipe.hvals(COST_PREFIX + queue)
+    costs = pipe.execute()[-1]
+    return len(costs), sum(int(cost) for cost in costs)
+
+
+def _user_inflight(client, user: str) -> int:
+    pipe = client.pipeline()
+    pipe.zremrangebyscore(USER_PREFIX + user, "-inf", time.time() - STALE_AFTER)
+    pipe.zcard(USER_PREFIX + user)
+    return pipe.execute()[-1]
+
+
+def _retry_after(seconds: float) -> int:
+    return max(1, min(ADMISSION_RETRY_MAX, math.ceil(seconds)))
+
+
+def check(celery: "Celery", targets: List[Tuple[str, int]], user: Optional[str] = None) -> None:
+    """
+    Raise Overloaded if the searches (queue, estimated cost) can't be admitted.
+
+    A queue is full when it holds ADMISSION_MAX_QUEUE_DEPTH messages or when
+    its queued work plus the new search would take longer than
+    ADMISSION_MAX_WAIT seconds to drain; Retry-After is the time to drain
+    the excess. A user is limited to ADMISSION_USER_INFLIGHT searches.
+    """
+    if not ADMISSION_ENABLED:
+        return
+    client = _redis(celery)
+    if user and client is not None and ADMISSION_USER_INFLIGHT > 0:
+        if _user_inflight(client, user) >= ADMISSION_USER_INFLIGHT:
+            wait = max((_queued_work(client, queue)[1] for queue, _ in targets), default=0)
+            raise Overloaded(
+                f"Too many searches in flight (limit {ADMISSION_USER_INFLIGHT})",
+                _retry_after(wait / ADMISSION_COST_RATE)
+            )
+
+    for queue, cost in targets:
+        queued, work = _queued_work(client, queue) if client is not None else (0, 0)
+        if ADMISSION_MAX_QUEUE_DEPTH > 0:
+            depth = queue_depth(celery, queue)
+            if depth >= ADMISSION_MAX_QUEUE_DEPTH:
+                average = work / queued if queued else cost
+                excess = (depth - ADMISSION_MAX_QUEUE_DEPTH + 1) * average
+                raise Overloaded(
+                    f"Queue {queue} is full ({depth} searches waiting)",
+                    _retry_after(excess / ADMISSION_COST_RATE)
+                )
+        if ADMISSION_MAX_WAIT > 0:
+            wait = (work + cost) / ADMISSION_COST_RATE
+            # поиск дороже всего лимита принимается в пустую очередь, иначе его не выполнить никогда
+            if wait > ADMISSION_MAX_WAIT and work > 0:
+                raise Overloaded(
+                    f"Queue {queue} holds about {work / ADMISSION_COST_RATE:.0f} s of work",
+                    _retry_after(wait - ADMISSION_MAX_WAIT)
+                )
+
+
+def record(
+    celery: "Celery", task_id: str, parts: List[Tuple[str, str, int]], user: Optional[str] = None
+) -> None:
+    """Account an admitted search: its (part id, queue, cost) parts and, per user, the task."""
+    if not ADMISSION_ENABLED:
+        return
+    client = _redis(celery)
+    if client is None:
+        return
+    now = time.time()
+    pipe = client.pipeline()
+    for part_id, queue, cost in parts:
+        pipe.zadd(QUEUED_PREFIX + queue, {part_id: now})
+        pipe.hset(COST_PREFIX + queue, part_id, cost)
+    if user:
+        pipe.zadd(USER_PREFIX + user, {task_id: now})
+        pipe.expire(USER_PREFIX + user, STALE_AFTER)
+        pipe.set(OWNER_PREFIX + task_id, user, ex=STALE_AFTER)
+    pipe.execute()
+
+
+def withdraw(celery: "Celery", task_id: str, parts: List[Tuple[str, str, int]]) -> None:
+    """Undo `record` for a search that never reached the broker."""
+    client = _redis(celery)
+    if client is None:
+        return
+    pipe = client.pipeline()
+    for part_id, queue, _ in parts:
+        pipe.zrem(QUEUED_PREFIX + queue, part_id)
+        pipe.hdel(COST_PREFIX + queue, part_id)
+    pipe.execute()
+    finished(celery, task_id)
+
+
+def started(celery: "Celery", task_id: str, queue: Optional[str]) -> Optional[float]:
+    """Take a search out of its queue's work; returns how long it waited, if known."""
+    client = _redis(celery)
+    if client is None or not queue:
+        return None
+    pipe = client.pipeline()
+    pipe.zscore(QUEUED_PREFIX + queue, task_id)
+    pipe.zrem(QUEUED_PREFIX + queue, task_id)
+    pipe.hdel(COST_PREFIX + queue, task_id)
+    admitted_at = pipe.execute()[0]
+    return time.time() - admitted_at if admitted_at is not None else None
+
+
+def finished(celery: "Celery", task_id: str) -> None:
+    """Drop the search from the in-flight searches of its user."""
+    client = _redis(celery)
+    if client is None:
+        return
+    user = client.get(OWNER_PREFIX + task_id)
+    if user is None:
+        return
+    pipe = client.pipeline()
+    pipe.zrem(USER_PREFIX + _decode(user), task_id)
+    pipe.delete(OWNER_PREFIX + task_id)
+    pipe.execute()
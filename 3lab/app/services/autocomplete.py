@@ -0,0 +1,257 @@
+"""
+Type-ahead suggestions from a per-corpus trie of the vocabulary.
+
+The trie holds normalized words (app.services.normalization), and the
+prefix is normalized the same way; suggestions list the surface forms of
+words that appear in the text in other forms.
+
+The trie is the sorted vocabulary itself: a node is the range of words
+sharing its prefix and its children are found by bisection, so a million
+words cost a list of references instead of millions of node objects.
+
+Exact-prefix completion walks down to the node of the prefix. Fuzzy-prefix
+search walks the trie from the root keeping one row of the Levenshtein
+matrix per node, computed from the row of its parent, so a prefix shared by
+many words is scored once; a branch is cut as soon as every cell of its row
+exceeds the allowed distance. Every node whose row ends within the distance
+is the root of matching completions, which are then taken shortest first.
+
+Most nodes on the way sit at the limit (the smallest cell of their row equals
+the allowed distance). Only a child that extends one of those cells by a
+matching character can stay within it, so such a node looks up the few
+children named by the query instead of listing all of them.
+"""
+import heapq
+import os
+import threading
+import time
+from bisect import bisect_left
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from app.cruds import corpus as corpus_crud
+from app.db.database import ReadSessionLocal
+from app.services import normalization
+from app.services.corpus_cache import CorpusCache
+
+AUTOCOMPLETE_CACHE_SIZE = int(os.getenv("AUTOCOMPLETE_CACHE_SIZE", "8"))
+# верхняя граница опечаток в префиксе; фактически не больше трети его длины
+AUTOCOMPLETE_MAX_DISTANCE = int(os.getenv("AUTOCOMPLETE_MAX_DISTANCE", "2"))
+AUTOCOMPLETE_MAX_LIMIT = 50
+
+# sorts after any character a word may continue with
+_LAST = "\U0010ffff"
+
+# (distance, depth, prefix, lo, hi): a node and the distance of its prefix to the query
+Node = Tuple[int, int, str, int, int]
+
+
+def distance_limit(prefix: str, max_distance: int) -> int:
+    """Typos allowed in a prefix: a short prefix with many typos would match most of the vocabulary."""
+    return max(0, min(max_distance, AUTOCOMPLETE_MAX_DISTANCE, len(prefix) // 3))
+
+
+class SortedTrie:
+    """Trie over a sorted list of distinct words; a node is the range of words with its prefix."""
+
+    def __init__(self, words: Iterable[str]):
+        self.words: List[str] = sorted(words)
+
+    def __len__(self) -> int:
+        return len(self.words)
+
+    def __contains__(self, word: str) -> bool:
+        i = bisect_left(self.words, word)
+        return i < len(self.words) and self.words[i] == word
+
+    def extended(self, words: Iterable[str]) -> "SortedTrie":
+        """A new trie with `words` added; searches running on this one are not disturbed."""
+        new = set(words).difference(self.words)
+        trie = SortedTrie(())
+        trie.words = list(heapq.merge(self.words, sorted(new))) if new else self.words
+        return trie
+
+    def complete(self, prefix: str, limit: int, max_distance: int = 0) -> List[Tuple[str, int]]:
+        """
+        Up to `limit` (word, distance) pairs: words starting with a prefix at
+        most `max_distance` edits from `prefix`, by distance, length and word.
+
+        Each larger distance is searched only if the smaller ones found fewer
+        than `limit` words, since its words would rank below theirs.
+        """
+        found: List[Tuple[str, int]] = []
+        if limit <= 0:
+            return found
+        lo = bisect_left(self.words, prefix)
+        hi = bisect_left(self.words, prefix + _LAST, lo)
+        if lo < hi:
+            found = self._shortest([(0, len(prefix), prefix, lo, hi)], limit)
+        for distance in range(1, max_distance + 1):
+            if len(found) >= limit:
+                break
+            found = self._shortest(self._fuzzy_roots(prefix, distance), limit)
+        return found
+
+    def _children(self, lo: int, hi: int, depth: int) -> Iterator[Tuple[int, int]]:
+        """Ranges of the children of a node at `depth`."""
+        words = self.words
+        if len(words[lo]) == depth:
+            # слово, равное префиксу узла, стоит первым в его диапазоне
+            lo += 1
+        while lo < hi:
+            end = bisect_left(words, words[lo][:depth + 1] + _LAST, lo + 1, hi)
+            yield lo, end
+            lo = end
+
+    def _child(self, lo: int, hi: int, depth: int, char: str) -> Optional[Tuple[int, int]]:
+        """Range of the child of a node at `depth` reached by `char`, None if there is none."""
+        words = self.words
+        key = words[lo][:depth] + char
+        child_lo = bisect_left(words, key, lo, hi)
+        if child_lo == hi or not words[child_lo].startswith(key):
+            return None
+        return child_lo, bisect_left(words, key + _LAST, child_lo + 1, hi)
+
+    def _fuzzy_roots(self, prefix: str, max_distance: int) -> List[Node]:
+        """Nodes whose prefix is within `max_distance` edits of `prefix`."""
+        words = self.words
+        roots: List[Node] = []
+        if not words:
+            return roots
+        size = len(prefix) + 1
+        # (lo, hi, depth, row, smallest cell of the row)
+        stack = [(0, len(words), 0, list(range(size)), 0)]
+        while stack:
+            lo, hi, depth, row, lowest = stack.pop()
+            if lowest < max_distance:
+                children: Iterable[Tuple[int, int]] = self._children(lo, hi, depth)
+            else:
+                # на границе допуска уложится только ребёнок с буквой запроса после клетки, равной допуску
+                chars = {prefix[j] for j in range(size - 1) if row[j] == max_distance}
+                children = filter(None, (self._child(lo, hi, depth, char) for char in sorted(chars)))
+            for child_lo, child_hi in children:
+                char = words[child_lo][depth]
+                left = row[0] + 1
+                new = [left]
+                smallest = left
+                for j in range(1, size):
+                    # без min(): строка считается на каждом узле обхода
+                    cell = row[j - 1] if prefix[j - 1] == char else row[j - 1] + 1
+                    if row[j] + 1 < cell:
+                        cell = row[j] + 1
+                    if left + 1 < cell:
+                        cell = left + 1
+                    new.append(cell)
+                    left = cell
+                    if cell < smallest:
+                        smallest = cell
+                if left <= max_distance:
+                    roots.append((left, depth + 1, words[child_lo][:depth + 1], child_lo, child_hi))
+                # глубже стоит идти, только если там расстояние может стать меньше
+                if smallest < left and smallest <= max_distance:
+                    stack.append((child_lo, child_hi, depth + 1, new, smallest))
+        return roots
+
+    def _shortest(self, roots: List[Node], limit: int) -> List[Tuple[str, int]]:
+        """Words under the roots, best-first by (distance, length, word), each once."""
+        words = self.words
+        heap = list(roots)
+        heapq.heapify(heap)
+        found: List[Tuple[str, int]] = []
+        seen = set()
+        while heap and len(found) < limit:
+            distance, depth, _, lo, hi = heapq.heappop(heap)
+            word = words[lo]
+            if len(word) == depth and word not in seen:
+                seen.add(word)
+                found.append((word, distance))
+            for child_lo, child_hi in self._children(lo, hi, depth):
+                heapq.heappush(
+                    heap, (distance, depth + 1, words[child_lo][:depth + 1], child_lo, child_hi)
+                )
+        return found
+
+
+class CorpusTrie:
+    """Trie of one corpus; appends are merged into a new trie when the version moves on."""
+
+    def __init__(self, corpus_id: int, tokens: Iterable[str], version: int = 1):
+        self.corpus_id = corpus_id
+        grouped = normalization.group(tokens)
+        self.trie = SortedTrie(grouped)
+        self.forms = normalization.differing_forms(grouped)
+        self.version = version
+        self.checked = time.monotonic()
+        self._lock = threading.Lock()
+
+    def refresh(self, db: Session) -> int:
+        """Catch up with the appends made since `version`; return the number of new words."""
+        self.checked = time.monotonic()
+        version = corpus_crud.get_corpus_version(db, self.corpus_id)
+        if version is None or version <= self.version:
+            return 0
+        with self._lock:
+            tokens: List[str] = []
+            for append_version, text in corpus_crud.get_appended_texts(db, self.corpus_id, self.version):
+                if append_version > self.version:
+                    tokens.extend(text.split())
+                    self.version = append_version
+            grouped = normalization.group(tokens)
+            for word, surfaces in grouped.items():
+                known = set(self.forms.get(word, [word])) if word in self.trie else set()
+                listed = normalization.surface_forms(word, known | surfaces)
+                if listed:
+                    self.forms[word] = listed
+            size = len(self.trie)
+            self.trie = self.trie.extended(grouped)
+            return len(self.trie) - size
+
+
+class TrieCache(CorpusCache):
+    """LRU cache of corpus tries, kept apart from the search vocabularies."""
+
+    @staticmethod
+    def _load(corpus_id: int, db: Optional[Session]) -> Optional[CorpusTrie]:
+        own_session = db is None
+        if own_session:
+            db = ReadSessionLocal()
+        try:
+            vocabulary = corpus_crud.get_vocabulary(db, corpus_id)
+        finally:
+            if own_session:
+                db.close()
+        if vocabulary is None:
+            return None
+        version, words = vocabulary
+        return CorpusTrie(corpus_id, words, version)
+
+
+cache = TrieCache(AUTOCOMPLETE_CACHE_SIZE)
+
+
+def suggest(
+    corpus_id: int, prefix: str, limit: int = 10, max_distance: int = 0,
+    db: Optional[Session] = None
+) -> Optional[dict]:
+    """Suggestions for `prefix` in a corpus, None if there is no such corpus."""
+    start_time = time.time()
+    entry = cache.get(corpus_id, db)
+    if entry is None:
+        return None
+    # префикс из одной пунктуации ничего не дополняет
+    normalized = normalization.normalize(prefix)
+    distance = distance_limit(normalized, max_distance)
+    suggestions = entry.trie.complete(normalized, min(limit, AUTOCOMPLETE_MAX_LIMIT), distance) if normalized else []
+    listed = []
+    for word, d in suggestions:
+        suggestion = {"word": word, "distance": d}
+        if word in entry.forms:
+            suggestion["forms"] = entry.forms[word]
+        listed.append(suggestion)
+    return {
+        "prefix": prefix,
+        "max_distance": distance,
+        "execution_time": round(time.time() - start_time, 4),
+        "suggestions": listed,
+    }
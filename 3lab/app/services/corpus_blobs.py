@@ -0,0 +1,111 @@
+"""
+Compressed, content-addressed storage of corpus texts.
+
+A text is stored once in `corpus_blobs` under the SHA-256 of its UTF-8
+bytes, so identical uploads share one row. Blobs are compressed with zstd
+when the `zstandard` package is installed and with zlib otherwise; every
+blob records its codec, so both kinds stay readable.
+
+Next to the text a blob keeps its vocabulary (the distinct words, sorted
+and newline-separated, compressed the same way). That is all a word search
+needs: loading a corpus decompresses the vocabulary, never the text, which
+only the substring search streams through.
+"""
+import codecs
+import hashlib
+import logging
+import os
+import zlib
+from typing import Iterable, Iterator, List
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+ZSTD = "zstd"
+ZLIB = "zlib"
+
+# zstd, если установлен пакет zstandard, иначе zlib
+CORPUS_BLOB_CODEC = os.getenv("CORPUS_BLOB_CODEC", ZSTD if zstandard is not None else ZLIB).lower()
+# zlib: 1-9, zstd: 1-22; корпуса пишутся редко, поэтому по умолчанию сильное сжатие
+CORPUS_BLOB_LEVEL = int(os.getenv("CORPUS_BLOB_LEVEL", "9"))
+
+if CORPUS_BLOB_CODEC == ZSTD and zstandard is None:
+    logger.warning("CORPUS_BLOB_CODEC=zstd needs the zstandard package, falling back to zlib")
+    CORPUS_BLOB_CODEC = ZLIB
+if CORPUS_BLOB_CODEC not in (ZSTD, ZLIB):
+    raise ValueError(f"Unknown CORPUS_BLOB_CODEC {CORPUS_BLOB_CODEC!r}, expected {ZSTD} or {ZLIB}")
+
+# compressed bytes fed to the decompressor per step of iter_text
+READ_SIZE = 1 << 18
+# upper bound on the decompressed bytes iter_text holds at a time
+WRITE_SIZE = 1 << 20
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def compress(data: bytes, codec: str = CORPUS_BLOB_CODEC) -> bytes:
+    if codec == ZSTD:
+        return zstandard.ZstdCompressor(level=CORPUS_BLOB_LEVEL).compress(data)
+    return zlib.compress(data, CORPUS_BLOB_LEVEL)
+
+
+def decompress(data: bytes, codec: str) -> bytes:
+    if codec == ZSTD:
+        return _zstd().decompress(data)
+    return zlib.decompress(data)
+
+
+def _zstd() -> "zstandard.ZstdDecompressor":
+    if zstandard is None:
+        raise RuntimeError("Corpus is stored with zstd, install the zstandard package to read it")
+    return zstandard.ZstdDecompressor()
+
+
+def _stream(data: bytes, codec: str) -> Iterator[bytes]:
+    if codec == ZSTD:
+        yield from _zstd().read_to_iter(data, read_size=READ_SIZE, write_size=WRITE_SIZE)
+        return
+    decompressor = zlib.decompressobj()
+    view = memoryview(data)
+    for start in range(0, len(data), READ_SIZE):
+        pending = view[start:start + READ_SIZE]
+        while pending:
+            out = decompressor.decompress(pending, WRITE_SIZE)
+            if out:
+                yield out
+            pending = decompressor.unconsumed_tail
+    out = decompressor.flush()
+    if out:
+        yield out
+
+
+def iter_text(data: bytes, codec: str) -> Iterator[str]:
+    """Decompress a text blob piece by piece; only one piece is held at a time."""
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    for piece in _stream(data, codec):
+        text = decoder.decode(piece)
+        if text:
+            yield text
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+
+def pack_text(text: str) -> bytes:
+    return compress(text.encode("utf-8"))
+
+
+def pack_vocabulary(words: Iterable[str]) -> bytes:
+    # отсортированные слова с общими префиксами сжимаются заметно лучше
+    return compress("\n".join(sorted(words)).encode("utf-8"))
+
+
+def unpack_vocabulary(data: bytes, codec: str) -> List[str]:
+    raw = decompress(data, codec).decode("utf-8")
+    return raw.split("\n") if raw else []
@@ -0,0 +1,231 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Set
+
+from sqlalchemy.orm import Session
+
+from app.cruds import corpus as corpus_crud
+from app.db.database import ReadSessionLocal
+from app.services import normalization, word_index
+
+CORPUS_CACHE_SIZE = int(os.getenv("CORPUS_CACHE_SIZE", "32"))
+# как часто (секунды) сверять версию закэшированного корпуса с базой; 0 - при каждом обращении
+CORPUS_CACHE_RECHECK = float(os.getenv("CORPUS_CACHE_RECHECK", "1"))
+
+
+class CachedCorpus:
+    """
+    Vocabulary of one corpus, ready to be scored against.
+
+    `words` are normalized (app.services.normalization); `forms` maps those
+    that appear in the text in other forms to their surface forms.
+
+    Corpora with a word index keep no vocabulary in memory (`words` is None);
+    their candidates are looked up in the index per query. A corpus whose
+    index is still being built is scanned (`index_pending`) and drops its
+    vocabulary once a refresh finds the index ready.
+
+    Appends only add words, so catching up with a newer version of the corpus
+    extends the vocabulary in place by the words of the newer appends.
+    """
+
+    def __init__(
+        self, corpus_id: int, words: Optional[List[str]], version: int = 1, index_pending: bool = False,
+        forms: Optional[Dict[str, List[str]]] = None
+    ):
+        self.corpus_id = corpus_id
+        self.words = words
+        self.version = version
+        self.index_pending = index_pending
+        # у корпусов с индексом слов формы хранит индекс
+        self.forms: Dict[str, List[str]] = forms if forms is not None else {}
+        self.checked = time.monotonic()
+        self._vocabulary: Optional[Set[str]] = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_tokens(
+        cls, corpus_id: int, tokens: Iterable[str], version: int = 1, index_pending: bool = False
+    ) -> "CachedCorpus":
+        """A corpus whose vocabulary is the normalized distinct tokens of its text."""
+        grouped = normalization.group(tokens)
+        return cls(corpus_id, list(grouped), version, index_pending, normalization.differing_forms(grouped))
+
+    @property
+    def size(self) -> int:
+        """Number of words a single query scores."""
+        if self.words is None:
+            return word_index.WORD_INDEX_CANDIDATES
+        return len(self.words)
+
+    def candidates(self, word: str, db: Optional[Session] = None) -> List[str]:
+        """Words to score for `word`: the whole vocabulary or the index candidates."""
+        if self.words is not None:
+            return self.words
+        own_session = db is None
+        if own_session:
+            db = ReadSessionLocal()
+        try:
+            return word_index.candidates(db, self.corpus_id, word)
+        finally:
+            if own_session:
+                db.close()
+
+    def attach_forms(self, results: List[dict], db: Optional[Session] = None) -> List[dict]:
+        """Add `forms` to the results whose word appears in the text in other forms."""
+        if self.words is not None:
+            forms = self.forms
+        else:
+            own_session = db is None
+            if own_session:
+                db = ReadSessionLocal()
+            try:
+                forms = word_index.forms_of(db, self.corpus_id, [r["word"] for r in results])
+            finally:
+                if own_session:
+                    db.close()
+        for result in results:
+            listed = forms.get(result["word"])
+            if listed:
+                result["forms"] = listed
+        return results
+
+    def refresh(self, db: Session) -> int:
+        """Catch up with the appends made since `version`; return the number of new words."""
+        self.checked = time.monotonic()
+        if self.index_pending and corpus_crud.word_index_ready(db, self.corpus_id):
+            with self._lock:
+                # поиски, уже перебирающие words, дорабатывают со своей ссылкой на список
+                self.words = None
+                self.forms = {}
+                self._vocabulary = None
+                self.index_pending = False
+        version = corpus_crud.get_corpus_version(db, self.corpus_id)
+        if version is None or version <= self.version:
+            return 0
+        with self._lock:
+            added = 0
+            for append_version, text in corpus_crud.get_appended_texts(db, self.corpus_id, self.version):
+                if append_version <= self.version:
+                    continue
+                if self.words is not None:
+                    added += self._extend(text.split())
+                self.version = append_version
+            return added
+
+    def _extend(self, tokens: Iterable[str]) -> int:
+        # the list only grows, so searches iterating it concurrently stay valid
+        if self._vocabulary is None:
+            self._vocabulary = set(self.words)
+        new = []
+        for word, surfaces in normalization.group(tokens).items():
+            known = set(self.forms.get(word, [word])) if word in self._vocabulary else set()
+            if not surfaces <= known:
+                listed = normalization.surface_forms(word, known | surfaces)
+                if listed:
+                    self.forms[word] = listed
+            if not known:
+                new.append(word)
+        self._vocabulary.update(new)
+        self.words.extend(new)
+        return len(new)
+
+
+class CorpusCache:
+    """Bounded per-process LRU cache of corpus vocabularies."""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries: "OrderedDict[int, CachedCorpus]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(
+        self, corpus_id: int, db: Optional[Session] = None, fresh: bool = False
+    ) -> Optional[CachedCorpus]:
+        """
+        Return the cached corpus, loading it from the database on a miss.
+
+        A hit is checked against the corpus version at most every
+        CORPUS_CACHE_RECHECK seconds, or right away with `fresh`.
+        """
+        with self._lock:
+            entry = self._entries.get(corpus_id)
+            if entry is not None:
+                self._entries.move_to_end(corpus_id)
+        if entry is not None:
+            if fresh or time.monotonic() - entry.checked >= CORPUS_CACHE_RECHECK:
+                self._refresh(entry, db)
+            return entry
+
+        entry = self._load(corpus_id, db)
+        if entry is not None:
+            self.put(entry)
+        return entry
+
+    def put(self, entry: CachedCorpus) -> None:
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[entry.corpus_id] = entry
+            self._entries.move_to_end(entry.corpus_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def __contains__(self, corpus_id: int) -> bool:
+        return corpus_id in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def warm(self, corpus_ids: Iterable[int]) -> int:
+        """Preload corpora (up to the cache size) in one session."""
+        loaded = 0
+        db = ReadSessionLocal()
+        try:
+            for corpus_id in corpus_ids:
+                if loaded >= self.max_size:
+                    break
+                if self.get(corpus_id, db) is not None:
+                    loaded += 1
+        finally:
+            db.close()
+        return loaded
+
+    @staticmethod
+    def _refresh(entry: CachedCorpus, db: Optional[Session]) -> None:
+        own_session = db is None
+        if own_session:
+            db = ReadSessionLocal()
+        try:
+            entry.refresh(db)
+        finally:
+            if own_session:
+                db.close()
+
+    @staticmethod
+    def _load(corpus_id: int, db: Optional[Session]) -> Optional[CachedCorpus]:
+        own_session = db is None
+        if own_session:
+            db = ReadSessionLocal()
+        try:
+            if corpus_crud.word_index_ready(db, corpus_id):
+                version = corpus_crud.get_corpus_version(db, corpus_id)
+                return CachedCorpus(corpus_id, None, version or 1)
+            vocabulary = corpus_crud.get_vocabulary(db, corpus_id)
+            if vocabulary is None:
+                return None
+            version, tokens = vocabulary
+            # индекс ещё строится в фоне: до его готовности словарь перебирается целиком
+            return CachedCorpus.from_tokens(corpus_id, tokens, version, word_index.should_index(len(tokens)))
+        finally:
+            if own_session:
+                db.close()
+
+
+cache = CorpusCache(CORPUS_CACHE_SIZE)
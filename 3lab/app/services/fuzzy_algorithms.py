@@ -1,9 +1,19 @@
+import heapq
+import os
 import time
-from typing import List
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 from difflib import SequenceMatcher
 from collections import Counter
 import math
 
+# алгоритмы, которые ищут по словарю корпуса, и поиск подстроки по сырому тексту
+WORD_ALGORITHMS = ("levenshtein", "ngram")
+TEXT_ALGORITHMS = ("bitap",)
+# верхняя граница max_errors: время bitap растёт линейно с числом ошибок
+BITAP_MAX_ERRORS = int(os.getenv("BITAP_MAX_ERRORS", "8"))
+# символов между проверками отмены в bitap
+BITAP_CHECK_BLOCK = 1 << 16
+
 def levenshtein_distance(a: str, b: str) -> int:
     if len(a) < len(b):
         return levenshtein_distance(b, a)
@@ -31,11 +41,17 @@ def ngram_similarity(a: str, b: str, n: int = 2) -> float:
     return 1.0 - intersection / union if union else 1.0
 
 def search(word: str, corpus: str, algorithm: str):
+    return search_words(word, set(corpus.split()), algorithm)
+
+def search_words(
+    word: str, words: Iterable[str], algorithm: str, check: Optional[Callable[[], None]] = None
+):
     start_time = time.time()
-    unique_words = set(corpus.split())
     results = []
 
-    for w in unique_words:
+    for w in words:
+        if check is not None:
+            check()
         if algorithm == "levenshtein":
             distance = levenshtein_distance(word, w)
         elif algorithm == "ngram":
@@ -50,3 +66,246 @@ def search(word: str, corpus: str, algorithm: str):
         "execution_time": round(end_time - start_time, 4),
         "results": results[:10]
     }
+
+def max_errors_limit(pattern: str) -> int:
+    """More than half the pattern in errors matches nearly every position of a text."""
+    return min(BITAP_MAX_ERRORS, len(pattern) // 2)
+
+def default_max_errors(pattern: str) -> int:
+    return min(1, max_errors_limit(pattern))
+
+def _edit_window(pattern: str, window: str) -> Tuple[int, int]:
+    """
+    Best alignment of `pattern` against a suffix of `window`: (errors, suffix start).
+
+    Semi-global DP over the reversed strings, anchored at the end of the window;
+    among equally good suffixes the one closest to the pattern length wins.
+    """
+    rev_pattern, rev_window = pattern[::-1], window[::-1]
+    m = len(rev_pattern)
+    column = list(range(m + 1))
+    best = (column[m], m, 0)
+    for j, c in enumerate(rev_window, 1):
+        previous, column[0] = column[0], j
+        for i in range(1, m + 1):
+            current = min(
+                column[i] + 1,
+                column[i - 1] + 1,
+                previous + (rev_pattern[i - 1] != c)
+            )
+            previous, column[i] = column[i], current
+        best = min(best, (column[m], abs(j - m), j))
+    return best[0], len(window) - best[2]
+
+def bitap_matches(
+    pattern: str, text: str, max_errors: int, offset: int = 0,
+    check: Optional[Callable[[], None]] = None
+) -> Iterator[dict]:
+    """
+    Approximate occurrences of `pattern` in `text`.
+
+    Bit-parallel Wu-Manber matcher: one pass over the text with max_errors + 1
+    bit vectors of len(pattern) bits, so the time is linear in the text length.
+    Every end position within max_errors edits is a hit; hits at most
+    max_errors + 1 characters apart belong to one occurrence, of which the one
+    with the fewest errors (on a tie the longest with the same start) is
+    reported with its start found by a small DP over the last
+    len(pattern) + max_errors characters.
+
+    Yields {"word", "distance", "start", "end"} with `end` exclusive and
+    `offset` added to both offsets. `check` is called every BITAP_CHECK_BLOCK
+    characters and may raise to stop the scan.
+    """
+    occurrences = _Occurrences(pattern, max_errors)
+    for end, errors in _bitap_hits(pattern, text, max_errors, check):
+        done = occurrences.add(text, offset, end, errors)
+        if done is not None:
+            yield done
+    last = occurrences.flush()
+    if last is not None:
+        yield last
+
+def _bitap_hits(
+    pattern: str, text: str, max_errors: int, check: Optional[Callable[[], None]] = None
+) -> Iterator[Tuple[int, int]]:
+    """(end, errors) of every position of `text` where a match within max_errors ends."""
+    m, k = len(pattern), max_errors
+    if m == 0 or not 0 <= k <= max_errors_limit(pattern):
+        raise ValueError("max_errors must be between 0 and len(pattern) // 2")
+    masks: Dict[str, int] = {}
+    for i, c in enumerate(pattern):
+        masks[c] = masks.get(c, 0) | 1 << i
+    full, top = (1 << m) - 1, 1 << (m - 1)
+    # R[d]: бит i - префикс шаблона длины i + 1 совпадает с текстом, заканчивающимся здесь, с d ошибками
+    states = [(1 << d) - 1 for d in range(k + 1)]
+
+    for block in range(0, len(text), BITAP_CHECK_BLOCK):
+        if check is not None:
+            check()
+        for pos, c in enumerate(text[block:block + BITAP_CHECK_BLOCK], block):
+            mask = masks.get(c, 0)
+            old = states[0]
+            states[0] = ((old << 1) | 1) & mask
+            errors = 0 if states[0] & top else -1
+            for d in range(1, k + 1):
+                previous_old, old = old, states[d]
+                states[d] = (
+                    (((old << 1) | 1) & mask)
+                    | previous_old
+                    | (((previous_old | states[d - 1]) << 1) | 1)
+                ) & full
+                if errors < 0 and states[d] & top:
+                    errors = d
+            if errors >= 0:
+                yield pos + 1, errors
+
+class _Occurrences:
+    """
+    Folds bitap hits, given in order of their end, into occurrences.
+
+    Offsets are kept over the whole text, so hits of several candidate ranges
+    or chunks fold together exactly as in one scan; the text passed with a
+    hit must hold the len(pattern) + max_errors characters before its end.
+    """
+
+    def __init__(self, pattern: str, max_errors: int):
+        self.pattern = pattern
+        self.max_errors = max_errors
+        self.pending: Optional[dict] = None
+
+    def add(self, text: str, base: int, end: int, errors: int) -> Optional[dict]:
+        """Fold the hit ending at text[end - 1], `base` being the offset of text; returns the occurrence it closes."""
+        m, k, pending = len(self.pattern), self.max_errors, self.pending
+        same_occurrence = pending is not None and base + end - pending["end"] <= k + 1
+        if same_occurrence and (errors > pending["distance"] or (
+            # a match keeping the start of the pending one can't be longer than m + k
+            errors == pending["distance"] and base + end - pending["start"] > m + k
+        )):
+            return None
+        window = text[max(0, end - m - k):end]
+        distance, start = _edit_window(self.pattern, window)
+        start += end - len(window)
+        if same_occurrence and errors == pending["distance"] and base + start > pending["start"]:
+            return None
+        self.pending = {"word": text[start:end], "distance": distance, "start": base + start, "end": base + end}
+        return None if same_occurrence else pending
+
+    def flush(self) -> Optional[dict]:
+        pending, self.pending = self.pending, None
+        return pending
+
+def _candidate_ranges(text: str, pattern: str, max_errors: int) -> Optional[List[Tuple[int, int]]]:
+    """
+    Parts of `text` that can hold a match, or None if they would cover most of it.
+
+    Pigeonhole filter: split into max_errors + 1 pieces, the pattern keeps at
+    least one piece intact in any match, and str.find locates the pieces at C
+    speed. Each exact piece pins the match start to within max_errors.
+    """
+    m, k = len(pattern), max_errors
+    size = m // (k + 1)
+    span = m + 2 * k + 2
+    budget = len(text) // (2 * span)
+    ranges = []
+    for i in range(k + 1):
+        piece_start = i * size
+        piece = pattern[piece_start:piece_start + size if i < k else m]
+        pos = text.find(piece)
+        while pos != -1:
+            if len(ranges) >= budget:
+                return None
+            lo = max(0, pos - piece_start - k - 1)
+            ranges.append((lo, min(len(text), lo + span)))
+            pos = text.find(piece, pos + 1)
+    ranges.sort()
+    merged: List[Tuple[int, int]] = []
+    for lo, hi in ranges:
+        if merged and lo <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], hi))
+        else:
+            merged.append((lo, hi))
+    return merged
+
+def search_text(
+    word: str, chunks: Iterable[str], max_errors: Optional[int] = None, limit: int = 10,
+    on_chunk: Optional[Callable[[int], None]] = None, check: Optional[Callable[[], None]] = None
+):
+    """
+    Top bitap matches over a text given as a stream of chunks, fewest errors first.
+
+    Each chunk is scanned together with the last len(word) + max_errors
+    characters of the previous one, so matches crossing a boundary are found;
+    hits are folded into occurrences across ranges and chunks, so the result
+    is that of the concatenated text scanned at once, with offsets counted
+    over it. `on_chunk` gets the number of characters read so far, `check` is
+    passed to the scan.
+    """
+    start_time = time.time()
+    if max_errors is None:
+        max_errors = default_max_errors(word)
+
+    def matches() -> Iterator[dict]:
+        occurrences = _Occurrences(word, max_errors)
+        tail, offset = "", 0
+        for chunk in chunks:
+            text = tail + chunk
+            base = offset - len(tail)
+            ranges = _candidate_ranges(text, word, max_errors)
+            if ranges is None:
+                ranges = [(0, len(text))]
+            for lo, hi in ranges:
+                for end, errors in _bitap_hits(word, text[lo:hi], max_errors, check):
+                    # попадания в хвосте уже учтены вместе с предыдущим куском
+                    if lo + end <= len(tail):
+                        continue
+                    done = occurrences.add(text, base, lo + end, errors)
+                    if done is not None:
+                        yield done
+            offset += len(chunk)
+            tail = text[-(len(word) + max_errors):]
+            if on_chunk is not None:
+                on_chunk(offset)
+        last = occurrences.flush()
+        if last is not None:
+            yield last
+
+    results = heapq.nsmallest(limit, matches(), key=lambda x: (x["distance"], x["start"]))
+    end_time = time.time()
+    return {
+        "execution_time": round(end_time - start_time, 4),
+        "results": results
+    }
+
+def merge_results(per_corpus: Dict[int, dict], limit: int = 10):
+    """Global top-k over per-corpus results; corpora are searched in parallel, so
+    the execution time is that of the slowest one."""
+    results = [
+        {**item, "corpus_id": corpus_id}
+        for corpus_id, result in per_corpus.items()
+        for item in result.get("results", [])
+    ]
+    results.sort(key=lambda x: x["distance"])
+    merged = {
+        "execution_time": max((r.get("execution_time", 0) for r in per_corpus.values()), default=0),
+        "results": results[:limit]
+    }
+    stages = [result["stages"] for result in per_corpus.values() if "stages" in result]
+    if stages:
+        # как и execution_time: этап параллельного поиска длится столько, сколько у самого медленного корпуса
+        names = dict.fromkeys(name for s in stages for name in s)
+        merged["stages"] = {name: max(s.get(name, 0) for s in stages) for name in names}
+    memory = [result["memory"] for result in per_corpus.values() if "memory" in result]
+    if memory:
+        # части считаются в разных процессах, поэтому пик поиска — пик самой тяжёлой из них
+        merged["memory"] = {name: max(m.get(name, 0) for m in memory) for name in ("peak_bytes", "objects")}
+    # удалённый корпус — в missing; остальные ошибки частей (лимит памяти, отмена) — в errors
+    missing = [corpus_id for corpus_id, result in per_corpus.items() if result.get("error") == "Corpus not found"]
+    if missing:
+        merged["missing"] = missing
+    errors = {
+        corpus_id: result["error"] for corpus_id, result in per_corpus.items()
+        if "error" in result and corpus_id not in missing
+    }
+    if errors:
+        merged["errors"] = errors
+    return merged
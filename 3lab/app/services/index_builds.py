@@ -0,0 +1,174 @@
+"""
+Background builds of corpus search indexes.
+
+Building the word index of a large corpus takes seconds, so neither the
+upload nor the first search pays for it: upload_corpus and the API start-up
+queue a `build_corpus_index` task, which runs on the bulk queue of the
+corpus shard, i.e. on a worker that searches the corpus and warms its cache
+right after the build. Until the index is ready searches scan the whole
+vocabulary, as for small corpora.
+
+The state of each corpus lives in `corpus_indexes` and is reported as
+building, ready or stale. Stale covers a corpus never indexed, a failed or
+lost build, an index behind the corpus version and one built with other
+normalization steps (TOKEN_NORMALIZATION); start-up rebuilds them.
+"""
+import logging
+import os
+import time
+from typing import Any, Dict, Optional
+
+from sqlalchemy.orm import Session
+
+from app import routing
+from app.cruds import corpus as corpus_crud
+from app.db.database import ReadSessionLocal, SessionLocal
+from app.models.corpus import CorpusIndex
+from app.services import normalization, word_index
+
+logger = logging.getLogger(__name__)
+
+INDEX_BUILD_ON_STARTUP = os.getenv("INDEX_BUILD_ON_STARTUP", "true").lower() in ("1", "true", "yes")
+# сборка, не завершившаяся за это время (воркер упал, задача потерялась), считается устаревшей
+INDEX_BUILD_TIMEOUT = float(os.getenv("INDEX_BUILD_TIMEOUT", "1800"))
+
+BUILDING = CorpusIndex.BUILDING
+READY = CorpusIndex.READY
+STALE = "stale"
+
+
+def state_of(row) -> str:
+    """building, ready or stale for a row of corpus_crud.get_index_states."""
+    if row.status == BUILDING and row.updated_at >= time.time() - INDEX_BUILD_TIMEOUT:
+        return BUILDING
+    if row.status == READY and row.indexed_version >= row.version:
+        # порог WORD_INDEX_MIN_WORDS могли понизить после загрузки корпуса
+        if row.kind == CorpusIndex.VOCABULARY and word_index.should_index(row.vocabulary_size):
+            return STALE
+        if row.kind == CorpusIndex.WORDS and row.normalization != normalization.SIGNATURE:
+            return STALE
+        return READY
+    return STALE
+
+
+def describe(row) -> Dict[str, Any]:
+    return {
+        "corpus_id": row.id,
+        "status": state_of(row),
+        "kind": row.kind,
+        "version": row.version,
+        "indexed_version": row.indexed_version,
+        "updated_at": row.updated_at,
+        "error": row.error,
+        "normalization": row.normalization if row.kind == CorpusIndex.WORDS else None,
+    }
+
+
+def status(db: Session, corpus_id: int) -> Optional[Dict[str, Any]]:
+    """Index state of a corpus, None if there is no such corpus."""
+    rows = corpus_crud.get_index_states(db, corpus_id)
+    return describe(rows[0]) if rows else None
+
+
+def schedule(db: Session, corpus_id: int) -> Optional[Dict[str, Any]]:
+    """
+    Queue an index build for the corpus unless its index is ready or being
+    built; return its state afterwards, None if there is no such corpus.
+
+    Needs a writable session. A corpus too small for a word index is marked
+    ready at once.
+    """
+    rows = corpus_crud.get_index_states(db, corpus_id)
+    if not rows:
+        return None
+    row = rows[0]
+    if state_of(row) == STALE:
+        _schedule(db, row)
+        row = corpus_crud.get_index_states(db, corpus_id)[0]
+    return describe(row)
+
+
+def _schedule(db: Session, row) -> bool:
+    """True if a build has been queued."""
+    if not word_index.should_index(row.vocabulary_size):
+        corpus_crud.set_index_state(db, row.id, READY, CorpusIndex.VOCABULARY, row.version)
+        return False
+    if not corpus_crud.claim_index_build(db, row.id, INDEX_BUILD_TIMEOUT):
+        return False
+    from kombu.exceptions import OperationalError
+    from app.services.search_tasks import get_celery_app
+
+    try:
+        get_celery_app().send_task(
+            "build_corpus_index",
+            args=[row.id],
+            queue=routing.queue_for_corpus(row.id, routing.BULK)
+        )
+    except OperationalError as e:
+        # без брокера индекс остаётся устаревшим, поиск идёт перебором; повторит следующий запуск
+        logger.warning(f"Index build for corpus {row.id} not queued: {e}")
+        corpus_crud.set_index_state(db, row.id, CorpusIndex.FAILED, error=f"Not queued: {e}")
+        return False
+    return True
+
+
+def schedule_stale() -> int:
+    """Queue builds for every corpus whose index is stale; returns how many were queued."""
+    db = SessionLocal()
+    try:
+        stale = [row for row in corpus_crud.get_index_states(db) if state_of(row) == STALE]
+        return sum(_schedule(db, row) for row in stale)
+    finally:
+        db.close()
+
+
+def build(corpus_id: int) -> Optional[str]:
+    """
+    Build the index of a corpus claimed by schedule and mark it ready; runs
+    in the build_corpus_index task. Returns the stored status, None if the
+    corpus is gone.
+
+    The vocabulary is read and normalized first, outside the write
+    transaction. Appends made meanwhile skip the unfinished index, so once
+    the build holds the write lock it adds their words and records the
+    version it reached.
+    """
+    read_db = ReadSessionLocal()
+    try:
+        vocabulary = corpus_crud.get_vocabulary(read_db, corpus_id)
+    finally:
+        read_db.close()
+    if vocabulary is None:
+        return None
+    version, words = vocabulary
+    grouped = normalization.group(words)
+
+    started = time.perf_counter()
+    db = SessionLocal()
+    try:
+        if not word_index.should_index(len(words)):
+            word_index.drop(db, corpus_id)
+            corpus_crud.set_index_state(db, corpus_id, READY, CorpusIndex.VOCABULARY, version)
+            return READY
+        if not word_index.build(db, corpus_id, grouped):
+            corpus_crud.set_index_state(
+                db, corpus_id, CorpusIndex.FAILED,
+                error="SQLite has no FTS5 trigram tokenizer, the vocabulary is scanned"
+            )
+            return CorpusIndex.FAILED
+        for version, text in corpus_crud.get_appended_texts(db, corpus_id, version):
+            word_index.add(db, corpus_id, normalization.group(text.split()))
+        corpus_crud.set_index_state(
+            db, corpus_id, READY, CorpusIndex.WORDS, version, normalization=normalization.SIGNATURE
+        )
+    except Exception as e:
+        db.rollback()
+        corpus_crud.set_index_state(db, corpus_id, CorpusIndex.FAILED, error=str(e))
+        raise
+    finally:
+        db.close()
+    logger.info(
+        f"Word index of corpus {corpus_id} built: {len(grouped)} words ({len(words)} forms), "
+        f"version {version}, {time.perf_counter() - started:.1f} s"
+    )
+    return READY
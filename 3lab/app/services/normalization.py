@@ -0,0 +1,104 @@
+"""
+Normalization of corpus tokens and query words.
+
+Corpora are stored as uploaded. Their distinct tokens (surface forms) are
+normalized when a vocabulary is loaded or indexed, and searches score the
+normalized words only: "Word", "word," and "word." are one entry "word",
+which keeps those forms and returns them next to the results as `forms`.
+
+TOKEN_NORMALIZATION lists the steps, always applied in this order:
+- nfc: Unicode NFC, so a composed and a decomposed "й" are one letter;
+- casefold: case-insensitive matching (str.casefold);
+- punctuation: strip non-word characters around a token, keeping those
+  inside it ("кто-то", "don't", "3.14");
+- yo: fold "ё" into "е".
+An empty value searches the raw tokens.
+
+Word indexes are built from normalized words and record the steps in
+SIGNATURE; an index built with other steps is stale and rebuilt.
+"""
+import os
+import re
+import unicodedata
+from typing import Callable, Dict, Iterable, List, Optional, Set
+
+NFC = "nfc"
+CASEFOLD = "casefold"
+PUNCTUATION = "punctuation"
+YO = "yo"
+STEPS = (NFC, CASEFOLD, PUNCTUATION, YO)
+
+TOKEN_NORMALIZATION = os.getenv("TOKEN_NORMALIZATION", "nfc,casefold,punctuation")
+
+_EDGES = re.compile(r"^\W+|\W+$")
+_YO = str.maketrans("ёЁ", "еЕ")
+
+
+def _nfc(token: str) -> str:
+    # почти весь текст уже в NFC, проверка дешевле преобразования
+    return token if unicodedata.is_normalized("NFC", token) else unicodedata.normalize("NFC", token)
+
+
+_STEP_FUNCTIONS: Dict[str, Callable[[str], str]] = {
+    NFC: _nfc,
+    CASEFOLD: str.casefold,
+    PUNCTUATION: lambda token: _EDGES.sub("", token),
+    YO: lambda token: token.translate(_YO),
+}
+
+SIGNATURE = ""
+_PIPELINE: List[Callable[[str], str]] = []
+
+
+def configure(steps: str) -> None:
+    """Switch the process to the comma-separated `steps`; done once at import from TOKEN_NORMALIZATION."""
+    global SIGNATURE, _PIPELINE
+    enabled = {step.strip().lower() for step in steps.split(",") if step.strip()}
+    if enabled - set(STEPS):
+        raise ValueError(
+            f"Unknown TOKEN_NORMALIZATION steps {sorted(enabled - set(STEPS))}, expected some of {list(STEPS)}"
+        )
+    SIGNATURE = ",".join(step for step in STEPS if step in enabled)
+    _PIPELINE = [_STEP_FUNCTIONS[step] for step in STEPS if step in enabled]
+
+
+configure(TOKEN_NORMALIZATION)
+
+
+def normalize(token: str) -> str:
+    """Normalized form of a token; empty for a token of punctuation only."""
+    for step in _PIPELINE:
+        token = step(token)
+    return token
+
+
+def normalize_query(word: str) -> str:
+    """A query word is normalized like the corpus, unless nothing would be left of it."""
+    return normalize(word) or word
+
+
+def group(tokens: Iterable[str]) -> Dict[str, Set[str]]:
+    """Surface forms of the tokens by normalized word; tokens normalized to nothing are dropped."""
+    forms: Dict[str, Set[str]] = {}
+    for token in tokens:
+        word = normalize(token)
+        if word:
+            forms.setdefault(word, set()).add(token)
+    return forms
+
+
+def surface_forms(word: str, forms: Set[str]) -> Optional[List[str]]:
+    """The forms worth reporting for a normalized word: None when it is its only form."""
+    if len(forms) == 1 and word in forms:
+        return None
+    return sorted(forms)
+
+
+def differing_forms(grouped: Dict[str, Set[str]]) -> Dict[str, List[str]]:
+    """surface_forms of every word of `group` output that has any worth reporting."""
+    listed = {}
+    for word, forms in grouped.items():
+        reported = surface_forms(word, forms)
+        if reported:
+            listed[word] = reported
+    return listed
@@ -0,0 +1,43 @@
+import os
+from typing import Optional
+
+from app import routing
+from app.cruds import corpus as corpus_crud
+from app.db.database import ReadSessionLocal
+from app.services import word_index
+from app.services.corpus_cache import cache as corpus_cache
+
+# vocabulary size * query length above which a search is treated as bulk
+BULK_COST_THRESHOLD = int(os.getenv("BULK_COST_THRESHOLD", "2000000"))
+
+
+def estimate_vocabulary_size(corpus_id: int) -> int:
+    """Words scored per query: exact for cached corpora, the candidate limit for indexed
+    ones, an estimate from the text length otherwise."""
+    if corpus_id in corpus_cache:
+        entry = corpus_cache.get(corpus_id)
+        if entry is not None:
+            return entry.size
+    db = ReadSessionLocal()
+    try:
+        if corpus_crud.word_index_ready(db, corpus_id):
+            return word_index.WORD_INDEX_CANDIDATES
+        return corpus_crud.estimate_vocabulary_size(db, corpus_id)
+    finally:
+        db.close()
+
+
+def estimate_cost(corpus_id: int, word: str) -> int:
+    """Rough cost of a scan: every vocabulary word is compared with the query."""
+    return estimate_vocabulary_size(corpus_id) * max(len(word), 1)
+
+
+def classify(corpus_id: int, word: str, priority: Optional[str] = None) -> str:
+    """Keep an explicit priority class, otherwise pick one by estimated cost."""
+    if priority in routing.PRIORITIES:
+        return priority
+    return priority_for_cost(estimate_cost(corpus_id, word))
+
+
+def priority_for_cost(cost: int) -> str:
+    return routing.BULK if cost >= BULK_COST_THRESHOLD else routing.INTERACTIVE
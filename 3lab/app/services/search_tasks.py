@@ -0,0 +1,428 @@
+import hashlib
+import json
+import logging
+import os
+import time
+import uuid
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Union
+
+from celery import states
+
+from app import routing
+from app.services import admission
+
+if TYPE_CHECKING:
+    from celery import Celery
+
+logger = logging.getLogger(__name__)
+
+INFLIGHT_TTL = int(os.getenv("INFLIGHT_TTL", "600"))
+INFLIGHT_PREFIX = "fuzzy:inflight:"
+# флаг отмены, который проверяет цикл поиска; хранится в result backend
+CANCEL_PREFIX = "fuzzy:cancel:"
+# кто ждёт задачу (множество) и что отменять вместе с ней (hash: inflight key, подзадачи)
+SUBMITTERS_PREFIX = "fuzzy:submitters:"
+TASK_PREFIX = "fuzzy:task:"
+# пользователи, отправившие задачу или присоединившиеся к ней: только их соединения
+# становятся отправителями при подписке
+OWNERS_PREFIX = "fuzzy:owners:"
+
+# удалить ключ, только если он всё ещё указывает на эту задачу: GET и DEL одной операцией,
+# иначе между ними ключ могла занять новая задача
+RELEASE_INFLIGHT_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class SearchCancelled(Exception):
+    """Raised inside a search when its task has been cancelled."""
+
+
+class Submission(NamedTuple):
+    task_id: str
+    coalesced: bool
+
+
+def inflight_key(corpus_id: Union[int, List[int]], word: str, algorithm: str, **params: Any) -> str:
+    """Key identifying identical searches: same corpus (or corpora), word, algorithm and params."""
+    raw = json.dumps([corpus_id, word, algorithm, params], sort_keys=True, ensure_ascii=False)
+    return INFLIGHT_PREFIX + hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def get_celery_app() -> "Celery":
+    """The project's Celery app, imported on first use to keep Celery out of API start-up."""
+    from app.celery_worker import celery_app
+    return celery_app
+
+
+def _redis(celery: "Celery"):
+    """Redis client of the result backend, or None for other backends."""
+    from celery.backends.redis import RedisBackend
+
+    backend = celery.backend
+    return backend.client if isinstance(backend, RedisBackend) else None
+
+
+def _cost_and_priority(corpus_id: int, word: str, priority: Optional[str]) -> tuple:
+    """Estimated cost for admission control and the priority class it implies."""
+    if priority in routing.PRIORITIES and not admission.ADMISSION_ENABLED:
+        return 0, priority
+    from app.services.priority import estimate_cost, priority_for_cost
+    cost = estimate_cost(corpus_id, word)
+    return cost, priority if priority in routing.PRIORITIES else priority_for_cost(cost)
+
+
+def submit_search(
+    celery: "Celery", word: str, algorithm: str, corpus_id: int,
+    priority: Optional[str] = None, submitter: Optional[str] = None,
+    user: Optional[str] = None, **params: Any
+) -> Submission:
+    """
+    Enqueue fuzzy_search_task unless an identical search is already in flight.
+
+    The first submission claims the in-flight key with SET NX and the task
+    deletes it when it finishes; duplicates meanwhile get the same task_id.
+    Without an explicit priority class the search is classified by its
+    estimated cost, which needs database access. `submitter` (a user or a
+    connection) is recorded so that cancel_search stops a shared task only
+    once every submitter has cancelled it.
+
+    A new search passes admission control first: admission.Overloaded is
+    raised if its queue is full or `user` has too many searches in flight.
+    Joining a search already in flight adds no work and is always admitted.
+    """
+    cost, priority = _cost_and_priority(corpus_id, word, priority)
+    queue = routing.queue_for_corpus(corpus_id, priority)
+
+    client = _redis(celery)
+    key = inflight_key(corpus_id, word, algorithm, **params) if client is not None else None
+    task_id = str(uuid.uuid4())
+
+    if key is not None:
+        existing = _claim(client, key, task_id)
+        if existing is not None:
+            logger.debug(f"Coalesced search {key} into task {existing}")
+            _track(client, existing, submitter, owner=user)
+            return Submission(existing, True)
+    try:
+        admission.check(celery, [(queue, cost)], user)
+    except admission.Overloaded:
+        release_inflight(celery, key, task_id)
+        raise
+    if client is not None:
+        _track(client, task_id, submitter, inflight=key, owner=user)
+    else:
+        _track_kv(celery, task_id, submitter, owner=user)
+    parts = [(task_id, queue, cost)]
+    admission.record(celery, task_id, parts, user)
+
+    try:
+        celery.send_task(
+            "fuzzy_search_task",
+            args=[word, algorithm, corpus_id],
+            kwargs={**params, "inflight_key": key},
+            task_id=task_id,
+            queue=queue,
+            expires=admission.queue_timeout()
+        )
+    except Exception:
+        _abandon(celery, key, task_id, parts)
+        raise
+    return Submission(task_id, False)
+
+
+def submit_multi_search(
+    celery: "Celery", word: str, algorithm: str, corpus_ids: List[int],
+    priority: Optional[str] = None, submitter: Optional[str] = None,
+    user: Optional[str] = None, **params: Any
+) -> Submission:
+    """
+    Enqueue a search over several corpora as a chord.
+
+    Every corpus gets its own fuzzy_search_task on its shard queue, so the
+    corpora are scored in parallel by different workers; merge_search_results
+    builds the global top list. The returned task_id is that of the merge.
+    Admission control checks the queue of every corpus and counts the
+    search once against `user`.
+    """
+    from celery import chord
+
+    client = _redis(celery)
+    key = inflight_key(sorted(corpus_ids), word, algorithm, **params) if client is not None else None
+    task_id = str(uuid.uuid4())
+
+    if key is not None:
+        existing = _claim(client, key, task_id)
+        if existing is not None:
+            logger.debug(f"Coalesced search {key} into task {existing}")
+            _track(client, existing, submitter, owner=user)
+            return Submission(existing, True)
+
+    targets = []
+    for corpus_id in corpus_ids:
+        cost, corpus_priority = _cost_and_priority(corpus_id, word, priority)
+        targets.append((routing.queue_for_corpus(corpus_id, corpus_priority), cost))
+    try:
+        admission.check(celery, targets, user)
+    except admission.Overloaded:
+        release_inflight(celery, key, task_id)
+        raise
+
+    header = [
+        celery.signature(
+            "fuzzy_search_task",
+            args=[word, algorithm, corpus_id],
+            kwargs=params,
+            task_id=str(uuid.uuid4()),
+            queue=queue,
+            expires=admission.queue_timeout()
+        )
+        for corpus_id, (queue, _) in zip(corpus_ids, targets)
+    ]
+    body = celery.signature(
+        "merge_search_results",
+        kwargs={"corpus_ids": corpus_ids, "inflight_key": key},
+        task_id=task_id
+    )
+    # если часть упала или истекла в очереди, merge не запустится — ключ освободит errback
+    body.link_error(celery.signature("release_failed_search"))
+    if client is not None:
+        _track(client, task_id, submitter, inflight=key, parts=[sig.id for sig in header], owner=user)
+    else:
+        _track_kv(celery, task_id, submitter, owner=user)
+    parts = [(sig.id, queue, cost) for sig, (queue, cost) in zip(header, targets)]
+    admission.record(celery, task_id, parts, user)
+    try:
+        chord(header, app=celery)(body)
+    except Exception:
+        _abandon(celery, key, task_id, parts)
+        raise
+    return Submission(task_id, False)
+
+
+def _abandon(celery: "Celery", key: Optional[str], task_id: str, parts: List[tuple]) -> None:
+    """
+    Forget a search whose publish failed: otherwise identical searches would
+    coalesce onto a task that never runs and its admission slots would leak.
+    """
+    release_inflight(celery, key, task_id)
+    admission.withdraw(celery, task_id, parts)
+    client = _redis(celery)
+    if client is not None:
+        client.delete(SUBMITTERS_PREFIX + task_id, TASK_PREFIX + task_id, OWNERS_PREFIX + task_id)
+    else:
+        celery.backend.delete(celery.backend.key_t(SUBMITTERS_PREFIX + task_id))
+        celery.backend.delete(celery.backend.key_t(OWNERS_PREFIX + task_id))
+
+
+def _track(
+    client, task_id: str, submitter: Optional[str],
+    inflight: Optional[str] = None, parts: Optional[List[str]] = None,
+    owner: Optional[str] = None
+) -> None:
+    pipe = client.pipeline()
+    if submitter:
+        pipe.sadd(SUBMITTERS_PREFIX + task_id, submitter)
+        pipe.expire(SUBMITTERS_PREFIX + task_id, INFLIGHT_TTL)
+    if owner:
+        pipe.sadd(OWNERS_PREFIX + task_id, owner)
+        pipe.expire(OWNERS_PREFIX + task_id, INFLIGHT_TTL)
+    fields = {}
+    if inflight:
+        fields["inflight"] = inflight
+    if parts:
+        fields["parts"] = json.dumps(parts)
+    if fields:
+        pipe.hset(TASK_PREFIX + task_id, mapping=fields)
+        pipe.expire(TASK_PREFIX + task_id, INFLIGHT_TTL)
+    pipe.execute()
+
+
+def _track_kv(
+    celery: "Celery", task_id: str, submitter: Optional[str], owner: Optional[str] = None
+) -> None:
+    """
+    Submitters and owners of a task in a key-value result backend other than
+    Redis: JSON lists under the same keys. Updates are not atomic; a lost one
+    can only make cancel_search or add_submitter refuse.
+    """
+    for prefix, member in ((SUBMITTERS_PREFIX, submitter), (OWNERS_PREFIX, owner)):
+        if not member:
+            continue
+        key = celery.backend.key_t(prefix + task_id)
+        members = _kv_submitters(celery, key)
+        if member not in members:
+            celery.backend.set(key, json.dumps(members + [member]))
+
+
+def _kv_submitters(celery: "Celery", key) -> List[str]:
+    raw = celery.backend.get(key)
+    return json.loads(_decode(raw)) if raw is not None else []
+
+
+def add_submitter(celery: "Celery", task_id: str, submitter: str, user: Optional[str]) -> bool:
+    """
+    Record one more party waiting for the task, e.g. a new connection of the
+    user who submitted it subscribing again after a reconnect. Only a user
+    recorded as an owner of the task may add one; returns whether it was added.
+    """
+    if not user:
+        return False
+    client = _redis(celery)
+    if client is not None:
+        if not client.sismember(OWNERS_PREFIX + task_id, user):
+            return False
+        _track(client, task_id, submitter)
+    else:
+        if user not in _kv_submitters(celery, celery.backend.key_t(OWNERS_PREFIX + task_id)):
+            return False
+        _track_kv(celery, task_id, submitter)
+    return True
+
+
+def keep_alive(celery: "Celery", task_id: str) -> None:
+    """Extend the submitters and cancel info of a search still running past INFLIGHT_TTL."""
+    client = _redis(celery)
+    if client is None:
+        return
+    pipe = client.pipeline()
+    pipe.expire(SUBMITTERS_PREFIX + task_id, INFLIGHT_TTL)
+    pipe.expire(TASK_PREFIX + task_id, INFLIGHT_TTL)
+    pipe.expire(OWNERS_PREFIX + task_id, INFLIGHT_TTL)
+    pipe.execute()
+
+
+def cancel_search(celery: "Celery", task_id: str, submitter: Optional[str] = None) -> bool:
+    """
+    Withdraw `submitter` from a search and stop it if nobody else waits for it.
+
+    Stopping sets the cancellation flag checked by the running search (and by
+    the parts of a multi-corpus chord), revokes the task if it is still queued,
+    frees its in-flight key and marks it REVOKED. Returns True if the task was
+    stopped, False if it is finished, still wanted by other submitters or
+    `submitter` is not recorded as one of them.
+    """
+    if not submitter:
+        return False
+    client = _redis(celery)
+    inflight, parts = None, []
+    if client is None:
+        key = celery.backend.key_t(SUBMITTERS_PREFIX + task_id)
+        submitters = _kv_submitters(celery, key)
+        if submitter not in submitters:
+            return False
+        submitters.remove(submitter)
+        celery.backend.set(key, json.dumps(submitters))
+        if submitters:
+            return False
+    else:
+        # чужую задачу (или задачу с истёкшей записью об отправителях) отменить нельзя
+        if not client.srem(SUBMITTERS_PREFIX + task_id, submitter):
+            return False
+        if client.scard(SUBMITTERS_PREFIX + task_id) > 0:
+            return False
+        info = {_decode(k): _decode(v) for k, v in client.hgetall(TASK_PREFIX + task_id).items()}
+        inflight, parts = info.get("inflight"), json.loads(info.get("parts") or "[]")
+    if celery.backend.get_task_meta(task_id)["status"] in states.READY_STATES:
+        return False
+
+    release_inflight(celery, inflight, task_id)
+    for part_id in [task_id, *parts]:
+        celery.backend.set(_cancel_key(celery, part_id), "1")
+    if not parts:
+        # части chord не отзываются: отозванная часть роняет chord с ошибкой,
+        # они видят флаг при старте и сразу возвращают {"error": "Cancelled"}
+        try:
+            celery.control.revoke(task_id)
+        except Exception as e:
+            logger.warning(f"Revoke of task {task_id} failed: {e}")
+    celery.backend.mark_as_revoked(task_id, reason="cancelled")
+    return True
+
+
+def cancel_searches(celery: "Celery", task_ids: Iterable[str], submitter: Optional[str] = None) -> int:
+    """cancel_search for many tasks, e.g. those of a closed connection; returns how many stopped."""
+    return sum(cancel_search(celery, task_id, submitter) for task_id in task_ids)
+
+
+def _cancel_key(celery: "Celery", task_id: str):
+    # ключи Redis — строки, у файлового и других key-value бэкендов — bytes
+    return celery.backend.key_t(CANCEL_PREFIX + task_id)
+
+
+def is_cancelled(celery: "Celery", task_id: str) -> bool:
+    return celery.backend.get(_cancel_key(celery, task_id)) is not None
+
+
+def cancellation_check(
+    celery: "Celery", task_id: str, interval: float, search_id: Optional[str] = None
+) -> Callable[[], None]:
+    """
+    A callable for search loops: raises SearchCancelled once the task is
+    cancelled, reading the flag at most every `interval` seconds. It also
+    keeps the submitters of `search_id` (the chord of a part, by default the
+    task itself) alive, so they can still cancel a search longer than
+    INFLIGHT_TTL.
+    """
+    next_check = next_refresh = 0.0
+
+    def check() -> None:
+        nonlocal next_check, next_refresh
+        now = time.monotonic()
+        if now >= next_refresh:
+            next_refresh = now + INFLIGHT_TTL / 3
+            keep_alive(celery, search_id or task_id)
+        if now >= next_check:
+            next_check = now + interval
+            if is_cancelled(celery, task_id):
+                raise SearchCancelled(task_id)
+
+    return check
+
+
+def _claim(client, key: str, task_id: str) -> Optional[str]:
+    """Claim key for task_id; return the task already holding it, if any."""
+    for _ in range(2):
+        if client.set(key, task_id, nx=True, ex=INFLIGHT_TTL):
+            return None
+        existing = client.get(key)
+        if existing is not None:
+            return _decode(existing)
+        # the holder finished between SET and GET, try to claim again
+    return None
+
+
+def release_inflight(celery: "Celery", key: Optional[str], task_id: str) -> None:
+    """Drop the in-flight key if it still points at this task."""
+    client = _redis(celery)
+    if client is None or not key:
+        return
+    client.eval(RELEASE_INFLIGHT_SCRIPT, 1, key, task_id)
+
+
+def _decode(value) -> Optional[str]:
+    if isinstance(value, bytes):
+        return value.decode()
+    return value
+
+
+def fetch_task_metas(celery: "Celery", task_ids: List[str]) -> List[Dict[str, Any]]:
+    """
+    Read the state of many tasks at once.
+
+    With a Redis backend this is a single MGET; unknown tasks are PENDING.
+    """
+    backend = celery.backend
+    client = _redis(celery)
+    if client is None:
+        return [backend.get_task_meta(task_id) for task_id in task_ids]
+
+    raw = client.mget([backend.get_key_for_task(task_id) for task_id in task_ids])
+    return [
+        backend.decode_result(item) if item is not None
+        else {"status": states.PENDING, "result": None}
+        for item in raw
+    ]
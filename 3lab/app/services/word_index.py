@@ -0,0 +1,202 @@
+"""
+FTS5 trigram index of corpus vocabularies.
+
+Large corpora get one `corpus_words_<id>` table tokenized into trigrams.
+Instead of scoring the whole vocabulary, a search scores only the words
+that share enough trigrams with the query word.
+
+The words themselves live in `corpus_vocab_<id>` (unique, the external
+content of the FTS table), so appends can skip known words by key lookup.
+Words are normalized (app.services.normalization); next to each word the
+table keeps its surface forms when they differ from it.
+"""
+import logging
+import os
+from typing import Dict, List, Optional, Set
+
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from app.services import normalization
+
+logger = logging.getLogger(__name__)
+
+# corpora with at least this many distinct words are indexed instead of cached; 0 disables
+WORD_INDEX_MIN_WORDS = int(os.getenv("WORD_INDEX_MIN_WORDS", "100000"))
+# upper bound on the words scored per query
+WORD_INDEX_CANDIDATES = int(os.getenv("WORD_INDEX_CANDIDATES", "2000"))
+# edit distance the trigram filter is tuned for
+WORD_INDEX_MAX_DISTANCE = int(os.getenv("WORD_INDEX_MAX_DISTANCE", "2"))
+
+TRIGRAM = 3
+# searches return the top 10, fewer candidates than that relax the filter
+MIN_CANDIDATES = 10
+
+
+# words per `IN (...)` lookup, below SQLite's bound parameter limit
+LOOKUP_BATCH = 500
+
+
+def table_name(corpus_id: int) -> str:
+    return f"corpus_words_{int(corpus_id)}"
+
+
+def vocab_table_name(corpus_id: int) -> str:
+    return f"corpus_vocab_{int(corpus_id)}"
+
+
+def should_index(vocabulary_size: int) -> bool:
+    return WORD_INDEX_MIN_WORDS > 0 and vocabulary_size >= WORD_INDEX_MIN_WORDS
+
+
+def _table_exists(db: Session, name: str) -> bool:
+    row = db.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+        {"name": name}
+    ).first()
+    return row is not None
+
+
+def is_indexed(db: Session, corpus_id: int) -> bool:
+    return _table_exists(db, table_name(corpus_id))
+
+
+def _pack_forms(word: str, forms: Set[str]) -> Optional[str]:
+    listed = normalization.surface_forms(word, forms)
+    # формы получены split(), пробельных символов в них нет
+    return "\n".join(listed) if listed else None
+
+
+def _unpack_forms(word: str, packed: Optional[str]) -> Set[str]:
+    return set(packed.split("\n")) if packed else {word}
+
+
+def build(db: Session, corpus_id: int, vocabulary: Dict[str, Set[str]]) -> bool:
+    """
+    (Re)create the index of a corpus from its normalized words and their
+    surface forms; the caller commits. False if FTS5 is unavailable.
+    """
+    table, vocab = table_name(corpus_id), vocab_table_name(corpus_id)
+    try:
+        drop(db, corpus_id)
+        db.execute(text(
+            f"CREATE TABLE {vocab} (id INTEGER PRIMARY KEY, word TEXT NOT NULL UNIQUE, forms TEXT)"
+        ))
+        db.execute(text(
+            f"CREATE VIRTUAL TABLE {table} USING fts5("
+            f"word, tokenize='trigram', content='{vocab}', content_rowid='id')"
+        ))
+    except OperationalError as e:
+        logger.warning(f"Word index for corpus {corpus_id} not built: {e.orig}")
+        db.rollback()
+        return False
+    db.execute(
+        text(f"INSERT OR IGNORE INTO {vocab} (word, forms) VALUES (:word, :forms)"),
+        [{"word": w, "forms": _pack_forms(w, forms)} for w, forms in vocabulary.items()]
+    )
+    db.execute(text(f"INSERT INTO {table} (rowid, word) SELECT id, word FROM {vocab}"))
+    return True
+
+
+def _lookup(db: Session, vocab: str, words: List[str]) -> Dict[str, Optional[str]]:
+    """Packed forms of the words the table has."""
+    found: Dict[str, Optional[str]] = {}
+    for start in range(0, len(words), LOOKUP_BATCH):
+        batch = words[start:start + LOOKUP_BATCH]
+        params = {f"w{i}": w for i, w in enumerate(batch)}
+        placeholders = ", ".join(f":{name}" for name in params)
+        rows = db.execute(text(f"SELECT word, forms FROM {vocab} WHERE word IN ({placeholders})"), params)
+        found.update((row.word, row.forms) for row in rows)
+    return found
+
+
+def add(db: Session, corpus_id: int, vocabulary: Dict[str, Set[str]]) -> int:
+    """
+    Index the normalized words the corpus does not have yet and record new
+    surface forms of the known ones; the caller commits. Returns the number
+    of new words.
+    """
+    table, vocab = table_name(corpus_id), vocab_table_name(corpus_id)
+    known = _lookup(db, vocab, list(vocabulary))
+    changed = []
+    for word, packed in known.items():
+        forms = _unpack_forms(word, packed)
+        if not vocabulary[word] <= forms:
+            changed.append({"word": word, "forms": _pack_forms(word, forms | vocabulary[word])})
+    if changed:
+        db.execute(text(f"UPDATE {vocab} SET forms = :forms WHERE word = :word"), changed)
+    new = [w for w in vocabulary if w not in known]
+    if not new:
+        return 0
+    last_id = db.execute(text(f"SELECT COALESCE(MAX(id), 0) FROM {vocab}")).scalar()
+    db.execute(
+        text(f"INSERT INTO {vocab} (word, forms) VALUES (:word, :forms)"),
+        [{"word": w, "forms": _pack_forms(w, vocabulary[w])} for w in new]
+    )
+    db.execute(text(
+        f"INSERT INTO {table} (rowid, word) SELECT id, word FROM {vocab} WHERE id > :last_id"
+    ), {"last_id": last_id})
+    return len(new)
+
+
+def forms_of(db: Session, corpus_id: int, words: List[str]) -> Dict[str, List[str]]:
+    """Surface forms of those of the words that have forms other than themselves."""
+    found = _lookup(db, vocab_table_name(corpus_id), words)
+    return {word: sorted(packed.split("\n")) for word, packed in found.items() if packed}
+
+
+def drop(db: Session, corpus_id: int) -> None:
+    db.execute(text(f"DROP TABLE IF EXISTS {table_name(corpus_id)}"))
+    db.execute(text(f"DROP TABLE IF EXISTS {vocab_table_name(corpus_id)}"))
+
+
+def trigrams(word: str) -> List[str]:
+    return sorted({word[i:i + TRIGRAM] for i in range(len(word) - TRIGRAM + 1)})
+
+
+def deletion_trigrams(word: str) -> List[str]:
+    """Trigrams of the word and of every variant with one character removed."""
+    grams = set(trigrams(word))
+    for i in range(len(word)):
+        grams.update(trigrams(word[:i] + word[i + 1:]))
+    return sorted(grams)
+
+
+def _phrase(term: str) -> str:
+    return '"' + term.replace('"', '""') + '"'
+
+
+def _matching(db: Session, table: str, grams: List[str], min_shared: int, limit: int) -> List[str]:
+    union = " UNION ALL ".join(
+        f"SELECT rowid, word FROM {table} WHERE {table} MATCH :g{i}" for i in range(len(grams))
+    )
+    query = text(
+        f"SELECT word, COUNT(*) AS shared FROM ({union}) GROUP BY rowid "
+        f"HAVING shared >= :min_shared ORDER BY shared DESC LIMIT :limit"
+    )
+    params = {f"g{i}": _phrase(gram) for i, gram in enumerate(grams)}
+    rows = db.execute(query, {**params, "min_shared": min_shared, "limit": limit})
+    return [row.word for row in rows]
+
+
+def candidates(db: Session, corpus_id: int, word: str, limit: int = WORD_INDEX_CANDIDATES) -> List[str]:
+    """Words of the corpus sharing the most trigrams with `word`, at most `limit` of them."""
+    table = table_name(corpus_id)
+    grams = trigrams(word)
+    if not grams:
+        # a query shorter than a trigram is closest to the short words
+        rows = db.execute(
+            text(f"SELECT word FROM {table} WHERE length(word) <= :length LIMIT :limit"),
+            {"length": len(word) + WORD_INDEX_MAX_DISTANCE, "limit": limit}
+        )
+        return [row.word for row in rows]
+
+    # q-gram lemma: one edit destroys at most TRIGRAM trigrams of the word
+    min_shared = max(1, len(grams) - TRIGRAM * WORD_INDEX_MAX_DISTANCE)
+    words = _matching(db, table, grams, min_shared, limit)
+    if len(words) < MIN_CANDIDATES:
+        # short words and transpositions can share no trigram at all ("pyhton" and
+        # "python"), their one-deletion variants usually do ("pyton", "pyhon")
+        words = _matching(db, table, deletion_trigrams(word), 1, limit)
+    return words
@@ -0,0 +1,111 @@
+"""
+Trie autocomplete vs. scoring the whole vocabulary on every keystroke.
+
+Reports the time to build the trie, the memory it holds and the per-query
+time of exact-prefix and fuzzy-prefix completion (typed prefixes of
+vocabulary words, with one or two typos for the fuzzy runs). Without
+--file the words are synthetic, glued from syllables so that prefixes are
+shared the way they are in natural language. --check compares a few
+queries with a brute-force prefix distance over the whole vocabulary.
+
+Usage (from the 3lab directory):
+    python -m benchmarks.autocomplete [--words 1000000] [--queries 200] [--file text.txt]
+"""
+import argparse
+import random
+import statistics
+import time
+import tracemalloc
+
+from app.services import autocomplete
+from app.services.fuzzy_algorithms import levenshtein_distance
+
+SYLLABLES = [
+    c + v for c in "бвгджзклмнпрстфхцчшщ" for v in "аеиоуыэюяё"
+] + ["ст", "ов", "ен", "ка", "ни", "ть", "ся", "ль", "ий", "ая"]
+
+LETTERS = "абвгдеёжзийклмнопрстуфхцчшщъыьэюя"
+
+
+def make_words(count: int, rng: random.Random) -> list:
+    words = set()
+    while len(words) < count:
+        words.add("".join(rng.choices(SYLLABLES, k=rng.randint(1, 5))))
+    return list(words)
+
+
+def typos(prefix: str, count: int, rng: random.Random) -> str:
+    for _ in range(count):
+        i = rng.randrange(len(prefix))
+        prefix = prefix[:i] + rng.choice(LETTERS) + prefix[i + 1:]
+    return prefix
+
+
+def prefix_distance(prefix: str, word: str) -> int:
+    return min(levenshtein_distance(prefix, word[:i]) for i in range(len(word) + 1))
+
+
+def percentile(samples: list, q: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--words", type=int, default=1000000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--file", help="use the words of this UTF-8 text instead of synthetic ones")
+    parser.add_argument("--check", action="store_true", help="verify 5 fuzzy queries by brute force")
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    if args.file:
+        with open(args.file, encoding="utf-8") as f:
+            words = list(set(f.read().split()))
+    else:
+        words = make_words(args.words, rng)
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    trie = autocomplete.SortedTrie(words)
+    build_time = time.perf_counter() - started
+    # only the list: the strings are shared with the vocabulary
+    trie_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print(f"trie of {len(trie)} words built in {build_time:.2f} s, {trie_bytes / 2 ** 20:.1f} MB")
+
+    samples = [w for w in rng.sample(words, min(len(words), args.queries * 4)) if len(w) >= 3]
+    print(f"{'mode':>8} {'prefix':>6} {'mean ms':>8} {'p95 ms':>7} {'found':>6}")
+    for errors, distance in ((0, 0), (1, 1), (2, 2)):
+        for length in (3, 5, 7):
+            prefixes = [
+                typos(w[:length], errors, rng) for w in samples if len(w) >= length
+            ][:args.queries]
+            allowed = [autocomplete.distance_limit(p, distance) for p in prefixes]
+            if not prefixes or max(allowed) < errors:
+                continue
+            times, found = [], 0
+            for prefix, limit in zip(prefixes, allowed):
+                started = time.perf_counter()
+                found += len(trie.complete(prefix, args.limit, limit))
+                times.append(time.perf_counter() - started)
+            mode = "exact" if distance == 0 else f"fuzzy {distance}"
+            print(
+                f"{mode:>8} {length:>6} {statistics.mean(times) * 1000:>8.2f}"
+                f" {percentile(times, 0.95) * 1000:>7.2f} {found / len(prefixes):>6.1f}"
+            )
+
+    if args.check:
+        for word in samples[:5]:
+            prefix = typos(word[:6], 1, rng)
+            got = trie.complete(prefix, args.limit, 1)
+            expected = sorted(
+                (d, len(w), w) for w in words if (d := prefix_distance(prefix, w)) <= 1
+            )[:args.limit]
+            assert got == [(w, d) for d, _, w in expected], (prefix, got, expected)
+        print("fuzzy results match the brute-force prefix distance")
+
+
+if __name__ == "__main__":
+    main()
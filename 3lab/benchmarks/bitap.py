@@ -0,0 +1,61 @@
+"""
+Bitap search over raw text: plain bit-parallel scan vs. the pigeonhole prefilter.
+
+Reports the time per query for several max_errors values and checks that
+both paths find the same best match.
+
+Usage (from the 3lab directory):
+    python -m benchmarks.bitap [--chars 1000000] [--word performance]
+"""
+import argparse
+import heapq
+import random
+import string
+import time
+
+from app.services import fuzzy_algorithms
+
+
+def make_text(chars: int, rng: random.Random) -> str:
+    words = []
+    size = 0
+    while size < chars:
+        word = "".join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 10)))
+        words.append(word)
+        size += len(word) + 1
+    return " ".join(words)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--chars", type=int, default=1000000)
+    parser.add_argument("--word", default="performance")
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    text = make_text(args.chars, rng)
+    # одно место с опечаткой посередине текста
+    middle = len(text) // 2
+    typo = args.word[:2] + args.word[3] + args.word[2] + args.word[4:]
+    text = f"{text[:middle]} {typo} {text[middle:]}"
+
+    print(f"{'errors':>6} {'scan s':>8} {'filter s':>9} {'best':>20}")
+    for max_errors in range(fuzzy_algorithms.max_errors_limit(args.word) + 1):
+        started = time.perf_counter()
+        scan = heapq.nsmallest(
+            1, fuzzy_algorithms.bitap_matches(args.word, text, max_errors),
+            key=lambda x: (x["distance"], x["start"])
+        )
+        scan_time = time.perf_counter() - started
+
+        started = time.perf_counter()
+        filtered = fuzzy_algorithms.search_text(args.word, [text], max_errors, limit=1)["results"]
+        filter_time = time.perf_counter() - started
+
+        assert scan == filtered, (scan, filtered)
+        best = f"{filtered[0]['word']}@{filtered[0]['start']}" if filtered else "-"
+        print(f"{max_errors:>6} {scan_time:>8.2f} {filter_time:>9.3f} {best:>20}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,316 @@
+"""
+Throughput of the Celery search pipeline at a fixed arrival rate.
+
+Replays a task file (JSON lines of word, algorithm, corpus_id and optionally
+priority and max_errors, like the scripts of cli_ws.py) or a synthetic mix
+through fuzzy_search_task. Tasks are sent open-loop, --rate per second on a
+fixed schedule whether or not the earlier ones have finished, so a pool too
+small for the load shows up as a growing queue wait instead of a slower
+sender.
+
+For every combination of --concurrency and --prefetch a fresh prefork worker
+is started, warmed up and then fed --duration seconds of tasks. Each row
+reports the completed tasks per second and the percentiles of queue wait
+(published to started, including the time a task sat prefetched in the
+worker), execution time and end-to-end latency (submitted to result stored).
+The smallest concurrency that keeps up with the rate with a flat queue wait
+is the one to run; a prefetch multiplier that lowers tasks/s or raises p99
+shows tasks held by a busy process.
+
+By default the broker is a SQLite file (kombu SQLAlchemy transport) and
+results are files (Celery file backend) in a temporary folder, so only the
+app itself is needed; --broker and --backend point to Redis to measure the
+deployment as it runs. The SQLite broker is polled every --poll seconds,
+which adds up to that much to the queue wait, and a worker that may hold
+only one task in total (concurrency 1, prefetch 1) polls it only every 2 s
+while that task runs; such rows are meaningful with Redis only. Without --tasks a temporary database is
+created with corpora of --corpus-sizes distinct words and the tasks are typos
+of their words; with --tasks the corpora are read from DATABASE_URL.
+Admission control is off, so an overloaded run queues instead of rejecting.
+
+Usage (from the 3lab directory):
+    python -m benchmarks.celery_throughput [--tasks tasks.jsonl] [--rate 20] [--duration 30] [--concurrency 1,2,4] [--prefetch 1,4]
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import string
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+# брокер по умолчанию: очередь в SQLite рядом с остальными файлами прогона
+SQLITE_BROKER = "sqla+sqlite:///{spool}/broker.db"
+ALGORITHM_MIX = {"levenshtein": 6, "ngram": 3, "bitap": 1}
+
+
+def run_worker(concurrency: int, prefetch: int) -> None:
+    from kombu.transport import sqlalchemy
+
+    from app.celery_worker import celery_app
+
+    # транспорт передаёт broker_transport_options в create_engine, поэтому интервал задаётся классу
+    sqlalchemy.Transport.polling_interval = float(os.environ["BENCH_POLL_INTERVAL"])
+    celery_app.worker_main([
+        "worker", "--pool", "prefork", "-c", str(concurrency),
+        "--prefetch-multiplier", str(prefetch), "-n", f"bench{concurrency}x{prefetch}@%h",
+        "--without-gossip", "--without-mingle", "--without-heartbeat", "-l", "warning",
+    ])
+
+
+def make_corpora(sizes: List[int], rng: random.Random) -> List[Tuple[int, List[str]]]:
+    """Corpora of random words in the database of DATABASE_URL: (corpus id, vocabulary)."""
+    from app.cruds import corpus as corpus_crud
+    from app.db.database import SessionLocal, create_tables
+    from app.schemas.corpus import CorpusCreate
+
+    create_tables()
+    corpora = []
+    db = SessionLocal()
+    try:
+        for size in sizes:
+            words = list({
+                "".join(rng.choices(string.ascii_lowercase, k=rng.randint(4, 10))) for _ in range(size)
+            })
+            text = " ".join(rng.choices(words, k=size * 3))
+            corpus = corpus_crud.create_corpus(db, CorpusCreate(corpus_name=f"bench{size}", text=text))
+            corpora.append((corpus.id, words))
+    finally:
+        db.close()
+    return corpora
+
+
+def typo(word: str, rng: random.Random) -> str:
+    i = rng.randrange(len(word))
+    return word[:i] + rng.choice(string.ascii_lowercase) + word[i + 1:]
+
+
+def synthetic_tasks(corpora: List[Tuple[int, List[str]]], count: int, rng: random.Random) -> List[dict]:
+    algorithms = rng.choices(list(ALGORITHM_MIX), weights=list(ALGORITHM_MIX.values()), k=count)
+    tasks = []
+    for algorithm in algorithms:
+        corpus_id, words = rng.choice(corpora)
+        task = {"word": typo(rng.choice(words), rng), "algorithm": algorithm, "corpus_id": corpus_id}
+        if algorithm == "bitap":
+            task["max_errors"] = 1
+        tasks.append(task)
+    return tasks
+
+
+def read_tasks(path: str) -> List[dict]:
+    tasks = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            task = json.loads(line)
+            if isinstance(task, dict) and {"word", "algorithm", "corpus_id"} <= task.keys():
+                tasks.append(task)
+    return tasks
+
+
+def submit(celery_app, task: dict) -> str:
+    from app.services import search_tasks
+
+    params = {"max_errors": task["max_errors"]} if task.get("max_errors") is not None else {}
+    return search_tasks.submit_search(
+        celery_app, task["word"], task["algorithm"], int(task["corpus_id"]),
+        priority=task.get("priority"), **params
+    ).task_id
+
+
+def finished_at(meta: dict) -> Optional[float]:
+    done = meta.get("date_done")
+    if isinstance(done, str):
+        done = datetime.fromisoformat(done)
+    if not isinstance(done, datetime):
+        return None
+    # Celery хранит date_done в UTC, старые версии — без часового пояса
+    return (done if done.tzinfo else done.replace(tzinfo=timezone.utc)).timestamp()
+
+
+def collect(celery_app, task_ids: List[str], timeout: float) -> Dict[str, dict]:
+    """Wait for the tasks to finish; metadata of the finished ones by task id."""
+    from celery import states
+
+    from app.services import search_tasks
+
+    pending = list(dict.fromkeys(task_ids))
+    done: Dict[str, dict] = {}
+    deadline = time.monotonic() + timeout
+    while pending and time.monotonic() < deadline:
+        metas = search_tasks.fetch_task_metas(celery_app, pending)
+        for task_id, meta in zip(pending, metas):
+            if meta.get("status") in states.READY_STATES:
+                done[task_id] = meta
+        pending = [task_id for task_id in pending if task_id not in done]
+        if pending:
+            time.sleep(0.2)
+    return done
+
+
+def percentile(samples: List[float], q: float) -> float:
+    if not samples:
+        return float("nan")
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def run_point(celery_app, args, concurrency: int, prefetch: int, tasks: List[dict]) -> dict:
+    worker = subprocess.Popen([
+        sys.executable, "-m", "benchmarks.celery_throughput", "--worker",
+        "--concurrency", str(concurrency), "--prefetch", str(prefetch),
+    ], stdout=subprocess.DEVNULL)
+    try:
+        # прогрев заодно ждёт, пока воркер запустится и загрузит корпуса
+        warmup = [submit(celery_app, task) for task in tasks[:args.warmup]]
+        metas = collect(celery_app, warmup, args.timeout)
+        if len(metas) < len(set(warmup)):
+            raise RuntimeError("worker did not finish the warm-up tasks")
+        for meta in metas.values():
+            if meta["status"] != "SUCCESS":
+                raise RuntimeError(f"warm-up task failed: {meta['result']!r}")
+
+        count = max(1, int(args.rate * args.duration))
+        submitted: List[Tuple[str, float]] = []
+        lag = 0.0
+        started = time.time()
+        for i in range(count):
+            due = started + i / args.rate
+            now = time.time()
+            if due > now:
+                time.sleep(due - now)
+            else:
+                lag = max(lag, now - due)
+            task = tasks[(args.warmup + i) % len(tasks)]
+            submitted_at = time.time()
+            submitted.append((submit(celery_app, task), submitted_at))
+        metas = collect(celery_app, [task_id for task_id, _ in submitted], args.timeout)
+    finally:
+        worker.terminate()
+        try:
+            worker.wait(10)
+        except subprocess.TimeoutExpired:
+            worker.kill()
+            worker.wait()
+
+    queue_wait, execution, latency, failed = [], [], [], 0
+    last = started
+    for task_id, submitted_at in submitted:
+        meta = metas.get(task_id)
+        if meta is None:
+            continue
+        result = meta.get("result")
+        if meta.get("status") != "SUCCESS" or not isinstance(result, dict) or "error" in result:
+            failed += 1
+            continue
+        done = finished_at(meta) or time.time()
+        last = max(last, done)
+        latency.append(done - submitted_at)
+        execution.append(result.get("execution_time", 0.0))
+        if "queue_wait" in result.get("stages", {}):
+            queue_wait.append(result["stages"]["queue_wait"])
+    return {
+        "concurrency": concurrency,
+        "prefetch": prefetch,
+        "sent": len(submitted),
+        "coalesced": len(submitted) - len({task_id for task_id, _ in submitted}),
+        "done": len(latency),
+        "failed": failed,
+        "lost": len(submitted) - len(latency) - failed,
+        "tasks_per_s": len(latency) / max(last - started, 1e-9),
+        "send_lag": lag,
+        "queue_wait": queue_wait,
+        "execution": execution,
+        "latency": latency,
+    }
+
+
+def print_row(point: dict) -> None:
+    ms = lambda samples, q: percentile(samples, q) * 1000
+    print(
+        f"{point['concurrency']:>4} {point['prefetch']:>4} {point['done']:>6} {point['tasks_per_s']:>7.1f}"
+        f" {ms(point['queue_wait'], 0.5):>7.0f} {ms(point['queue_wait'], 0.95):>7.0f}"
+        f" {ms(point['queue_wait'], 0.99):>7.0f} {ms(point['execution'], 0.5):>7.0f}"
+        f" {ms(point['execution'], 0.95):>7.0f} {ms(point['latency'], 0.5):>7.0f}"
+        f" {ms(point['latency'], 0.95):>7.0f} {ms(point['latency'], 0.99):>7.0f}"
+        f" {point['failed'] + point['lost']:>5}"
+    )
+    if point["coalesced"]:
+        print(f"      {point['coalesced']} submissions joined a search already in flight")
+    if point["send_lag"] > 1 / 10:
+        print(f"      the sender fell {point['send_lag']:.2f} s behind schedule: the offered rate is lower")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tasks", help="JSON lines of searches to replay, cycled; default: a synthetic mix")
+    parser.add_argument("--rate", type=float, default=20, help="tasks sent per second")
+    parser.add_argument("--duration", type=float, default=30, help="seconds of sending per run")
+    parser.add_argument("--concurrency", default="1,2,4", help="worker processes to try, comma-separated")
+    parser.add_argument("--prefetch", default="1,4", help="prefetch multipliers to try, comma-separated")
+    parser.add_argument("--warmup", type=int, default=10, help="tasks run before measuring")
+    parser.add_argument("--timeout", type=float, default=120, help="seconds to wait for the tasks of a run")
+    parser.add_argument("--corpus-sizes", default="2000,20000,100000", help="words of the synthetic corpora")
+    parser.add_argument("--broker", help="broker URL, e.g. redis://localhost:6379/0; default: a SQLite file")
+    parser.add_argument("--backend", help="result backend URL; default: files in a temporary folder")
+    parser.add_argument("--poll", type=float, default=0.01, help="polling interval of the SQLite broker, seconds")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(int(args.concurrency), int(args.prefetch))
+        return
+
+    rng = random.Random(42)
+    spool = tempfile.mkdtemp(prefix="celery_bench_")
+    results = os.path.join(spool, "results")
+    os.makedirs(results)
+    broker = args.broker or SQLITE_BROKER.format(spool=spool)
+    # настройки читаются при импорте app, воркеры наследуют окружение
+    os.environ.update({
+        "CELERY_BROKER_URL": broker,
+        "CELERY_RESULT_BACKEND": args.backend or f"file://{results}",
+        "BENCH_POLL_INTERVAL": str(args.poll),
+        "ADMISSION_ENABLED": "false",
+    })
+    if not args.tasks:
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(spool, 'bench.db')}"
+        os.environ["CREATE_TABLES"] = "always"
+
+    try:
+        from app.celery_worker import celery_app
+
+        if args.tasks:
+            tasks = read_tasks(args.tasks)
+            if not tasks:
+                parser.error(f"no tasks with word, algorithm and corpus_id in {args.tasks}")
+        else:
+            corpora = make_corpora([int(size) for size in args.corpus_sizes.split(",")], rng)
+            tasks = synthetic_tasks(corpora, args.warmup + int(args.rate * args.duration), rng)
+
+        print(
+            f"{len(tasks)} tasks at {args.rate:g}/s for {args.duration:g} s,"
+            f" broker {broker.split('://')[0]}, {os.cpu_count()} CPUs"
+        )
+        print(
+            f"{'conc':>4} {'pref':>4} {'done':>6} {'tasks/s':>7} {'wait50':>7} {'wait95':>7} {'wait99':>7}"
+            f" {'exec50':>7} {'exec95':>7} {'e2e50':>7} {'e2e95':>7} {'e2e99':>7} {'fail':>5}"
+        )
+        for concurrency in [int(value) for value in args.concurrency.split(",")]:
+            for prefetch in [int(value) for value in args.prefetch.split(",")]:
+                print_row(run_point(celery_app, args, concurrency, prefetch, tasks))
+                if concurrency * prefetch == 1 and not broker.startswith("redis"):
+                    # синхронный цикл воркера ждёт опрашиваемый брокер до 2 с, пока единственная задача занята
+                    print("      one task in flight: a polling broker adds up to 2 s per task, use Redis")
+    finally:
+        shutil.rmtree(spool, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
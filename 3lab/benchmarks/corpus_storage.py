@@ -0,0 +1,110 @@
+"""
+Plain Text column vs. compressed, content-addressed corpus blobs.
+
+Reports the bytes stored per codec and level, and the time and bytes read
+to load a corpus vocabulary: the old path selects and splits the whole
+text, the blob path decompresses only the stored vocabulary. Without
+--file the text is synthetic with Zipf-distributed word frequencies, like
+natural language.
+
+Usage (from the 3lab directory):
+    python -m benchmarks.corpus_storage [--words 2000000] [--file text.txt]
+"""
+import argparse
+import os
+import random
+import string
+import tempfile
+import time
+
+from sqlalchemy import text
+from sqlalchemy.orm import sessionmaker
+
+from app.cruds import corpus as corpus_crud
+from app.db.database import Base, make_engine
+from app.models import corpus, user  # noqa: F401  (tables for create_all)
+from app.schemas.corpus import CorpusCreate
+from app.services import corpus_blobs
+
+
+def make_text(words: int, vocabulary: int, rng: random.Random) -> str:
+    lexicon = [
+        "".join(rng.choices(string.ascii_lowercase, k=rng.randint(2, 10))) for _ in range(vocabulary)
+    ]
+    weights = [1 / rank for rank in range(1, vocabulary + 1)]
+    return " ".join(rng.choices(lexicon, weights=weights, k=words))
+
+
+def timed(fn, repeat: int = 3):
+    best, result = float("inf"), None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--words", type=int, default=2000000)
+    parser.add_argument("--vocabulary", type=int, default=50000)
+    parser.add_argument("--file", help="use this UTF-8 text instead of a synthetic one")
+    args = parser.parse_args()
+
+    if args.file:
+        with open(args.file, encoding="utf-8") as f:
+            corpus_text = f.read()
+    else:
+        corpus_text = make_text(args.words, args.vocabulary, random.Random(42))
+    raw = corpus_text.encode("utf-8")
+    words = set(corpus_text.split())
+    mb = 2 ** 20
+    print(f"text {len(raw) / mb:.1f} MB, {len(words)} distinct words")
+
+    codecs = [("zlib", level) for level in (1, 6, 9)]
+    if corpus_blobs.zstandard is not None:
+        codecs += [("zstd", level) for level in (3, 9, 19)]
+    print(f"{'codec':>6} {'level':>6} {'text MB':>8} {'ratio':>6} {'vocab MB':>9} {'pack s':>7}")
+    for codec, level in codecs:
+        corpus_blobs.CORPUS_BLOB_LEVEL = level
+        started = time.perf_counter()
+        packed = corpus_blobs.compress(raw, codec)
+        elapsed = time.perf_counter() - started
+        vocabulary = corpus_blobs.compress("\n".join(sorted(words)).encode("utf-8"), codec)
+        print(
+            f"{codec:>6} {level:>6} {len(packed) / mb:>8.2f} {len(raw) / len(packed):>6.1f}"
+            f" {len(vocabulary) / mb:>9.2f} {elapsed:>7.2f}"
+        )
+
+    corpus_blobs.CORPUS_BLOB_LEVEL = int(os.getenv("CORPUS_BLOB_LEVEL", "9"))
+    engine = make_engine(f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}")
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE plain (id INTEGER PRIMARY KEY, text TEXT)"))
+        conn.execute(text("INSERT INTO plain (id, text) VALUES (1, :t)"), {"t": corpus_text})
+
+    started = time.perf_counter()
+    corpus_crud.create_corpus(db, CorpusCreate(corpus_name="first", text=corpus_text))
+    first = time.perf_counter() - started
+    started = time.perf_counter()
+    corpus_crud.create_corpus(db, CorpusCreate(corpus_name="copy", text=corpus_text))
+    copy = time.perf_counter() - started
+    blobs, stored = db.execute(text("SELECT COUNT(*), SUM(length(data)) FROM corpus_blobs")).one()
+    print(f"upload {first:.2f} s, identical upload {copy:.2f} s; {blobs} blob of {stored / mb:.2f} MB")
+
+    def load_plain():
+        with engine.connect() as conn:
+            return set(conn.execute(text("SELECT text FROM plain WHERE id = 1")).scalar().split())
+
+    plain_time, plain_words = timed(load_plain)
+    blob_time, (_, blob_words) = timed(lambda: corpus_crud.get_vocabulary(db, 1))
+    vocabulary_bytes = db.execute(text("SELECT length(vocabulary) FROM corpus_blobs")).scalar()
+    assert plain_words == blob_words
+    print(f"{'load':>6} {'ms':>8} {'read MB':>8}")
+    print(f"{'plain':>6} {plain_time * 1000:>8.1f} {len(raw) / mb:>8.2f}")
+    print(f"{'blob':>6} {blob_time * 1000:>8.1f} {vocabulary_bytes / mb:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
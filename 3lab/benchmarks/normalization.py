@@ -0,0 +1,79 @@
+"""
+Vocabulary size and scan time with and without token normalization.
+
+For each set of steps reports the distinct words a search scans, the time
+to normalize the vocabulary on load and the per-query time of a full
+Levenshtein scan. Without --file the text is synthetic Russian-like prose:
+capitalized sentence starts, punctuation glued to words, quotes and "ё"
+written either way.
+
+Usage (from the 3lab directory):
+    python -m benchmarks.normalization [--words 300000] [--queries 5] [--file text.txt]
+"""
+import argparse
+import random
+import time
+
+from app.services import fuzzy_algorithms, normalization
+
+SYLLABLES = [c + v for c in "бвгдзклмнпрстхчш" for v in "аеиоуыяё"]
+
+STEP_SETS = ["", "nfc", "nfc,casefold", "nfc,casefold,punctuation", "nfc,casefold,punctuation,yo"]
+
+
+def make_text(words: int, vocabulary: int, rng: random.Random) -> str:
+    lexicon = ["".join(rng.choices(SYLLABLES, k=rng.randint(1, 4))) for _ in range(vocabulary)]
+    weights = [1 / rank for rank in range(1, vocabulary + 1)]
+    tokens = []
+    sentence_start = True
+    for word in rng.choices(lexicon, weights=weights, k=words):
+        if "ё" in word and rng.random() < 0.5:
+            word = word.replace("ё", "е")
+        if sentence_start or rng.random() < 0.03:
+            word = word.capitalize()
+        if rng.random() < 0.02:
+            word = f"«{word}»"
+        sentence_start = rng.random() < 0.08
+        if sentence_start:
+            word += rng.choice(".!?")
+        elif rng.random() < 0.1:
+            word += rng.choice(",;:")
+        tokens.append(word)
+    return " ".join(tokens)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--words", type=int, default=300000)
+    parser.add_argument("--vocabulary", type=int, default=30000)
+    parser.add_argument("--queries", type=int, default=5)
+    parser.add_argument("--file", help="use this UTF-8 text instead of a synthetic one")
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    if args.file:
+        with open(args.file, encoding="utf-8") as f:
+            text = f.read()
+    else:
+        text = make_text(args.words, args.vocabulary, rng)
+    tokens = set(text.split())
+    queries = [w.strip(".,;:!?«»").lower() for w in rng.sample(sorted(tokens), args.queries)]
+
+    print(f"{'steps':>28} {'words':>8} {'share':>6} {'load ms':>8} {'scan ms':>8}")
+    for steps in STEP_SETS:
+        normalization.configure(steps)
+        started = time.perf_counter()
+        words = list(normalization.group(tokens))
+        load = time.perf_counter() - started
+        started = time.perf_counter()
+        for query in queries:
+            fuzzy_algorithms.search_words(normalization.normalize_query(query), words, "levenshtein")
+        scan = (time.perf_counter() - started) / len(queries)
+        print(
+            f"{steps or 'none':>28} {len(words):>8} {len(words) / len(tokens):>6.0%}"
+            f" {load * 1000:>8.0f} {scan * 1000:>8.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""
+Compare Celery result payloads encoded with json and zmsgpack.
+
+Usage (from the 3lab directory):
+    python -m benchmarks.result_payload
+"""
+import random
+import string
+import timeit
+
+from kombu.serialization import dumps, loads
+
+from app.core.serialization import ZMSGPACK, register_zmsgpack
+
+
+def make_result(size: int) -> dict:
+    """Build a task result shaped like fuzzy_search_task output."""
+    rng = random.Random(size)
+    results = [
+        {
+            "word": "".join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 12))),
+            "distance": rng.randint(0, 10),
+        }
+        for _ in range(size)
+    ]
+    return {
+        "status": "SUCCESS",
+        "result": {"execution_time": 0.1234, "results": results},
+        "traceback": None,
+        "children": [],
+        "date_done": "2025-01-01T00:00:00",
+    }
+
+
+def measure(serializer: str, meta: dict, number: int):
+    content_type, encoding, payload = dumps(meta, serializer=serializer)
+    encode = timeit.timeit(lambda: dumps(meta, serializer=serializer), number=number)
+    decode = timeit.timeit(
+        lambda: loads(payload, content_type, encoding, accept=[content_type]),
+        number=number,
+    )
+    size = len(payload.encode("utf-8")) if isinstance(payload, str) else len(payload)
+    return size, encode / number * 1e6, decode / number * 1e6
+
+
+def main() -> None:
+    register_zmsgpack()
+    print(f"{'results':>8} {'serializer':>10} {'bytes':>10} {'encode us':>10} {'decode us':>10}")
+    for size in (10, 1000, 10000):
+        meta = make_result(size)
+        number = max(10, 20000 // size)
+        for serializer in ("json", ZMSGPACK):
+            size_b, enc, dec = measure(serializer, meta, number)
+            print(f"{size:>8} {serializer:>10} {size_b:>10} {enc:>10.1f} {dec:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Compare serialization paths of a large list response.
+
+    model   - response_model validation + FastAPI's default encoder
+    orjson  - response_model validation, rendered by ORJSONResponse
+    direct  - rows turned into dicts and returned as ORJSONResponse
+
+Usage (from the 3lab directory):
+    python -m benchmarks.serialization
+"""
+import gzip
+import random
+import string
+import timeit
+from types import SimpleNamespace
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.core.responses import ORJSONResponse
+from app.schemas.corpus import CorpusListOut
+
+
+def make_rows(size: int) -> list:
+    """Build objects shaped like Corpus ORM rows."""
+    rng = random.Random(size)
+    return [
+        SimpleNamespace(
+            id=i,
+            name="".join(rng.choices(string.ascii_lowercase, k=rng.randint(5, 20))),
+        )
+        for i in range(size)
+    ]
+
+
+def make_app(rows: list) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/model", response_model=CorpusListOut)
+    def model():
+        return {"corpuses": rows}
+
+    @app.get("/orjson", response_model=CorpusListOut, response_class=ORJSONResponse)
+    def orjson_model():
+        return {"corpuses": rows}
+
+    @app.get("/direct", response_model=CorpusListOut)
+    def direct():
+        return ORJSONResponse({"corpuses": [{"id": r.id, "name": r.name} for r in rows]})
+
+    return app
+
+
+def main() -> None:
+    print(f"{'rows':>8} {'path':>8} {'bytes':>10} {'gzip':>10} {'request us':>11}")
+    for size in (100, 1000, 10000):
+        client = TestClient(make_app(make_rows(size)))
+        number = max(5, 20000 // size)
+        for path in ("model", "orjson", "direct"):
+            body = client.get(f"/{path}").content
+            elapsed = timeit.timeit(lambda: client.get(f"/{path}"), number=number)
+            print(
+                f"{size:>8} {path:>8} {len(body):>10} {len(gzip.compress(body, 5)):>10}"
+                f" {elapsed / number * 1e6:>11.0f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Searches reading corpora while uploads write to the same SQLite file.
+
+    default      - one engine, SQLite defaults (rollback journal)
+    performance  - WAL + pragmas, reads through the read-only pool
+
+Usage (from the 3lab directory):
+    python -m benchmarks.sqlite_concurrency [--seconds 5] [--readers 4]
+"""
+import argparse
+import os
+import random
+import string
+import tempfile
+import threading
+import time
+
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from app.db.database import make_engine
+
+
+def make_text(size: int) -> str:
+    rng = random.Random(size)
+    return " ".join(
+        "".join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 10))) for _ in range(size)
+    )
+
+
+def run(profile: str, seconds: float, readers: int) -> dict:
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    url = f"sqlite:///{path}"
+    write_engine = make_engine(url, profile=profile)
+    read_engine = make_engine(url, read_only=True, profile=profile) if profile == "performance" else write_engine
+    with write_engine.begin() as conn:
+        conn.execute(text("CREATE TABLE corpuses (id INTEGER PRIMARY KEY, name TEXT, text TEXT)"))
+        for i in range(20):
+            conn.execute(text("INSERT INTO corpuses (name, text) VALUES (:n, :t)"),
+                         {"n": f"seed{i}", "t": make_text(20000)})
+
+    payload = make_text(50000)
+    stop = time.monotonic() + seconds
+    stats = {"reads": 0, "writes": 0, "errors": 0, "latencies": []}
+    lock = threading.Lock()
+
+    def writer():
+        n = 0
+        while time.monotonic() < stop:
+            try:
+                with write_engine.begin() as conn:
+                    conn.execute(text("INSERT INTO corpuses (name, text) VALUES (:n, :t)"),
+                                 {"n": f"upload{n}", "t": payload})
+                n += 1
+            except OperationalError:
+                with lock:
+                    stats["errors"] += 1
+        with lock:
+            stats["writes"] += n
+
+    def reader():
+        rng = random.Random()
+        latencies = []
+        errors = 0
+        while time.monotonic() < stop:
+            started = time.perf_counter()
+            try:
+                with read_engine.connect() as conn:
+                    conn.execute(text("SELECT text FROM corpuses WHERE id = :id"),
+                                 {"id": rng.randint(1, 20)}).scalar()
+                latencies.append(time.perf_counter() - started)
+            except OperationalError:
+                errors += 1
+        with lock:
+            stats["reads"] += len(latencies)
+            stats["errors"] += errors
+            stats["latencies"].extend(latencies)
+
+    threads = [threading.Thread(target=writer)] + [threading.Thread(target=reader) for _ in range(readers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    write_engine.dispose()
+    read_engine.dispose()
+
+    latencies = sorted(stats["latencies"]) or [0.0]
+    return {
+        "reads/s": stats["reads"] / seconds,
+        "writes/s": stats["writes"] / seconds,
+        "read p99 ms": latencies[int(len(latencies) * 0.99) - 1] * 1000,
+        "errors": stats["errors"],
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--readers", type=int, default=4)
+    args = parser.parse_args()
+
+    print(f"{'profile':>12} {'reads/s':>10} {'writes/s':>10} {'read p99 ms':>12} {'errors':>7}")
+    for profile in ("default", "performance"):
+        result = run(profile, args.seconds, args.readers)
+        print(
+            f"{profile:>12} {result['reads/s']:>10.0f} {result['writes/s']:>10.1f}"
+            f" {result['read p99 ms']:>12.2f} {result['errors']:>7}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Full vocabulary scan vs. FTS5 trigram prefilter on a large corpus.
+
+Reports per-query time, the number of scored words, memory held for the
+vocabulary, how often the best match of the prefilter equals the best
+match of the full scan and the cost of appending words to the index.
+
+Usage (from the 3lab directory):
+    python -m benchmarks.word_index [--words 200000] [--queries 20] [--append 1000]
+"""
+import argparse
+import os
+import random
+import string
+import tempfile
+import time
+import tracemalloc
+
+from sqlalchemy.orm import sessionmaker
+
+from app.db.database import make_engine
+from app.services import fuzzy_algorithms, normalization, word_index
+
+
+def make_words(count: int, rng: random.Random) -> list:
+    words = set()
+    while len(words) < count:
+        words.add("".join(rng.choices(string.ascii_lowercase, k=rng.randint(4, 12))))
+    return list(words)
+
+
+def typo(word: str, rng: random.Random) -> str:
+    i = rng.randrange(len(word))
+    return word[:i] + rng.choice(string.ascii_lowercase) + word[i + 1:]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--words", type=int, default=200000)
+    parser.add_argument("--queries", type=int, default=20)
+    parser.add_argument("--append", type=int, default=1000, help="words per append, half of them known")
+    parser.add_argument("--algorithm", default="levenshtein", choices=["levenshtein", "ngram"])
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    engine = make_engine(f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}")
+    db = sessionmaker(bind=engine)()
+
+    tracemalloc.start()
+    words = make_words(args.words, rng)
+    vocabulary_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    started = time.perf_counter()
+    word_index.build(db, 1, normalization.group(words))
+    db.commit()
+    print(f"index of {len(words)} words built in {time.perf_counter() - started:.2f} s")
+
+    queries = [typo(rng.choice(words), rng) for _ in range(args.queries)]
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    full_results = [fuzzy_algorithms.search_words(q, words, args.algorithm)["results"] for q in queries]
+    scan_time = time.perf_counter() - started
+    scan_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    scored = 0
+    index_results = []
+    for query in queries:
+        candidates = word_index.candidates(db, 1, query)
+        scored += len(candidates)
+        index_results.append(fuzzy_algorithms.search_words(query, candidates, args.algorithm)["results"])
+    index_time = time.perf_counter() - started
+    index_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    same_best = sum(
+        bool(filtered) and filtered[0]["distance"] == full[0]["distance"]
+        for full, filtered in zip(full_results, index_results)
+    )
+    n = len(queries)
+    mb = 2 ** 20
+    print(f"{'path':>8} {'ms/query':>10} {'scored':>10} {'held MB':>8} {'peak MB':>8}")
+    print(f"{'scan':>8} {scan_time / n * 1000:>10.1f} {len(words):>10} {vocabulary_bytes / mb:>8.1f} {scan_peak / mb:>8.1f}")
+    print(f"{'index':>8} {index_time / n * 1000:>10.1f} {scored // n:>10} {0:>8.1f} {index_peak / mb:>8.1f}")
+    print(f"best distance matches the full scan in {same_best}/{n} queries")
+
+    appended = [typo(rng.choice(words), rng) for _ in range(args.append // 2)]
+    appended += rng.sample(words, args.append // 2)
+    started = time.perf_counter()
+    added = word_index.add(db, 1, normalization.group(appended))
+    db.commit()
+    print(f"append of {len(appended)} words ({added} new) took {(time.perf_counter() - started) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,22 @@
-from typing import Dict, List, Optional, Any, NoReturn
+from typing import Callable, Dict, List, Optional, Any, NoReturn
 import asyncio
 import json
 import argparse
 import getpass
-from dataclasses import dataclass
+import time
+import uuid
+from dataclasses import dataclass, field
 import requests
 from requests.exceptions import RequestException
 from colorama import Fore, Style, init as colorama_init
 import logging
-from celery import Celery
-from celery.result import AsyncResult
+import websockets
+from websockets.exceptions import ConnectionClosed, InvalidStatus, WebSocketException
+from celery import Celery, states
+from celery.backends.redis import RedisBackend
+from app.core.serialization import WS_MSGPACK, frame_size, ws_codec
+from app.services.admission import Overloaded
+from app.services.search_tasks import cancel_search, cancel_searches, submit_search
 
 # Initialize colorama and logging
 colorama_init()
@@ -18,31 +25,470 @@ logger = logging.getLogger(__name__)
 
 # Constants
 API_URL = "http://localhost:8000"
-REDIS_URL = "redis://localhost:6379/0"
+WS_URL = "ws://localhost:8000/ws"
+RECONNECT_MAX_DELAY = 10.0
+DEFAULT_CONCURRENCY = 32
+POLL_INTERVAL = 0.2
+# task ids per MGET when polling the result backend
+POLL_BATCH_SIZE = 500
+# how many times a script task is resubmitted after Retry-After when the server is over capacity
+OVERLOAD_RETRIES = 10
+# results pushed for tasks nobody waits for yet; older ones are dropped and fetched again on wait()
+FINISHED_CACHE_SIZE = 1000
+
+ProgressCallback = Callable[[Optional[Dict]], None]
 
 @dataclass
 class TaskConfig:
     word: str
     algorithm: str
     corpus_id: int
+    priority: Optional[str] = None
+    # только для algorithm=bitap
+    max_errors: Optional[int] = None
+
+    def search_params(self) -> Dict[str, Any]:
+        return {"max_errors": self.max_errors} if self.max_errors is not None else {}
 
 class CeleryClient:
     def __init__(self):
-        self.app = Celery(
-            "tasks",
-            broker=REDIS_URL,
-            backend=REDIS_URL
-        )
+        # Shared config: broker, serializers and corpus queue routing
+        self.app = Celery("tasks")
+        self.app.config_from_object("app.celeryconfig")
+        # identifies this client among the submitters of a coalesced search
+        self.submitter = f"cli:{uuid.uuid4().hex}"
 
     def send_task(self, task: TaskConfig) -> str:
-        task_obj = self.app.send_task(
-            "fuzzy_search_task",
-            args=[task.word, task.algorithm, task.corpus_id]
+        submission = submit_search(
+            self.app, task.word, task.algorithm, task.corpus_id, priority=task.priority,
+            submitter=self.submitter, **task.search_params()
         )
-        return task_obj.id
+        return submission.task_id
+
+    def cancel_task(self, task_id: str) -> bool:
+        return cancel_search(self.app, task_id, self.submitter)
+
+    def cancel_tasks(self, task_ids: List[str]) -> int:
+        return cancel_searches(self.app, task_ids, self.submitter)
+
+class AsyncResultClient:
+    """Waits for many task results at once with batched, non-blocking backend reads."""
+
+    def __init__(self, app: Celery, poll_interval: float = POLL_INTERVAL):
+        self.app = app
+        self.poll_interval = poll_interval
+        self._waiters: Dict[str, asyncio.Future] = {}
+        self._progress: Dict[str, ProgressCallback] = {}
+        self._poller: Optional[asyncio.Task] = None
+        self._redis = None
+        if isinstance(app.backend, RedisBackend):
+            import redis.asyncio as aioredis
+            self._redis = aioredis.from_url(app.conf.result_backend)
+
+    async def wait(self, task_id: str, on_progress: Optional[ProgressCallback] = None) -> Dict:
+        """Return the task meta ({status, result, ...}) once the task is ready."""
+        if on_progress is not None:
+            self._progress[task_id] = on_progress
+        future = self._waiters.get(task_id)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self._waiters[task_id] = future
+        if self._poller is None or self._poller.done():
+            self._poller = asyncio.create_task(self._poll())
+        return await asyncio.shield(future)
+
+    async def close(self) -> None:
+        if self._poller is not None:
+            self._poller.cancel()
+        if self._redis is not None:
+            await self._redis.aclose()
+
+    async def _poll(self) -> None:
+        while self._waiters:
+            task_ids = list(self._waiters)
+            for start in range(0, len(task_ids), POLL_BATCH_SIZE):
+                batch = task_ids[start:start + POLL_BATCH_SIZE]
+                try:
+                    metas = await self._fetch(batch)
+                except Exception as e:
+                    logger.error(f"Failed to fetch task results: {e}")
+                    break
+                for task_id, meta in zip(batch, metas):
+                    if not meta:
+                        continue
+                    if meta.get("status") in states.READY_STATES:
+                        future = self._waiters.pop(task_id)
+                        self._progress.pop(task_id, None)
+                        if not future.done():
+                            future.set_result(meta)
+                    elif meta.get("status") == "PROGRESS" and task_id in self._progress:
+                        self._progress[task_id](meta.get("result"))
+            await asyncio.sleep(self.poll_interval)
+
+    async def _fetch(self, task_ids: List[str]) -> List[Optional[Dict]]:
+        backend = self.app.backend
+        if self._redis is None:
+            return await asyncio.to_thread(
+                lambda: [backend.get_task_meta(task_id) for task_id in task_ids])
+        raw = await self._redis.mget([backend.get_key_for_task(task_id) for task_id in task_ids])
+        return [backend.decode_result(item) if item is not None else None for item in raw]
+
+class CeleryTransport:
+    """Submits through the broker and reads results from the backend directly."""
+
+    def __init__(self):
+        self.client = CeleryClient()
+        self.results = AsyncResultClient(self.client.app)
+        # submitted searches whose result nobody has received yet
+        self._pending = set()
+
+    async def submit(self, task: TaskConfig) -> str:
+        task_id = await asyncio.to_thread(self.client.send_task, task)
+        self._pending.add(task_id)
+        return task_id
+
+    async def wait(self, task_id: str, on_progress: Optional[ProgressCallback] = None) -> Dict:
+        meta = await self.results.wait(task_id, on_progress)
+        self._pending.discard(task_id)
+        return meta
+
+    async def cancel(self, task_id: str) -> bool:
+        self._pending.discard(task_id)
+        return await asyncio.to_thread(self.client.cancel_task, task_id)
+
+    async def close(self) -> None:
+        # exit or Ctrl-C: free the workers still busy with our searches
+        if self._pending:
+            task_ids, self._pending = list(self._pending), set()
+            try:
+                await asyncio.to_thread(self.client.cancel_tasks, task_ids)
+            except Exception as e:
+                logger.error(f"Failed to cancel pending tasks: {e}")
+        await self.results.close()
+
+class WebSocketTransport:
+    """
+    Multiplexes many searches and status subscriptions over one /ws connection.
+
+    Searches carry a request_id to match the server's STARTED reply; task
+    updates are matched by task_id. After a reconnect, unanswered searches
+    are resent (the server coalesces duplicates), every pending task is
+    subscribed again and unanswered cancels are repeated.
+    """
+
+    def __init__(self, token: str, url: str = WS_URL, ws_format: str = "json",
+                 compression: bool = True):
+        self.url = f"{url}?token={token}"
+        self.subprotocols = [WS_MSGPACK] if ws_format == "msgpack" else None
+        self.compression = "deflate" if compression else None
+        self.codec = ws_codec(None)
+        self.stats = {"messages_in": 0, "messages_out": 0, "bytes_in": 0, "bytes_out": 0,
+                      "encode_seconds": 0.0, "decode_seconds": 0.0}
+        self._ws = None
+        self._connected = asyncio.Event()
+        self._closing = False
+        self._runner: Optional[asyncio.Task] = None
+        self._next_request_id = 0
+        self._requests: Dict[int, tuple] = {}
+        self._waiters: Dict[str, asyncio.Future] = {}
+        self._progress: Dict[str, ProgressCallback] = {}
+        self._finished: Dict[str, Dict] = {}
+        self._cancels: Dict[str, asyncio.Future] = {}
+
+    async def submit(self, task: TaskConfig) -> str:
+        self._ensure_running()
+        self._next_request_id += 1
+        request_id = self._next_request_id
+        message = {
+            "word": task.word,
+            "algorithm": task.algorithm,
+            "corpus_id": task.corpus_id,
+            "request_id": request_id,
+            "subscribe": True,
+            **task.search_params(),
+        }
+        if task.priority:
+            message["priority"] = task.priority
+        future = asyncio.get_running_loop().create_future()
+        self._requests[request_id] = (message, future)
+        await self._send(message)
+        return await future
+
+    async def wait(self, task_id: str, on_progress: Optional[ProgressCallback] = None) -> Dict:
+        self._ensure_running()
+        if task_id in self._finished:
+            return self._finished.pop(task_id)
+        if on_progress is not None:
+            self._progress[task_id] = on_progress
+        future = self._waiters.get(task_id)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self._waiters[task_id] = future
+            # searches sent by this transport are already subscribed
+            await self._send({"subscribe": task_id})
+        return await asyncio.shield(future)
+
+    async def cancel(self, task_id: str) -> bool:
+        """Cancel the task on the server; a waiter gets a REVOKED meta right away."""
+        self._finished.pop(task_id, None)
+        self._ensure_running()
+        reply = self._cancels.get(task_id)
+        if reply is None:
+            reply = asyncio.get_running_loop().create_future()
+            self._cancels[task_id] = reply
+            # while disconnected, the cancel is sent by _resend on connect
+            await self._send({"cancel": task_id})
+        self._progress.pop(task_id, None)
+        future = self._waiters.pop(task_id, None)
+        if future is not None and not future.done():
+            future.set_result({"status": states.REVOKED, "result": "cancelled"})
+        return await asyncio.shield(reply)
+
+    async def close(self) -> None:
+        # the server cancels the searches of a closed connection by itself
+        self._closing = True
+        if self._ws is not None:
+            await self._ws.close()
+        if self._runner is not None:
+            self._runner.cancel()
+
+    def stats_report(self) -> Dict[str, Any]:
+        """Frame payload bytes and serialization time of this connection."""
+        report = {key: round(value, 4) if isinstance(value, float) else value
+                  for key, value in self.stats.items()}
+        report["format"] = self.codec.subprotocol if self.codec.binary else "json"
+        report["compression"] = self.compression
+        return report
+
+    def _encode(self, message: Dict):
+        started = time.perf_counter()
+        data = self.codec.encode(message)
+        self.stats["encode_seconds"] += time.perf_counter() - started
+        self.stats["messages_out"] += 1
+        self.stats["bytes_out"] += frame_size(data)
+        return data
+
+    def _decode(self, data) -> Dict:
+        started = time.perf_counter()
+        message = self.codec.decode(data) if isinstance(data, bytes) else json.loads(data)
+        self.stats["decode_seconds"] += time.perf_counter() - started
+        self.stats["messages_in"] += 1
+        self.stats["bytes_in"] += frame_size(data)
+        return message
+
+    def _ensure_running(self) -> None:
+        if self._runner is None or self._runner.done():
+            self._runner = asyncio.create_task(self._run())
+
+    async def _send(self, message: Dict) -> None:
+        # while disconnected, pending messages are sent by _resend on connect
+        if not self._connected.is_set():
+            return
+        try:
+            await self._ws.send(self._encode(message))
+        except ConnectionClosed:
+            pass
+
+    async def _run(self) -> None:
+        delay = 0.5
+        while not self._closing:
+            try:
+                async with websockets.connect(
+                    self.url, subprotocols=self.subprotocols, compression=self.compression
+                ) as ws:
+                    self._ws = ws
+                    # the server may decline msgpack; then the connection stays JSON
+                    self.codec = ws_codec(ws.subprotocol)
+                    # snapshot and flag together, so every message is sent exactly once
+                    requests = [message for message, _ in self._requests.values()]
+                    subscriptions = list(self._waiters)
+                    cancels = list(self._cancels)
+                    self._connected.set()
+                    delay = 0.5
+                    await self._resend(requests, subscriptions, cancels)
+                    async for raw in ws:
+                        self._dispatch(self._decode(raw))
+            except (WebSocketException, OSError) as e:
+                if self._closing:
+                    break
+                if self._rejected(e):
+                    # неверный или истёкший токен: повтор с ним же ничего не даст
+                    logger.error(f"WebSocket connection rejected: {e}")
+                    self._fail_pending(PermissionError(f"WebSocket connection rejected, check the token: {e}"))
+                    break
+                logger.warning(f"WebSocket connection lost ({e}), reconnecting in {delay:.1f}s")
+            finally:
+                self._connected.clear()
+            if self._closing:
+                break
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, RECONNECT_MAX_DELAY)
+
+    @staticmethod
+    def _rejected(error: Exception) -> bool:
+        """The server refused us: handshake answered 401/403 or the socket closed with 1008."""
+        if isinstance(error, InvalidStatus):
+            return error.response.status_code in (401, 403)
+        return isinstance(error, ConnectionClosed) and error.rcvd is not None and error.rcvd.code == 1008
+
+    def _fail_pending(self, error: Exception) -> None:
+        """Fail every search, wait and cancel still expecting an answer from the server."""
+        futures = [future for _, future in self._requests.values()]
+        futures += list(self._waiters.values()) + list(self._cancels.values())
+        self._requests.clear()
+        self._waiters.clear()
+        self._cancels.clear()
+        self._progress.clear()
+        for future in futures:
+            if not future.done():
+                future.set_exception(error)
+
+    async def _resend(self, requests: List[Dict], subscriptions: List[str], cancels: List[str]) -> None:
+        for message in requests:
+            await self._ws.send(self._encode(message))
+        for task_id in subscriptions:
+            await self._ws.send(self._encode({"subscribe": task_id}))
+        for task_id in cancels:
+            await self._ws.send(self._encode({"cancel": task_id}))
 
-    def get_result(self, task_id: str) -> AsyncResult:
-        return self.app.AsyncResult(task_id)
+    def _dispatch(self, message: Dict) -> None:
+        request_id = message.get("request_id")
+        if request_id in self._requests:
+            _, future = self._requests.pop(request_id)
+            if future.done():
+                return
+            if "retry_after" in message:
+                future.set_exception(Overloaded(message["error"], message["retry_after"]))
+            elif "error" in message:
+                future.set_exception(RuntimeError(message["error"]))
+            else:
+                future.set_result(message["task_id"])
+            return
+
+        task_id = message.get("task_id")
+        if task_id is None:
+            logger.error(f"Server error: {message.get('error', message)}")
+            return
+
+        if "cancelled" in message:
+            reply = self._cancels.pop(task_id, None)
+            if reply is not None and not reply.done():
+                reply.set_result(message["cancelled"])
+            return
+
+        status = message.get("status")
+        if status == "PROGRESS":
+            callback = self._progress.get(task_id)
+            if callback is not None:
+                callback(message)
+        elif status == "COMPLETED" or status in states.READY_STATES:
+            meta = self._to_meta(message)
+            self._progress.pop(task_id, None)
+            future = self._waiters.pop(task_id, None)
+            if future is None:
+                self._finished[task_id] = meta
+                if len(self._finished) > FINISHED_CACHE_SIZE:
+                    del self._finished[next(iter(self._finished))]
+            elif not future.done():
+                future.set_result(meta)
+
+    @staticmethod
+    def _to_meta(message: Dict) -> Dict:
+        """Convert a server push into the {status, result} shape of Celery metas."""
+        if message["status"] != "COMPLETED":
+            return {"status": message["status"], "result": message.get("error")}
+        result = {
+            key: message[key]
+            for key in ("execution_time", "results", "profile_id", "error")
+            if key in message
+        }
+        return {"status": states.SUCCESS, "result": result}
+
+@dataclass
+class ScriptStats:
+    latencies: List[float] = field(default_factory=list)
+    failed: int = 0
+    started_at: float = field(default_factory=time.perf_counter)
+
+    def percentile(self, q: float) -> float:
+        ordered = sorted(self.latencies)
+        if not ordered:
+            return 0.0
+        index = min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))
+        return ordered[index]
+
+    def summary(self) -> Dict[str, Any]:
+        elapsed = time.perf_counter() - self.started_at
+        total = len(self.latencies)
+        return {
+            "tasks": total,
+            "failed": self.failed,
+            "elapsed_s": round(elapsed, 3),
+            "throughput_per_s": round(total / elapsed, 2) if elapsed else 0.0,
+            "latency_p50_s": round(self.percentile(50), 4),
+            "latency_p90_s": round(self.percentile(90), 4),
+            "latency_p99_s": round(self.percentile(99), 4),
+            "latency_max_s": round(max(self.latencies, default=0.0), 4),
+        }
+
+class ScriptRunner:
+    """Replays a task script with bounded concurrency and writes NDJSON results."""
+
+    def __init__(self, transport, concurrency: int, output_path: str):
+        self.transport = transport
+        self.concurrency = max(1, concurrency)
+        self.output_path = output_path
+
+    async def run(self, tasks: List[Dict]) -> Dict[str, Any]:
+        semaphore = asyncio.Semaphore(self.concurrency)
+        stats = ScriptStats()
+
+        with open(self.output_path, "w", encoding="utf-8") as out:
+            async def run_one(index: int, task_data: Dict) -> None:
+                async with semaphore:
+                    record = await self._run_task(index, task_data)
+                stats.latencies.append(record["latency_s"])
+                if record["status"] != states.SUCCESS:
+                    stats.failed += 1
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+            await asyncio.gather(*(run_one(i, t) for i, t in enumerate(tasks)))
+        summary = stats.summary()
+        if hasattr(self.transport, "stats_report"):
+            summary["transport"] = self.transport.stats_report()
+        return summary
+
+    async def _run_task(self, index: int, task_data: Dict) -> Dict:
+        started = time.perf_counter()
+        record: Dict[str, Any] = {"index": index, "task": task_data}
+        try:
+            # batch jobs go to the bulk queues unless the line says otherwise
+            task = TaskConfig(**{"priority": "bulk", **task_data})
+            task_id = await self._submit(task, record)
+            record["task_id"] = task_id
+            meta = await self.transport.wait(task_id)
+            result = meta.get("result")
+            if meta["status"] == states.SUCCESS and isinstance(result, dict) and "error" in result:
+                record.update(status="ERROR", error=result["error"])
+            elif meta["status"] == states.SUCCESS:
+                record.update(status=states.SUCCESS, result=result)
+            else:
+                record.update(status=meta["status"], error=str(result))
+        except Exception as e:
+            record.update(status="ERROR", error=str(e))
+        record["latency_s"] = round(time.perf_counter() - started, 4)
+        return record
+
+    async def _submit(self, task: TaskConfig, record: Dict) -> str:
+        """Submit, backing off for Retry-After while the server refuses work."""
+        for attempt in range(OVERLOAD_RETRIES + 1):
+            try:
+                return await self.transport.submit(task)
+            except Overloaded as e:
+                if attempt == OVERLOAD_RETRIES:
+                    raise
+                record["overload_retries"] = attempt + 1
+                await asyncio.sleep(e.retry_after)
 
 class APIClient:
     @staticmethod
@@ -67,26 +513,13 @@ class OutputFormatter:
         return f"{color}{label}{Style.RESET_ALL}"
 
 class TaskManager:
-    def __init__(self):
-        self.celery_client = CeleryClient()
-
-    async def poll_status(self, task_id: str) -> None:
-        while True:
-            result = self.celery_client.get_result(task_id)
-            
-            if result.successful():
-                self._handle_success(task_id, result.result)
-                break
-            elif result.state == "PROGRESS":
-                self._handle_progress(result.info)
-            elif result.failed():
-                print(OutputFormatter.color_block("[FAILED]", Fore.RED))
-                print(f"Task failed: {result.result}")
-                break
-            else:
-                print(OutputFormatter.color_block("[STATUS]", Fore.YELLOW), result.state)
-            
-            await asyncio.sleep(1)
+    def show_result(self, task_id: str, meta: Dict) -> None:
+        if meta["status"] == states.SUCCESS:
+            self._handle_success(task_id, meta.get("result"))
+        else:
+            print(OutputFormatter.color_block(f"[{meta['status']}]", Fore.RED))
+            print(f"Task failed: {meta.get('result')}")
+            print("-" * 50)
 
     def _handle_success(self, task_id: str, res: Optional[Dict]) -> None:
         if not res or res.get("results") is None or res.get("execution_time") is None:
@@ -114,31 +547,42 @@ class TaskManager:
               f"{progress}% — {current_word}")
 
 class CLI:
-    def __init__(self):
+    def __init__(self, transport=None):
         self.task_manager = TaskManager()
-        self.celery_client = CeleryClient()
+        self.transport = transport or CeleryTransport()
 
     async def run_interactive_session(self, token: str) -> None:
-        print("\nAvailable commands: search, status, exit\n")
-        while True:
-            action = input("> ").strip().lower()
-            if action == "exit":
-                break
-            elif action == "search":
-                await self._handle_search()
-            elif action == "status":
-                await self._handle_status()
-            else:
-                print(OutputFormatter.color_block("Unknown command.", Fore.YELLOW))
+        print("\nAvailable commands: search, status, cancel, exit\n")
+        try:
+            while True:
+                # read input in a thread so the transport keeps running meanwhile
+                action = (await asyncio.to_thread(input, "> ")).strip().lower()
+                if action == "exit":
+                    break
+                elif action == "search":
+                    await self._handle_search()
+                elif action == "status":
+                    await self._handle_status()
+                elif action == "cancel":
+                    await self._handle_cancel()
+                else:
+                    print(OutputFormatter.color_block("Unknown command.", Fore.YELLOW))
+        finally:
+            await self.transport.close()
 
     async def _handle_search(self) -> None:
         try:
-            word = input("Word to search: ").strip()
-            algorithm = input("Algorithm (levenshtein/ngram): ").strip()
-            corpus_id = int(input("Corpus ID: ").strip())
-            
-            task = TaskConfig(word=word, algorithm=algorithm, corpus_id=corpus_id)
-            task_id = self.celery_client.send_task(task)
+            word = (await asyncio.to_thread(input, "Word to search: ")).strip()
+            algorithm = (await asyncio.to_thread(input, "Algorithm (levenshtein/ngram/bitap): ")).strip()
+            corpus_id = int((await asyncio.to_thread(input, "Corpus ID: ")).strip())
+            max_errors = None
+            if algorithm == "bitap":
+                raw = (await asyncio.to_thread(input, "Max errors (empty for default): ")).strip()
+                max_errors = int(raw) if raw else None
+
+            task = TaskConfig(word=word, algorithm=algorithm, corpus_id=corpus_id,
+                              priority="interactive", max_errors=max_errors)
+            task_id = await self.transport.submit(task)
             
             print(OutputFormatter.color_block("[TASK QUEUED]", Fore.CYAN),
                   f"Task ID: {task_id}")
@@ -146,10 +590,24 @@ class CLI:
         except ValueError:
             print(OutputFormatter.color_block(
                 "Corpus ID must be an integer.", Fore.RED))
+        except Overloaded as e:
+            print(OutputFormatter.color_block("[BUSY]", Fore.YELLOW),
+                  f"{e.reason}, retry in {e.retry_after} s")
+        except RuntimeError as e:
+            print(OutputFormatter.color_block("[ERROR]", Fore.RED), e)
 
     async def _handle_status(self) -> None:
-        task_id = input("Enter Task ID: ").strip()
-        await self.task_manager.poll_status(task_id)
+        task_id = (await asyncio.to_thread(input, "Enter Task ID: ")).strip()
+        meta = await self.transport.wait(task_id, on_progress=self.task_manager._handle_progress)
+        self.task_manager.show_result(task_id, meta)
+
+    async def _handle_cancel(self) -> None:
+        task_id = (await asyncio.to_thread(input, "Enter Task ID: ")).strip()
+        if await self.transport.cancel(task_id):
+            print(OutputFormatter.color_block("[CANCELLED]", Fore.YELLOW), f"Task ID: {task_id}")
+        else:
+            print(OutputFormatter.color_block("[NOT CANCELLED]", Fore.YELLOW),
+                  "Task is finished or still awaited by other clients.")
 
     @staticmethod
     def parse_file(file_path: str) -> List[Dict]:
@@ -161,21 +619,31 @@ class CLI:
             logger.error(f"Error reading tasks file: {e}")
             return []
 
-    async def run_task_sequence(self, tasks: List[Dict]) -> None:
-        for task_data in tasks:
-            try:
-                task = TaskConfig(**task_data)
-                task_id = self.celery_client.send_task(task)
-                print(OutputFormatter.color_block("[TASK STARTED]", Fore.CYAN),
-                      f"Task ID: {task_id}")
-                await self.task_manager.poll_status(task_id)
-            except Exception as e:
-                logger.error(f"Error processing task: {e}")
+    async def run_script(self, tasks: List[Dict], concurrency: int, output_path: str) -> None:
+        runner = ScriptRunner(self.transport, concurrency, output_path)
+        print(OutputFormatter.color_block("[SCRIPT]", Fore.CYAN),
+              f"{len(tasks)} tasks, concurrency {runner.concurrency}, results -> {output_path}")
+        try:
+            summary = await runner.run(tasks)
+        finally:
+            await self.transport.close()
+        print(OutputFormatter.color_block("[SUMMARY]", Fore.GREEN))
+        print(OutputFormatter.format_json(summary))
 
 def main() -> NoReturn:
     parser = argparse.ArgumentParser(
-        description="CLI Client for Fuzzy Search (Celery-based)")
+        description="CLI Client for Fuzzy Search")
     parser.add_argument("--script", help="Path to .jsonl file with search tasks")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY,
+                        help="Maximum number of script tasks in flight")
+    parser.add_argument("--output", default="results.ndjson",
+                        help="NDJSON file for script results, in completion order")
+    parser.add_argument("--transport", choices=["celery", "ws"], default="celery",
+                        help="celery: talk to Redis directly; ws: one multiplexed /ws connection")
+    parser.add_argument("--ws-format", choices=["json", "msgpack"], default="json",
+                        help="Frame format requested from /ws (ws transport)")
+    parser.add_argument("--no-ws-compression", action="store_true",
+                        help="Do not offer permessage-deflate (ws transport)")
     args = parser.parse_args()
 
     print("Enter your credentials to authenticate:")
@@ -187,10 +655,15 @@ def main() -> NoReturn:
         print(OutputFormatter.color_block(
             "Authenticated successfully.", Fore.GREEN))
         
-        cli = CLI()
+        if args.transport == "ws":
+            transport = WebSocketTransport(token, ws_format=args.ws_format,
+                                           compression=not args.no_ws_compression)
+        else:
+            transport = CeleryTransport()
+        cli = CLI(transport)
         if args.script:
             tasks = cli.parse_file(args.script)
-            asyncio.run(cli.run_task_sequence(tasks))
+            asyncio.run(cli.run_script(tasks, args.concurrency, args.output))
         else:
             print(OutputFormatter.color_block(
                 "\nNo script provided. Entering interactive mode.",
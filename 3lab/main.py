@@ -1,17 +1,26 @@
+import asyncio
 from typing import NoReturn
 import warnings
 from contextlib import suppress
 
+from app.core.startup import FirstRequestMiddleware, StartupTimer, logger
+
+timer = StartupTimer()
+
 # Suppress deprecation and user warnings
 with suppress(Exception):
     warnings.filterwarnings("ignore", category=DeprecationWarning)
     warnings.filterwarnings("ignore", category=UserWarning)
 
-from fastapi import FastAPI
-import uvicorn
+with timer.measure("fastapi"):
+    from fastapi import FastAPI, Request
+    from fastapi.responses import JSONResponse
 
-from app.api import auth, fuzzy, ws, async_fuzzy
-from app.db.database import create_tables
+from app.core.responses import add_compression
+from app.core.tracing import TracingMiddleware
+with timer.measure("app.db.database"):
+    from sqlalchemy.exc import OperationalError
+    from app.db.database import create_tables
 
 app = FastAPI(
     title="Fuzzy Search API",
@@ -19,25 +28,65 @@ app = FastAPI(
     version="1.0.0"
 )
 
+add_compression(app)
+app.add_middleware(FirstRequestMiddleware, timer=timer)
+app.add_middleware(TracingMiddleware)
+
 # Register routers
+auth = timer.import_module("app.api.auth")
+fuzzy = timer.import_module("app.api.fuzzy")
+ws = timer.import_module("app.api.ws")
+async_fuzzy = timer.import_module("app.api.async_fuzzy")
+health = timer.import_module("app.api.health")
+
 app.include_router(auth.router, prefix="/auth", tags=["auth"])
 app.include_router(fuzzy.router, prefix="/fuzzy", tags=["fuzzy"])
 app.include_router(ws.router)
 app.include_router(async_fuzzy.router, prefix="/fuzzy", tags=["fuzzy-async"])
+app.include_router(health.router, tags=["health"])
+
+@app.exception_handler(OperationalError)
+async def database_busy_handler(request: Request, exc: OperationalError) -> JSONResponse:
+    """SQLite stayed locked longer than SQLITE_BUSY_TIMEOUT: ask the client to retry."""
+    if "locked" not in str(exc.orig):
+        raise exc
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Database is busy, retry later"},
+        headers={"Retry-After": "1"}
+    )
 
 @app.on_event("startup")
 async def startup_event() -> None:
-    """Initialize database tables on application startup."""
-    create_tables()
+    """Initialize database tables on application startup unless migrations manage them."""
+    with timer.measure("create_tables"):
+        create_tables()
+    from app import server
+    from app.services import index_builds
+
+    # устаревшие индексы ставятся в очередь один раз на запуск, в фоне: старт их не ждёт
+    if index_builds.INDEX_BUILD_ON_STARTUP and server.worker_index in (None, 0):
+        asyncio.get_running_loop().run_in_executor(None, schedule_stale_indexes)
+    timer.mark_ready()
+
+def schedule_stale_indexes() -> None:
+    from app.services import index_builds
+
+    try:
+        queued = index_builds.schedule_stale()
+    except Exception:
+        logger.exception("Startup: index builds not scheduled")
+        return
+    logger.info(f"Startup: {queued} corpus index builds queued")
 
 def start_server() -> NoReturn:
-    """Start the uvicorn server with the FastAPI application."""
-    uvicorn.run(
-        "main:app",
-        host="127.0.0.1",
-        port=8000,
-        reload=False,
-        log_level="info"
+    """Start the API with SERVER_WORKERS pre-forked uvicorn workers (see app/server.py)."""
+    from app.server import serve
+
+    serve(
+        app,
+        log_level="info",
+        ws_per_message_deflate=ws.WS_PER_MESSAGE_DEFLATE
     )
 
 if __name__ == "__main__":
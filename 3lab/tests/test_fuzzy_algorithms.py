@@ -0,0 +1,50 @@
+import random
+import unittest
+
+from app.services import fuzzy_algorithms
+
+
+def split(text: str, rng: random.Random):
+    """`text` cut at a few random places; empty chunks included."""
+    cuts = sorted(rng.sample(range(len(text) + 1), min(len(text) + 1, rng.randint(1, 12))))
+    return [text[a:b] for a, b in zip([0] + cuts, cuts + [len(text)])]
+
+
+class SearchTextChunksTest(unittest.TestCase):
+    """A text given in chunks is searched exactly as the same text in one piece."""
+
+    def assert_same_as_whole(self, word, chunks, max_errors):
+        whole = fuzzy_algorithms.search_text(word, ["".join(chunks)], max_errors, limit=10 ** 6)
+        chunked = fuzzy_algorithms.search_text(word, chunks, max_errors, limit=10 ** 6)
+        self.assertEqual(chunked["results"], whole["results"], (word, chunks, max_errors))
+
+    def test_match_across_boundary_reported_once(self):
+        result = fuzzy_algorithms.search_text("hello", ["xxhell", "o world"], 1)
+        self.assertEqual(result["results"], [{"word": "hello", "distance": 0, "start": 2, "end": 7}])
+
+    def test_random_splits(self):
+        rng = random.Random(1)
+        for _ in range(500):
+            alphabet = rng.choice(["ab", "abcd", "abcdefghij", "привет мир"])
+            word = "".join(rng.choices(alphabet, k=rng.randint(2, 8)))
+            max_errors = rng.randint(0, fuzzy_algorithms.max_errors_limit(word))
+            text = "".join(rng.choices(alphabet, k=rng.choice([30, 300, 1000])))
+            middle = len(text) // 2
+            text = text[:middle] + word + text[middle:]
+            self.assert_same_as_whole(word, split(text, rng), max_errors)
+
+    def test_prefilter_matches_full_scan(self):
+        rng = random.Random(2)
+        text = " ".join("".join(rng.choices("abcdefghij", k=rng.randint(3, 10))) for _ in range(1000))
+        for word in ("abcdefgh", "jihgfedc", "badcfehg"):
+            for max_errors in range(fuzzy_algorithms.max_errors_limit(word) + 1):
+                scan = sorted(
+                    fuzzy_algorithms.bitap_matches(word, text, max_errors),
+                    key=lambda x: (x["distance"], x["start"])
+                )
+                filtered = fuzzy_algorithms.search_text(word, split(text, rng), max_errors, limit=10 ** 6)
+                self.assertEqual(filtered["results"], scan, (word, max_errors))
+
+
+if __name__ == "__main__":
+    unittest.main()
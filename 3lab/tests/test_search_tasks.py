@@ -0,0 +1,180 @@
+import os
+import unittest
+from unittest import mock
+
+from celery import Celery
+from celery.app.task import Context
+
+from app import routing
+from app.services import admission, search_tasks
+
+try:
+    import fakeredis
+except ImportError:  # the tests need a Redis double; without it they are skipped
+    fakeredis = None
+
+
+@unittest.skipIf(fakeredis is None, "fakeredis is not installed")
+class SearchTasksTestCase(unittest.TestCase):
+    """search_tasks and admission over a fake Redis result backend and a broker that records sends."""
+
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis()
+        self.celery = Celery("tests", broker="memory://", backend="cache+memory://")
+        self.sent = []
+        self.celery.send_task = lambda name, **options: self.sent.append((name, options))
+        self.depths = {}
+        patches = [
+            mock.patch.object(search_tasks, "_redis", lambda celery: self.redis),
+            mock.patch.object(
+                search_tasks, "_cost_and_priority", lambda corpus_id, word, priority: (10, "interactive")
+            ),
+            mock.patch.object(admission, "queue_depth", lambda celery, queue: self.depths.get(queue, 0)),
+            mock.patch.object(self.celery.control, "revoke"),
+        ]
+        for patcher in patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def submit(self, submitter: str, user: str, word: str = "python") -> search_tasks.Submission:
+        return search_tasks.submit_search(
+            self.celery, word, "levenshtein", 1, submitter=submitter, user=user
+        )
+
+    def admitted(self, queue: str, user: str) -> tuple:
+        """(searches queued in `queue`, searches in flight for `user`) as admission control sees them."""
+        return (
+            self.redis.zcard(admission.QUEUED_PREFIX + queue),
+            self.redis.zcard(admission.USER_PREFIX + user)
+        )
+
+
+QUEUE = routing.queue_for_corpus(1, "interactive")
+
+
+class AdmissionTest(SearchTasksTestCase):
+    def test_record_and_withdraw(self):
+        parts = [("part-1", QUEUE, 10), ("part-2", QUEUE, 30)]
+        admission.record(self.celery, "task-1", parts, "user:1")
+        self.assertEqual(self.admitted(QUEUE, "user:1"), (2, 1))
+        self.assertEqual(admission._queued_work(self.redis, QUEUE), (2, 40))
+
+        admission.withdraw(self.celery, "task-1", parts)
+        self.assertEqual(self.admitted(QUEUE, "user:1"), (0, 0))
+        self.assertIsNone(self.redis.get(admission.OWNER_PREFIX + "task-1"))
+
+    def test_full_queue_is_rejected(self):
+        self.depths[QUEUE] = admission.ADMISSION_MAX_QUEUE_DEPTH
+        with self.assertRaises(admission.Overloaded) as caught:
+            admission.check(self.celery, [(QUEUE, 10)], "user:1")
+        self.assertGreaterEqual(caught.exception.retry_after, 1)
+
+    def test_user_limit_rejects_new_search_but_not_a_duplicate(self):
+        with mock.patch.object(admission, "ADMISSION_USER_INFLIGHT", 1):
+            first = self.submit("ws:1", "user:1")
+            with self.assertRaises(admission.Overloaded):
+                self.submit("ws:1", "user:1", word="java")
+            # отклонённый поиск не держит in-flight ключ
+            self.assertIsNone(self.redis.get(search_tasks.inflight_key(1, "java", "levenshtein")))
+            # такой же поиск, как уже идущий, работы не добавляет и принимается
+            self.assertEqual(self.submit("ws:2", "user:1"), (first.task_id, True))
+        self.assertEqual(len(self.sent), 1)
+
+
+class CoalesceTest(SearchTasksTestCase):
+    def test_identical_search_joins_the_running_task(self):
+        first = self.submit("ws:1", "user:1")
+        second = self.submit("ws:2", "user:2")
+
+        self.assertEqual(first, (first.task_id, False))
+        self.assertEqual(second, (first.task_id, True))
+        self.assertEqual(len(self.sent), 1)
+        self.assertEqual(self.admitted(QUEUE, "user:1"), (1, 1))
+        self.assertEqual(self.admitted(QUEUE, "user:2"), (1, 0))
+        # присоединившийся пользователь тоже владелец: его новое соединение может подписаться
+        self.assertTrue(search_tasks.add_submitter(self.celery, first.task_id, "ws:3", "user:2"))
+
+    def test_publish_failure_abandons_the_search(self):
+        def fail(name, **options):
+            raise ConnectionError("broker is down")
+
+        self.celery.send_task = fail
+        with self.assertRaises(ConnectionError):
+            self.submit("ws:1", "user:1")
+        # ни in-flight ключа, ни учёта в admission, ни отправителей не осталось
+        self.assertEqual(self.redis.keys("fuzzy:*"), [])
+
+        self.celery.send_task = lambda name, **options: self.sent.append((name, options))
+        self.assertFalse(self.submit("ws:1", "user:1").coalesced)
+        self.assertEqual(len(self.sent), 1)
+
+
+class CancelTest(SearchTasksTestCase):
+    def test_foreign_subscriber_cannot_block_or_cancel(self):
+        task_id = self.submit("ws:owner", "user:1").task_id
+
+        # подписка чужого соединения не делает его отправителем
+        self.assertFalse(search_tasks.add_submitter(self.celery, task_id, "ws:stranger", "user:2"))
+        self.assertFalse(search_tasks.cancel_search(self.celery, task_id, "ws:stranger"))
+        self.assertFalse(search_tasks.is_cancelled(self.celery, task_id))
+
+        self.assertTrue(search_tasks.cancel_search(self.celery, task_id, "ws:owner"))
+        self.assertTrue(search_tasks.is_cancelled(self.celery, task_id))
+
+    def test_owner_connection_keeps_task_alive(self):
+        task_id = self.submit("ws:old", "user:1").task_id
+        self.assertTrue(search_tasks.add_submitter(self.celery, task_id, "ws:new", "user:1"))
+
+        # старое соединение закрылось, новое всё ещё ждёт задачу
+        self.assertFalse(search_tasks.cancel_search(self.celery, task_id, "ws:old"))
+        self.assertTrue(search_tasks.cancel_search(self.celery, task_id, "ws:new"))
+
+    def test_cancel_without_submitter_is_refused(self):
+        task_id = self.submit("ws:owner", "user:1").task_id
+        self.assertFalse(search_tasks.cancel_search(self.celery, task_id, None))
+        self.redis.delete(search_tasks.SUBMITTERS_PREFIX + task_id)
+        self.assertFalse(search_tasks.cancel_search(self.celery, task_id, "ws:owner"))
+
+
+class ChordErrbackTest(SearchTasksTestCase):
+    def test_failed_chord_releases_the_search(self):
+        # celery_worker создаёт движок БД при импорте; сама база тесту не нужна
+        os.environ.setdefault("DATABASE_URL", "sqlite://")
+        from app.celery_worker import release_failed_search
+
+        with mock.patch("celery.canvas.chord.apply_async") as apply_async:
+            submission = search_tasks.submit_multi_search(
+                self.celery, "python", "levenshtein", [1, 2], submitter="ws:1", user="user:1"
+            )
+        # chord(header)(body) публикует через chord.apply_async((), {"body": body})
+        body = apply_async.call_args.args[1]["body"]
+        key = body.kwargs["inflight_key"]
+        self.assertEqual(self.redis.get(key).decode(), submission.task_id)
+        self.assertEqual([errback.task for errback in body.options["link_error"]], ["release_failed_search"])
+
+        # так Celery вызывает errback тела chord, когда часть упала или истекла в очереди
+        release_failed_search(Context(id=submission.task_id, kwargs=body.kwargs), RuntimeError("part failed"), None)
+        self.assertIsNone(self.redis.get(key))
+        self.assertEqual(self.redis.zcard(admission.USER_PREFIX + "user:1"), 0)
+        with mock.patch("celery.canvas.chord.apply_async"):
+            again = search_tasks.submit_multi_search(
+                self.celery, "python", "levenshtein", [1, 2], submitter="ws:1", user="user:1"
+            )
+        self.assertFalse(again.coalesced)
+
+
+class ReleaseInflightTest(SearchTasksTestCase):
+    def test_releases_only_own_key(self):
+        key = search_tasks.inflight_key(1, "python", "levenshtein")
+        self.redis.set(key, "task-new")
+
+        # ключ уже занят следующей задачей: завершившаяся его не трогает
+        search_tasks.release_inflight(self.celery, key, "task-old")
+        self.assertEqual(self.redis.get(key), b"task-new")
+
+        search_tasks.release_inflight(self.celery, key, "task-new")
+        self.assertIsNone(self.redis.get(key))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -8,16 +8,20 @@ import models
 import schemas
 import database
 from database import engine, get_db
+from responses import ORJSONResponse, add_compression
 
 # Создаем таблицы в базе данных
 models.Base.metadata.create_all(bind=engine)
 
 app = FastAPI()
+add_compression(app)
 
 @app.get("/authors", response_model=List[schemas.Author])
 def get_authors(db: Session = Depends(get_db)):
     """Получение списка всех авторов"""
-    return db.query(models.Author).all()
+    # Берём только нужные колонки и отдаём их без повторной валидации схемой
+    rows = db.query(models.Author.id, models.Author.name)
+    return ORJSONResponse([{"id": row.id, "name": row.name} for row in rows])
 
 @app.post("/authors", response_model=schemas.Author, status_code=201)
 def create_author(author: schemas.AuthorCreate, db: Session = Depends(get_db)):
@@ -64,10 +68,13 @@ def delete_author(author_id: int, db: Session = Depends(get_db)):
 @app.get("/books", response_model=List[schemas.Book])
 def get_books(author_id: Optional[int] = None, db: Session = Depends(get_db)):
     """Получение списка книг с опциональной фильтрацией по автору"""
-    query = db.query(models.Book)
+    query = db.query(models.Book.id, models.Book.title, models.Book.year, models.Book.author_id)
     if author_id is not None:
         query = query.filter(models.Book.author_id == author_id)
-    return query.all()
+    return ORJSONResponse([
+        {"id": row.id, "title": row.title, "year": row.year, "author_id": row.author_id}
+        for row in query
+    ])
 
 @app.post("/books", response_model=schemas.Book, status_code=201)
 async def create_book(book: schemas.BookCreate, db: Session = Depends(get_db)):
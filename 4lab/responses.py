@@ -0,0 +1,35 @@
+import os
+from typing import Any
+
+from fastapi import FastAPI
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # без orjson используется стандартный json
+    orjson = None
+
+# Ответы меньше этого размера (в байтах) не сжимаются
+RESPONSE_COMPRESS_MIN_SIZE = int(os.getenv("RESPONSE_COMPRESS_MIN_SIZE", "1024"))
+
+
+class ORJSONResponse(JSONResponse):
+    """JSON-ответ, сериализуемый через orjson"""
+
+    def render(self, content: Any) -> bytes:
+        if orjson is None:
+            return super().render(content)
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+
+
+def add_compression(app: FastAPI) -> None:
+    """Сжатие больших ответов: brotli, если установлен brotli-asgi, иначе gzip"""
+    try:
+        from brotli_asgi import BrotliMiddleware
+    except ImportError:
+        app.add_middleware(GZipMiddleware, minimum_size=RESPONSE_COMPRESS_MIN_SIZE)
+    else:
+        app.add_middleware(
+            BrotliMiddleware, minimum_size=RESPONSE_COMPRESS_MIN_SIZE, gzip_fallback=True
+        )